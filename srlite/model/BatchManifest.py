@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import json
+import time
+import socket
+import hashlib
+import threading
+
+# -----------------------------------------------------------------------------
+# class BatchManifest
+#
+# This class is a persistent record of the state of each scene of a batch
+# (running, completed, failed, skipped), with the fingerprints (size and
+# mtime) of its inputs and output and the hash of the parameters that shape
+# the output.  A resumed batch only redoes scenes that are not completed or
+# whose inputs, output or parameters changed since they were completed.
+#
+# The manifest is a directory of JSON-lines files, one per process, so that
+# workers on any number of nodes append to their own file and never lock a
+# shared database (SQLite locking is unreliable on GPFS/NFS).  Events are
+# folded in time order when the manifest is read.
+# -----------------------------------------------------------------------------
+class BatchManifest(object):
+
+    STATE_RUNNING = 'running'
+    STATE_COMPLETED = 'completed'
+    STATE_FAILED = 'failed'
+    STATE_SKIPPED = 'skipped'
+
+    SUFFIX = '.jsonl'
+
+    # Prefetch threads share the file of their process
+    _lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    # __init__
+    # -------------------------------------------------------------------------
+    def __init__(self, manifest_dir, owner=None):
+        """
+        :param manifest_dir: manifest directory (created if needed)
+        :param owner: name of the file of this process (default host-pid)
+        """
+        self.manifest_dir = str(manifest_dir)
+        self.owner = owner or '{}-{}'.format(socket.gethostname(), os.getpid())
+        os.makedirs(self.manifest_dir, exist_ok=True)
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def getParameterHash(context, keys):
+        # Hash of the context values that shape the output of a scene
+        values = [[key, str(context.get(key))] for key in keys]
+        return hashlib.sha1(json.dumps(values).encode()).hexdigest()
+
+    @staticmethod
+    def getFingerprint(fn_list):
+        # {path: [size, mtime_ns]} of each input (None if it does not exist)
+        fingerprint = {}
+        for fn in fn_list:
+            try:
+                st = os.stat(str(fn))
+                fingerprint[str(fn)] = [st.st_size, st.st_mtime_ns]
+            except OSError:
+                fingerprint[str(fn)] = None
+        return fingerprint
+
+    # -------------------------------------------------------------------------
+    # start()
+    #
+    # Mark a scene as running (a crash leaves it running, hence redone on resume)
+    # -------------------------------------------------------------------------
+    def start(self, toa_fn, scene, params, fn_list):
+        self._append({'toa': str(toa_fn), 'scene': scene, 'state': self.STATE_RUNNING, 'params': params,
+                      'inputs': self.getFingerprint(fn_list), 'cog': None, 'cog_size': None,
+                      'cog_mtime_ns': None, 'updated': time.time(), 'error': None, 'summary': None})
+
+    # -------------------------------------------------------------------------
+    # record()
+    #
+    # Record the outcome of a scene from its summary
+    # -------------------------------------------------------------------------
+    def record(self, summary, cog_fn=None):
+        state = summary['status']
+        event = {'toa': str(summary['toa']), 'scene': summary.get('scene'), 'state': state,
+                 'updated': time.time(), 'error': summary.get('error'), 'summary': summary,
+                 'cog': None, 'cog_size': None, 'cog_mtime_ns': None}
+        if (state == self.STATE_COMPLETED) and (cog_fn is not None):
+            st = os.stat(str(cog_fn))
+            event.update({'cog': str(cog_fn), 'cog_size': st.st_size, 'cog_mtime_ns': st.st_mtime_ns})
+        self._append(event)
+
+    def get(self, toa_fn):
+        return self._load().get(str(toa_fn))
+
+    # -------------------------------------------------------------------------
+    # getPending()
+    #
+    # Scenes of toaList that are not completed with the current inputs, output
+    # and parameters
+    # -------------------------------------------------------------------------
+    def getPending(self, toaList, params):
+        rows = self._load()
+        return [toa_fn for toa_fn in toaList if not self._isCurrent(rows.get(str(toa_fn)), params)]
+
+    def getCounts(self):
+        counts = {}
+        for row in self._load().values():
+            counts[row['state']] = counts.get(row['state'], 0) + 1
+        return counts
+
+    def _isCurrent(self, row, params):
+        if (row is None) or (row['state'] != self.STATE_COMPLETED) or (row.get('params') != params) \
+                or (row.get('cog') is None):
+            return False
+        inputs = row.get('inputs') or {}
+        if (len(inputs) == 0) or (self.getFingerprint(inputs) != inputs):
+            return False
+        return self.getFingerprint([row['cog']])[row['cog']] == [row['cog_size'], row['cog_mtime_ns']]
+
+    # -------------------------------------------------------------------------
+    # _load()
+    #
+    # State of each scene - the events of all files folded in time order
+    # -------------------------------------------------------------------------
+    def _load(self):
+        events = []
+        with os.scandir(self.manifest_dir) as entries:
+            paths = sorted(entry.path for entry in entries if entry.name.endswith(self.SUFFIX))
+        for path in paths:
+            with open(path) as manifestFile:
+                for line in manifestFile:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        # Line cut short by a crash
+                        continue
+
+        rows = {}
+        for event in sorted(events, key=lambda event: event['updated']):
+            row = rows.get(event['toa'])
+            if (row is None):
+                rows[event['toa']] = dict(event)
+            elif (event['state'] != self.STATE_SKIPPED):
+                # A skipped scene's output predates the run - keep what is known about it
+                row.update(event)
+        return rows
+
+    def _append(self, event):
+        # One write per event, to the file of this process only
+        line = json.dumps(event) + '\n'
+        with self._lock:
+            with open(os.path.join(self.manifest_dir, self.owner + self.SUFFIX), 'a') as manifestFile:
+                manifestFile.write(line)
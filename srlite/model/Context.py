@@ -5,6 +5,8 @@ import sys
 import argparse  # system libraries
 from datetime import datetime
 from srlite.model.PlotLib import PlotLib
+from srlite.model.ShardPlanner import ShardPlanner
+from srlite.model.BatchManifest import BatchManifest
 from pathlib import Path
 import csv
 # -----------------------------------------------------------------------------
@@ -23,6 +25,10 @@ class Context(object):
     DIR_CLOUDMASK = 'dir_cloudmask'
     DIR_OUTPUT = 'dir_out'
     DIR_OUTPUT_CSV = 'dir_out_cvs'
+    DIR_WARP = 'dir_warp'
+
+    # Raster metadata catalog (SQLite)
+    FN_CATALOG = 'fn_catalog'
 
     # File names
     FN_DEST = 'fn_dest'
@@ -39,6 +45,7 @@ class Context(object):
     MA_WARP_VALID_LIST = 'ma_warp_valid_list'
     MA_WARP_MASKED_LIST = 'ma_warp_masked_list'
     PRED_LIST = 'pred_list'
+    MODEL_LIST = 'model_list'
     COMMON_MASK = 'comman_mask'
 
     FN_TOA = 'fn_toa'
@@ -138,11 +145,100 @@ class Context(object):
     # Cloud mask flag
     CLOUD_MASK_FLAG = 'cloud_mask_flag'
 
+    # Cloud fraction of each 30m cell (cells above the threshold are masked)
+    CLOUD_FRACTION_THRESHOLD = 'cloud_fraction_threshold'
+    MA_CLOUD_FRACTION = 'ma_cloud_fraction'
+    CLOUDMASK_CLOUD_VALUE = 1
+    DEFAULT_CLOUD_FRACTION_THRESHOLD = 0.5
+
+    # Bit-packed band-independent masks of a scene (MaskEngine)
+    MASK_ENGINE = 'mask_engine'
+
     # Threshold flag
     THRESHOLD_MASK_FLAG = 'threshold_mask_flag'
     THRESHOLD_MIN = 'threshold_min'
     THRESHOLD_MAX = 'threshold_max'
 
+    # Warp cache
+    WARP_CACHE_FLAG = 'warp_cache_flag'
+    WARP_CACHE_SIZE = 'warp_cache_size'
+    WARP_CACHE_HASH_FLAG = 'warp_cache_hash_flag'
+    WARP_CACHE_STATUS = 'warp_cache_status'
+
+    # Resampling path taken for each reprojected input (none, window, reduce or warp)
+    GRID_PLAN_LIST = 'grid_plan_list'
+    DEFAULT_WARP_CACHE_SIZE = 100
+
+    # Batched fit of all band pairs
+    BATCH_FIT_FLAG = 'batch_fit_flag'
+
+    # Streaming apply (GDAL computes predictions block by block from a VRT)
+    STREAM_FLAG = 'stream_flag'
+    WINDOW_SIZE = 'window_size'
+    DEFAULT_WINDOW_SIZE = 1024
+
+    # Batch execution (process pool)
+    WORKERS = 'workers'
+    MAX_TASKS_PER_WORKER = 'max_tasks_per_worker'
+    DEFAULT_WORKERS = 1
+    DEFAULT_MAX_TASKS_PER_WORKER = 10
+
+    # Scenes validated, opened and warped ahead of the scene being computed
+    PREFETCH = 'prefetch'
+    DEFAULT_PREFETCH = 0
+
+    # Threads within a scene (apply and COG write)
+    THREADS = 'threads'
+    DEFAULT_THREADS = 1
+    FN_SUMMARY_SUFFIX = '_SRLite_summary.json'
+
+    # Static sharding of a batch across the tasks of a job array ('i/N' or 'slurm')
+    SHARD = 'shard'
+    SHARD_INDEX = 'shard_index'
+    SHARD_COUNT = 'shard_count'
+
+    # Dynamic scene queue on a shared filesystem (see WorkQueue)
+    QUEUE_DIR = 'queue_dir'
+    QUEUE_TIMEOUT = 'queue_timeout'
+    DEFAULT_QUEUE_TIMEOUT = 600
+
+    # Batch manifest (JSON-lines directory) of scene states, and resumption of incomplete batches
+    FN_MANIFEST = 'fn_manifest'
+    FN_MANIFEST_SUFFIX = '_SRLite_manifest'
+    RESUME_FLAG = 'resume_flag'
+    PARAMETER_HASH = 'parameter_hash'
+
+    # Order of the scenes of a batch (see SceneScheduler)
+    SCHEDULE = 'schedule'
+    SCHEDULE_SORTED = 'sorted'
+    SCHEDULE_COST = 'cost'
+    DEFAULT_SCHEDULE = SCHEDULE_SORTED
+
+    # Stage profiling
+    PROFILE_FLAG = 'profile_flag'
+    PROFILE_LIST = 'profile_list'
+    FN_PROFILE_EVENTS = 'fn_profile_events'
+    FN_EVENTS_SUFFIX = '_SRLite_events.jsonl'
+
+    # Working precision and output encoding
+    PRECISION = 'precision'
+    PRECISION_FLOAT64 = 'float64'
+    PRECISION_FLOAT32 = 'float32'
+    PRECISION_INT16 = 'int16'
+    DEFAULT_INT16_SCALE = 0.0001
+
+    # Memory budget
+    MAX_MEMORY = 'max_memory'
+    MEMORY_PLAN = 'memory_plan'
+    DIR_SCRATCH = 'dir_scratch'
+
+    # Parameters that shape the output of a scene (a change makes manifest entries stale)
+    OUTPUT_PARAMETERS = (LIST_BAND_PAIRS, TARGET_XRES, TARGET_YRES, TARGET_SAMPLING_METHOD,
+                         FN_TARGET_SUFFIX, FN_CLOUDMASK_SUFFIX, REGRESSION_MODEL,
+                         CLOUD_MASK_FLAG, CLOUD_FRACTION_THRESHOLD, POSITIVE_MASK_FLAG,
+                         QUALITY_MASK_FLAG, LIST_QUALITY_MASK,
+                         THRESHOLD_MASK_FLAG, THRESHOLD_MIN, THRESHOLD_MAX, PRECISION)
+
     # Global instance variables
     context_dict = {}
     plotLib = None
@@ -152,7 +248,14 @@ class Context(object):
     # -------------------------------------------------------------------------
     # __init__
     # -------------------------------------------------------------------------
-    def __init__(self):
+    def __init__(self, context_dict=None):
+
+        # Rehydrate from a serialized context (e.g., in a batch worker process)
+        if context_dict is not None:
+            self.context_dict = dict(context_dict)
+            self.debug_level = int(self.context_dict[Context.DEBUG_LEVEL])
+            self.plot_lib = PlotLib(self.context_dict[Context.DEBUG_LEVEL])
+            return
 
         args = self._getParser()
         # Initialize serializable context for orchestration
@@ -162,6 +265,8 @@ class Context(object):
             self.context_dict[Context.DIR_TARGET] = str(args.target_dir)
             self.context_dict[Context.DIR_CLOUDMASK] = str(args.cloudmask_dir)
             self.context_dict[Context.DIR_OUTPUT] = str(args.out_dir)
+            self.context_dict[Context.DIR_WARP] = str(args.warp_dir)
+            self.context_dict[Context.FN_CATALOG] = str(args.catalog_fn)
 
             self.context_dict[Context.LIST_BAND_PAIRS] = str(args.band_pairs_list)
             self.context_dict[Context.TARGET_XRES] = int(args.target_xres)
@@ -184,6 +289,7 @@ class Context(object):
             # self.context_dict[Context.ALGORITHM_CLASS] = str(args.algorithm)
             self.context_dict[Context.STORAGE_TYPE] = str(args.storage)
             self.context_dict[Context.CLOUD_MASK_FLAG] = str(args.cmaskbool)
+            self.context_dict[Context.CLOUD_FRACTION_THRESHOLD] = float(args.cloud_fraction_threshold)
             self.context_dict[Context.POSITIVE_MASK_FLAG] = str(args.pmaskbool)
             self.context_dict[Context.CSV_FLAG] = str(args.csvbool)
             self.context_dict[Context.QUALITY_MASK_FLAG] = str(args.qfmaskbool)
@@ -194,6 +300,29 @@ class Context(object):
             self.context_dict[Context.THRESHOLD_MIN] = int(threshold_range[0])
             self.context_dict[Context.THRESHOLD_MAX] = int(threshold_range[2])
 
+            self.context_dict[Context.WARP_CACHE_FLAG] = str(args.warpcachebool)
+            self.context_dict[Context.WARP_CACHE_SIZE] = float(args.warp_cache_size)
+            self.context_dict[Context.WARP_CACHE_HASH_FLAG] = str(args.warpcachehashbool)
+            self.context_dict[Context.BATCH_FIT_FLAG] = str(args.batchfitbool)
+            self.context_dict[Context.STREAM_FLAG] = str(args.streambool)
+            self.context_dict[Context.WINDOW_SIZE] = int(args.window_size)
+
+            self.context_dict[Context.WORKERS] = int(args.workers)
+            self.context_dict[Context.MAX_TASKS_PER_WORKER] = int(args.max_tasks_per_worker)
+            self.context_dict[Context.THREADS] = int(args.threads)
+            self.context_dict[Context.PREFETCH] = int(args.prefetch)
+            self.context_dict[Context.SHARD] = str(args.shard)
+            self.context_dict[Context.SHARD_INDEX], self.context_dict[Context.SHARD_COUNT] = \
+                ShardPlanner.parse(args.shard)
+            self.context_dict[Context.QUEUE_DIR] = str(args.queue_dir)
+            self.context_dict[Context.QUEUE_TIMEOUT] = float(args.queue_timeout)
+            self.context_dict[Context.FN_MANIFEST] = str(args.manifest_fn)
+            self.context_dict[Context.RESUME_FLAG] = str(args.resumebool)
+            self.context_dict[Context.SCHEDULE] = str(args.schedule)
+            self.context_dict[Context.PROFILE_FLAG] = str(args.profilebool)
+            self.context_dict[Context.MAX_MEMORY] = float(args.max_memory)
+            self.context_dict[Context.PRECISION] = str(args.precision)
+
         except BaseException as err:
             print('Check arguments: ', err)
             sys.exit(1)
@@ -218,6 +347,7 @@ class Context(object):
         plotLib.trace(f'Storage:    {self.context_dict[Context.STORAGE_TYPE]}')
         if (eval(self.context_dict[Context.CLOUD_MASK_FLAG] )):
             plotLib.trace(f'Cloud Mask:    {self.context_dict[Context.CLOUD_MASK_FLAG]}')
+            plotLib.trace(f'Cloud Fraction Threshold:    {self.context_dict[Context.CLOUD_FRACTION_THRESHOLD]}')
         if (eval(self.context_dict[Context.POSITIVE_MASK_FLAG] )):
             plotLib.trace(f'Positive Pixels Only Flag:    {self.context_dict[Context.POSITIVE_MASK_FLAG]}')
         if (eval(self.context_dict[Context.CSV_FLAG] )):
@@ -235,6 +365,52 @@ class Context(object):
             plotLib.trace(f'Threshold Mask:    {self.context_dict[Context.THRESHOLD_MASK_FLAG]}')
             plotLib.trace(f'Threshold Min:    {self.context_dict[Context.THRESHOLD_MIN]}')
             plotLib.trace(f'Threshold Max:    {self.context_dict[Context.THRESHOLD_MAX]}')
+        if (eval(self.context_dict[Context.WARP_CACHE_FLAG])):
+            plotLib.trace(f'Warp Cache Directory:    {self.context_dict[Context.DIR_WARP]}')
+            plotLib.trace(f'Warp Cache Size (GB):    {self.context_dict[Context.WARP_CACHE_SIZE]}')
+            plotLib.trace(f'Warp Cache Hash Flag:    {self.context_dict[Context.WARP_CACHE_HASH_FLAG]}')
+        if (eval(self.context_dict[Context.BATCH_FIT_FLAG])):
+            plotLib.trace(f'Batch Fit Flag:    {self.context_dict[Context.BATCH_FIT_FLAG]}')
+        if (eval(self.context_dict[Context.STREAM_FLAG])):
+            plotLib.trace(f'Stream Flag:    {self.context_dict[Context.STREAM_FLAG]}')
+            plotLib.trace(f'Window Size:    {self.context_dict[Context.WINDOW_SIZE]}')
+        if (self.context_dict[Context.FN_CATALOG] != 'None'):
+            plotLib.trace(f'Catalog:    {self.context_dict[Context.FN_CATALOG]}')
+        if (eval(self.context_dict[Context.PROFILE_FLAG])):
+            # One event log per batch, shared by all worker processes
+            self.context_dict[Context.FN_PROFILE_EVENTS] = os.path.join(self.context_dict[Context.DIR_OUTPUT],
+                                                                        Context.getBatchName(self.context_dict)
+                                                                        + Context.FN_EVENTS_SUFFIX)
+            plotLib.trace(f'Profile Events:    {self.context_dict[Context.FN_PROFILE_EVENTS]}')
+        if (self.context_dict[Context.PRECISION] != Context.PRECISION_FLOAT64):
+            plotLib.trace(f'Precision:    {self.context_dict[Context.PRECISION]}')
+        if (float(self.context_dict[Context.MAX_MEMORY]) > 0):
+            plotLib.trace(f'Max Memory (GB):    {self.context_dict[Context.MAX_MEMORY]}')
+        if (int(self.context_dict[Context.WORKERS]) > 1):
+            plotLib.trace(f'Workers:    {self.context_dict[Context.WORKERS]}')
+            plotLib.trace(f'Max Scenes per Worker:    {self.context_dict[Context.MAX_TASKS_PER_WORKER]}')
+        if (int(self.context_dict[Context.THREADS]) > 1):
+            plotLib.trace(f'Threads:    {self.context_dict[Context.THREADS]}')
+        if (int(self.context_dict[Context.PREFETCH]) > 0):
+            plotLib.trace(f'Prefetch Depth:    {self.context_dict[Context.PREFETCH]}')
+        if (int(self.context_dict[Context.SHARD_COUNT]) > 1):
+            plotLib.trace(f'Shard:    {self.context_dict[Context.SHARD_INDEX]} of {self.context_dict[Context.SHARD_COUNT]}')
+        # The manifest is only kept when asked for - by --manifest or --resume
+        if (self.context_dict[Context.FN_MANIFEST] == 'None') and (eval(self.context_dict[Context.RESUME_FLAG])):
+            self.context_dict[Context.FN_MANIFEST] = os.path.join(self.context_dict[Context.DIR_OUTPUT],
+                                                                  Context.getBatchName(self.context_dict)
+                                                                  + Context.FN_MANIFEST_SUFFIX)
+        self.context_dict[Context.PARAMETER_HASH] = BatchManifest.getParameterHash(self.context_dict,
+                                                                                   Context.OUTPUT_PARAMETERS)
+        if (self.context_dict[Context.FN_MANIFEST] != 'None'):
+            plotLib.trace(f'Manifest:    {self.context_dict[Context.FN_MANIFEST]}')
+        if (eval(self.context_dict[Context.RESUME_FLAG])):
+            plotLib.trace(f'Resume Flag:    {self.context_dict[Context.RESUME_FLAG]}')
+        if (self.context_dict[Context.SCHEDULE] != Context.DEFAULT_SCHEDULE):
+            plotLib.trace(f'Schedule:    {self.context_dict[Context.SCHEDULE]}')
+        if (self.context_dict[Context.QUEUE_DIR] != 'None'):
+            plotLib.trace(f'Queue Directory:    {self.context_dict[Context.QUEUE_DIR]}')
+            plotLib.trace(f'Queue Timeout (s):    {self.context_dict[Context.QUEUE_TIMEOUT]}')
 
         return
 
@@ -278,6 +454,12 @@ class Context(object):
             "--warp_dir", "--input-warp-dir", type=str, required=False, dest='warp_dir',
             default="./", help="Specify directory path containing warped files."
         )
+        parser.add_argument(
+            "--catalog", "--input-catalog", type=str, required=False, dest='catalog_fn',
+            default=None, help="Specify SQLite raster metadata catalog (created and refreshed as needed by the "
+                               "driver process; read-only on a shared filesystem with --shard or --queue_dir, "
+                               "so use a node-local path there)."
+        )
         parser.add_argument(
             "--xres", "--input-x-resolution", type=str, required=False, dest='target_xres',
             default=Context.DEFAULT_XRES, help="Specify target X resolution (default = 30)."
@@ -340,7 +522,8 @@ class Context(object):
                             dest='storage',
                             default='memory',
                             choices=['memory', 'file'],
-                            help='Choose which storage model to use')
+                            help='Choose which storage model to use (file = warps, predictions and masks in '
+                                 'scratch files under --warp_dir)')
 
         parser.add_argument('--cloudmask',
                             required=False,
@@ -349,6 +532,14 @@ class Context(object):
                             action='store_true',
                             help='Apply cloud mask values to common mask')
 
+        parser.add_argument('--cloudfrac',
+                            required=False,
+                            dest='cloud_fraction_threshold',
+                            default=Context.DEFAULT_CLOUD_FRACTION_THRESHOLD,
+                            type=float,
+                            help='Mask 30m cells whose fraction of cloudy 2m pixels exceeds this value '
+                                 '(default 0.5 = majority, 0 = any cloud)')
+
         parser.add_argument('--qfmask',
                             required=False,
                             dest='qfmaskbool',
@@ -361,7 +552,8 @@ class Context(object):
                             dest='qfmask_list',
                             default='0,3,4',
                             type=str,
-                            help='Choose quality flag values to mask')
+                            help="Choose quality flag values to mask (comma-separated; 'b<N>' masks values "
+                                 "with bit N set, e.g. 'b3,b4' for Landsat QA_PIXEL cloud and shadow)")
 
         parser.add_argument('--thmask',
                             required=False,
@@ -377,6 +569,150 @@ class Context(object):
                             type=str,
                             help='Choose quality flag values to mask')
 
+        parser.add_argument('--warpcache',
+                            required=False,
+                            dest='warpcachebool',
+                            default=False,
+                            action='store_true',
+                            help='Cache warped 30m stacks under --warp_dir and reuse them across runs')
+
+        parser.add_argument('--warpcachesize',
+                            required=False,
+                            dest='warp_cache_size',
+                            default=Context.DEFAULT_WARP_CACHE_SIZE,
+                            type=float,
+                            help='Maximum size of the warp cache in GB (least recently used entries are evicted)')
+
+        parser.add_argument('--warpcachehash',
+                            required=False,
+                            dest='warpcachehashbool',
+                            default=False,
+                            action='store_true',
+                            help='Key the warp cache on input file contents (SHA-1) in addition to size and mtime')
+
+        parser.add_argument('--batchfit',
+                            required=False,
+                            dest='batchfitbool',
+                            default=False,
+                            action='store_true',
+                            help='Fit all band pairs in one vectorized pass over the 30m stacks')
+
+        parser.add_argument('--stream',
+                            required=False,
+                            dest='streambool',
+                            default=False,
+                            action='store_true',
+                            help='Let GDAL apply coefficients to the 2m TOA block by block while writing the COG')
+
+        parser.add_argument('--window',
+                            required=False,
+                            dest='window_size',
+                            default=Context.DEFAULT_WINDOW_SIZE,
+                            type=int,
+                            help='Window size in pixels of streamed and windowed predictions (the block size of '
+                                 'the prediction VRT, and about the pixels per band of each window applied with '
+                                 '--threads or --storage file), rounded to TOA blocks')
+
+        parser.add_argument('--workers',
+                            required=False,
+                            dest='workers',
+                            default=Context.DEFAULT_WORKERS,
+                            type=int,
+                            help='Number of worker processes used to process scenes in parallel')
+
+        parser.add_argument('--maxtasks',
+                            required=False,
+                            dest='max_tasks_per_worker',
+                            default=Context.DEFAULT_MAX_TASKS_PER_WORKER,
+                            type=int,
+                            help='Number of scenes a worker process handles before it is recycled')
+
+        parser.add_argument('--threads',
+                            required=False,
+                            dest='threads',
+                            default=Context.DEFAULT_THREADS,
+                            type=int,
+                            help='Number of threads applying the models to the 2m TOA and writing the COG')
+
+        parser.add_argument('--prefetch',
+                            required=False,
+                            dest='prefetch',
+                            default=Context.DEFAULT_PREFETCH,
+                            type=int,
+                            help='Number of following scenes validated, opened and warped in background threads '
+                                 'while a scene is computed (single-process batches)')
+
+        parser.add_argument('--shard',
+                            required=False,
+                            dest='shard',
+                            default=None,
+                            type=str,
+                            help="Process only shard i of N of the batch ('i/N', 0 <= i < N), or the shard of this "
+                                 "SLURM job-array task ('slurm'); scenes are split deterministically by size")
+
+        parser.add_argument('--queue_dir',
+                            required=False,
+                            dest='queue_dir',
+                            default=None,
+                            type=str,
+                            help='Shared queue directory - every node started with it claims the next pending '
+                                 'scene (largest first) until the batch is drained')
+
+        parser.add_argument('--queue_timeout',
+                            required=False,
+                            dest='queue_timeout',
+                            default=Context.DEFAULT_QUEUE_TIMEOUT,
+                            type=float,
+                            help='Seconds without heartbeat after which a claimed scene is returned to the queue')
+
+        parser.add_argument('--manifest',
+                            required=False,
+                            dest='manifest_fn',
+                            default=None,
+                            type=str,
+                            help='Record scene states in this manifest directory (one JSON-lines file per process; '
+                                 'default <output_dir>/<batch>_SRLite_manifest with --resume)')
+
+        parser.add_argument('--resume',
+                            required=False,
+                            dest='resumebool',
+                            default=False,
+                            action='store_true',
+                            help='Only process scenes that are not completed in the manifest, or whose inputs, '
+                                 'output or parameters changed since - also pass it to the first run of a batch, '
+                                 'since scenes missing from the manifest are redone')
+
+        parser.add_argument('--schedule',
+                            required=False,
+                            dest='schedule',
+                            default=Context.DEFAULT_SCHEDULE,
+                            choices=[Context.SCHEDULE_SORTED, Context.SCHEDULE_COST],
+                            type=str,
+                            help="Order of the scenes: by name ('sorted'), or largest estimated cost first ('cost')")
+
+        parser.add_argument('--profile',
+                            required=False,
+                            dest='profilebool',
+                            default=False,
+                            action='store_true',
+                            help='Record per-stage time, memory, I/O and pixel counts as JSON-lines events')
+
+        parser.add_argument('--max-memory',
+                            required=False,
+                            dest='max_memory',
+                            default=0,
+                            type=float,
+                            help='Memory budget in GB shared by all workers (0 = unlimited); oversized scenes '
+                                 'are streamed or use disk-backed storage')
+
+        parser.add_argument('--precision',
+                            required=False,
+                            dest='precision',
+                            default=Context.PRECISION_FLOAT64,
+                            choices=[Context.PRECISION_FLOAT64, Context.PRECISION_FLOAT32, Context.PRECISION_INT16],
+                            help='Working precision of fits and predictions; int16 also writes SR-Lite as scaled '
+                                 'int16 (scale/offset tags)')
+
         return parser.parse_args()
 
     # -------------------------------------------------------------------------
@@ -403,15 +739,32 @@ class Context(object):
     def getDebugLevel(self):
         return self.debug_level
 
+    # -------------------------------------------------------------------------
+    # getBatchName()
+    #
+    # Name of the batch outputs (summary, events) - tagged with the shard, if any
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def getBatchName(context):
+        batch = str(context[Context.BATCH_NAME])
+        if (batch == 'None'):
+            batch = os.path.basename(os.path.normpath(context[Context.DIR_TOA]))
+        count = int(context.get(Context.SHARD_COUNT, 1))
+        if (count > 1):
+            width = len(str(count - 1))
+            batch += '_shard{}of{}'.format(str(context[Context.SHARD_INDEX]).zfill(width), count)
+        return batch
+
     # -------------------------------------------------------------------------
     # getFileNames()
     #
     # Get input file names
     # -------------------------------------------------------------------------
-    def getFileNames(self, prefix, context):
+    def getFileNames(self, prefix, context, catalog=None):
         """
         :param prefix: core TOA file name (must match core target and cloudmask file name)
         :param context: input context object dictionary
+        :param catalog: optional RasterCatalog used instead of probing the file system
         :return: updated context
         """
  #       context[Context.FN_PREFIX] = "WV02_20200812_M1BS_10300100AB21A400"
@@ -440,13 +793,14 @@ class Context(object):
         context[Context.FN_COG] = os.path.join(context[Context.DIR_OUTPUT] + '/' +
             context[Context.FN_PREFIX] + self.FN_SRLITE_SUFFIX)
 
-        if not (os.path.exists(context[Context.FN_TOA])):
+        exists = os.path.exists if catalog is None else catalog.exists
+        if not (exists(context[Context.FN_TOA])):
             raise FileNotFoundError("TOA File not found: {}".format(context[Context.FN_TOA]))
-        if not (os.path.exists(context[Context.FN_TARGET])):
+        if not (exists(context[Context.FN_TARGET])):
             self.plot_lib.trace("Processing: " + context[Context.FN_TOA])
             raise FileNotFoundError("TARGET File not found: {}".format(context[Context.FN_TARGET]))
         if (eval(self.context_dict[Context.CLOUD_MASK_FLAG] )):
-            if not (os.path.exists(context[Context.FN_CLOUDMASK])):
+            if not (exists(context[Context.FN_CLOUDMASK])):
                 self.plot_lib.trace("Processing: " + context[Context.FN_TOA])
                 raise FileNotFoundError("Cloudmask File not found: {}".format(context[Context.FN_CLOUDMASK]))
 
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# coding: utf-8
+import math
+import numpy as np
+from osgeo import gdal, osr
+
+# -----------------------------------------------------------------------------
+# class GridPlanner
+#
+# This class decides how each input reaches the 30m working grid that
+# pygeotools would warp to (the extent and CRS of the TOA at --target_xres),
+# by comparing geotransforms and CRS:
+#
+#   none   - the input is already on the grid (returned as is)
+#   window - same CRS and resolution, offset by whole pixels (sliced and padded)
+#   reduce - same CRS, resolution an exact integer factor finer and pixel-aligned
+#            (vectorized block reduction with nodata-aware counts)
+#   warp   - anything else (full GDAL warp)
+#
+# Block reductions reproduce the GDAL resampling of the aligned case (integer
+# results may differ by one where the mean is an exact .5 tie, which GDAL
+# rounds either way depending on its floating-point pixel weights).
+# -----------------------------------------------------------------------------
+class GridPlanner(object):
+
+    PATH_NONE = 'none'
+    PATH_WINDOW = 'window'
+    PATH_REDUCE = 'reduce'
+    PATH_WARP = 'warp'
+
+    # Resampling methods with a block reducer (method name -> method of this class)
+    REDUCERS = {'average': '_reduceAverage'}
+
+    # Grids are compared to the nearest mm (as pygeotools does)
+    PRECISION = 1E-3
+    # Destination rows reduced per read, to bound the size of the source strips
+    STRIP_ROWS = 32
+
+    # -------------------------------------------------------------------------
+    # __init__
+    # -------------------------------------------------------------------------
+    def __init__(self, dst_gt, dst_cols, dst_rows, dst_srs, dst_ndv=None):
+        self.dst_gt = tuple(float(value) for value in dst_gt)
+        self.dst_cols = int(dst_cols)
+        self.dst_rows = int(dst_rows)
+        self.dst_srs = dst_srs
+        self.dst_ndv = dst_ndv
+
+    @classmethod
+    def fromDataset(cls, ds, res, dst_ndv=None):
+        """
+        Grid of a pygeotools warp to extent=ds, t_srs=ds at resolution res (None if ds is rotated)
+        """
+        gt = ds.GetGeoTransform()
+        if (gt[2] != 0.0) or (gt[4] != 0.0):
+            return None
+        res = float(res)
+        xmin, xmax = sorted([gt[0], gt[0] + ds.RasterXSize * gt[1]])
+        ymin, ymax = sorted([gt[3], gt[3] + ds.RasterYSize * gt[5]])
+        srs = osr.SpatialReference(wkt=ds.GetProjection())
+        return cls((xmin, res, 0.0, ymax, 0.0, -res),
+                   int(round((xmax - xmin) / res)), int(round((ymax - ymin) / res)), srs, dst_ndv)
+
+    # -------------------------------------------------------------------------
+    # plan()
+    #
+    # Cheapest path from src_ds to the grid for the resampling method
+    # -------------------------------------------------------------------------
+    def plan(self, src_ds, method):
+        """
+        :return: dict with 'path' and, for window/reduce, the integer 'factor' and the
+                 source pixel offsets 'col_off'/'row_off' of the grid origin
+        """
+        plan = {'path': self.PATH_WARP, 'method': method}
+        gt = src_ds.GetGeoTransform()
+        src_srs = osr.SpatialReference(wkt=src_ds.GetProjection())
+        if (gt[2] != 0.0) or (gt[4] != 0.0) or (gt[1] <= 0.0) or (gt[5] >= 0.0):
+            plan['reason'] = 'rotated or flipped geotransform'
+            return plan
+        if not src_srs.IsSame(self.dst_srs):
+            plan['reason'] = 'different CRS'
+            return plan
+
+        precision = 1E-8 if src_srs.IsGeographic() else self.PRECISION
+        factor = int(round(self.dst_gt[1] / gt[1]))
+        if (factor < 1) or (abs(factor * gt[1] - self.dst_gt[1]) > precision) \
+                or (abs(factor * -gt[5] - -self.dst_gt[5]) > precision):
+            plan['reason'] = 'resolution is not an integer factor of the grid'
+            return plan
+
+        col_off = (self.dst_gt[0] - gt[0]) / gt[1]
+        row_off = (self.dst_gt[3] - gt[3]) / gt[5]
+        if (abs(col_off - round(col_off)) * gt[1] > precision) or (abs(row_off - round(row_off)) * -gt[5] > precision):
+            plan['reason'] = 'not pixel-aligned'
+            return plan
+
+        plan.update({'factor': factor, 'col_off': int(round(col_off)), 'row_off': int(round(row_off))})
+        if (factor == 1):
+            if (plan['col_off'] == 0) and (plan['row_off'] == 0) \
+                    and (src_ds.RasterXSize == self.dst_cols) and (src_ds.RasterYSize == self.dst_rows):
+                plan['path'] = self.PATH_NONE
+            else:
+                plan['path'] = self.PATH_WINDOW
+        elif (method in self.REDUCERS):
+            plan['path'] = self.PATH_REDUCE
+        else:
+            plan['path'] = self.PATH_WARP
+            plan['reason'] = f'no block reducer for {method}'
+        return plan
+
+    # -------------------------------------------------------------------------
+    # apply()
+    #
+    # Dataset of src_ds on the grid for a 'none', 'window' or 'reduce' plan
+    # -------------------------------------------------------------------------
+    def apply(self, src_ds, plan):
+        if (plan['path'] == self.PATH_NONE):
+            return src_ds
+
+        dst_ds = self.createDataset(src_ds.RasterCount, src_ds.GetRasterBand(1).DataType, src_ds.GetDescription())
+
+        for index in range(1, src_ds.RasterCount + 1):
+            src_band = src_ds.GetRasterBand(index)
+            src_ndv = src_band.GetNoDataValue()
+            dst_ndv = src_ndv if self.dst_ndv is None else self.dst_ndv
+            dst_band = dst_ds.GetRasterBand(index)
+            if (dst_ndv is not None):
+                dst_band.SetNoDataValue(dst_ndv)
+            fill = 0 if dst_ndv is None else dst_ndv
+            for dst_row in range(0, self.dst_rows, self.STRIP_ROWS):
+                strip_rows = min(self.STRIP_ROWS, self.dst_rows - dst_row)
+                values, valid = self._readStrip(src_band, src_ndv, plan, dst_row, strip_rows)
+                if (plan['path'] == self.PATH_WINDOW):
+                    strip = np.where(valid, values, fill).astype(values.dtype, copy=False)
+                else:
+                    strip = getattr(self, self.REDUCERS[plan['method']])(values, valid, plan['factor'],
+                                                                         np.dtype(values.dtype), dst_ndv)
+                dst_band.WriteArray(strip, 0, dst_row)
+            dst_band = None
+        return dst_ds
+
+    def createDataset(self, band_count, data_type, description=''):
+        # Empty MEM dataset on the grid
+        dst_ds = gdal.GetDriverByName('MEM').Create('', self.dst_cols, self.dst_rows, band_count, data_type)
+        dst_ds.SetProjection(self.dst_srs.ExportToWkt())
+        dst_ds.SetGeoTransform(self.dst_gt)
+        dst_ds.SetDescription(description)
+        return dst_ds
+
+    # -------------------------------------------------------------------------
+    # countCategory()
+    #
+    # Categorical downsampling for a 'none', 'window' or 'reduce' plan: number of
+    # source pixels equal to value, and of valid source pixels, in each grid cell
+    # -------------------------------------------------------------------------
+    def countCategory(self, src_ds, plan, value, band=1):
+        """
+        :return: (value count, valid count) int32 arrays of the grid shape
+        """
+        src_band = src_ds.GetRasterBand(band)
+        src_ndv = src_band.GetNoDataValue()
+        factor = plan['factor']
+        value_count = np.zeros((self.dst_rows, self.dst_cols), dtype=np.int32)
+        valid_count = np.zeros((self.dst_rows, self.dst_cols), dtype=np.int32)
+        for dst_row in range(0, self.dst_rows, self.STRIP_ROWS):
+            strip_rows = min(self.STRIP_ROWS, self.dst_rows - dst_row)
+            # The strip keeps the source type (e.g., uint8 for cloud masks)
+            values, valid = self._readStrip(src_band, src_ndv, plan, dst_row, strip_rows)
+            rows = slice(dst_row, dst_row + strip_rows)
+            value_count[rows] = self._getBlocks(valid & (values == value), factor).sum(axis=(1, 3))
+            valid_count[rows] = self._getBlocks(valid, factor).sum(axis=(1, 3))
+        return value_count, valid_count
+
+    def _readStrip(self, src_band, src_ndv, plan, dst_row, strip_rows):
+        """
+        Source pixels under strip_rows grid rows starting at dst_row, padded (invalid) where the grid
+        extends past the source
+        :return: (values, valid) arrays of shape (strip_rows * factor, dst_cols * factor)
+        """
+        factor = plan['factor']
+        rows, cols = strip_rows * factor, self.dst_cols * factor
+        row0 = plan['row_off'] + dst_row * factor
+        col0 = plan['col_off']
+        dtype = gdal.GetDataTypeName(src_band.DataType)
+        values = np.zeros((rows, cols), dtype=self._getNumpyType(dtype))
+        valid = np.zeros((rows, cols), dtype=bool)
+
+        # Intersection of the strip with the source, in source pixels
+        r0, r1 = max(row0, 0), min(row0 + rows, src_band.YSize)
+        c0, c1 = max(col0, 0), min(col0 + cols, src_band.XSize)
+        if (r0 < r1) and (c0 < c1):
+            data = src_band.ReadAsArray(c0, r0, c1 - c0, r1 - r0)
+            target = (slice(r0 - row0, r1 - row0), slice(c0 - col0, c1 - col0))
+            values[target] = data
+            if (src_ndv is None):
+                valid[target] = True
+            elif math.isnan(src_ndv):
+                valid[target] = ~np.isnan(data)
+            else:
+                valid[target] = (data != src_ndv)
+        return values, valid
+
+    def _getNumpyType(self, gdal_type_name):
+        return {'Byte': np.uint8, 'Int8': np.int8, 'UInt16': np.uint16, 'Int16': np.int16,
+                'UInt32': np.uint32, 'Int32': np.int32, 'UInt64': np.uint64, 'Int64': np.int64,
+                'Float32': np.float32, 'Float64': np.float64}[gdal_type_name]
+
+    # -------------------------------------------------------------------------
+    # Block reducers - (rows * factor, cols * factor) values/valid -> (rows, cols)
+    # -------------------------------------------------------------------------
+    def _getBlocks(self, array, factor):
+        rows, cols = array.shape[0] // factor, array.shape[1] // factor
+        return array.reshape(rows, factor, cols, factor)
+
+    def _reduceAverage(self, values, valid, factor, dtype, dst_ndv):
+        # Mean of the valid pixels of each block (GDAL 'average' on an aligned grid)
+        total = self._getBlocks(np.where(valid, values, 0), factor).sum(axis=(1, 3), dtype=np.float64)
+        count = self._getBlocks(valid, factor).sum(axis=(1, 3))
+        mean = total / np.maximum(count, 1)
+        return self._toType(mean, count > 0, dtype, dst_ndv)
+
+    def _toType(self, result, valid, dtype, dst_ndv):
+        # Round (half up) and clamp to integer outputs, and keep valid results off the nodata value
+        if np.issubdtype(dtype, np.integer):
+            info = np.iinfo(dtype)
+            result = np.clip(np.floor(result + 0.5), info.min, info.max)
+            if (dst_ndv is not None):
+                collision = valid & (result == dst_ndv)
+                result[collision] += 1 if dst_ndv < info.max else -1
+        result = result.astype(dtype)
+        result[~valid] = 0 if dst_ndv is None else dst_ndv
+        return result
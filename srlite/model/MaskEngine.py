@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# coding: utf-8
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# class MaskEngine
+#
+# This class holds the band-independent masks of a scene (cloudmask, quality
+# flags, blue-band threshold) on the 30m grid as one bit-packed array (one bit
+# per pixel), built once per scene.  Band-specific masks (nodata, negative
+# values) are packed and OR-ed with it, so each band costs one bitwise pass
+# instead of a list of full masked-array copies.
+# -----------------------------------------------------------------------------
+class MaskEngine(object):
+
+    # -------------------------------------------------------------------------
+    # __init__
+    # -------------------------------------------------------------------------
+    def __init__(self, shape):
+        self.shape = tuple(int(dim) for dim in shape)
+        self.size = int(np.prod(self.shape))
+        self._packed = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        self._counts = {}
+
+    # -------------------------------------------------------------------------
+    # add()
+    #
+    # OR a band-independent layer (a masked array, or a boolean array where True
+    # means masked) into the scene mask
+    # -------------------------------------------------------------------------
+    def add(self, name, layer, positive=False):
+        """
+        :param name: layer name (for getCounts)
+        :param layer: masked array or boolean array of the scene shape
+        :param positive: also mask negative values of the layer
+        """
+        mask = np.ma.getmaskarray(layer) if np.ma.isMaskedArray(layer) else np.asarray(layer, dtype=bool)
+        if positive:
+            mask = mask | (np.ma.getdata(layer) < 0)
+        packed = np.packbits(mask.ravel())
+        self._counts[name] = int(np.count_nonzero(mask))
+        self._packed |= packed
+
+    # -------------------------------------------------------------------------
+    # getMask()
+    #
+    # Scene mask OR-ed with band-specific masks of shape (..., rows, cols) or (..., pixels)
+    # -------------------------------------------------------------------------
+    def getMask(self, band_mask=None):
+        """
+        :return: boolean array of the shape of band_mask (or of the scene), True where masked
+        """
+        if band_mask is None:
+            return self._unpack(self._packed[np.newaxis, :]).reshape(self.shape)
+        band_mask = np.asarray(band_mask, dtype=bool)
+        packed = np.packbits(band_mask.reshape(-1, self.size), axis=1)
+        packed |= self._packed
+        return self._unpack(packed).reshape(band_mask.shape)
+
+    def getCount(self):
+        # Number of pixels masked by the band-independent layers
+        return int(np.unpackbits(self._packed, count=self.size).sum())
+
+    def getCounts(self):
+        return dict(self._counts)
+
+    def _unpack(self, packed):
+        return np.unpackbits(packed, axis=1, count=self.size).view(bool)
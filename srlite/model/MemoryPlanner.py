@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# coding: utf-8
+import math
+
+# -----------------------------------------------------------------------------
+# class MemoryPlanner
+#
+# This class estimates the peak memory of each workflow stage from raster
+# dimensions and dtypes and picks an execution mode that fits a budget:
+#
+#   memory - 2m TOA stack, predictions and output dataset held in memory
+#   stream - predictions computed block by block by GDAL (VRT -> COG), with the
+#            GDAL block cache (the effective window) sized to the leftover budget
+#   disk   - stream, plus 30m warps written to scratch GeoTIFFs (--storage file)
+#
+# The same estimates bound the number of scenes processed concurrently.
+# -----------------------------------------------------------------------------
+class MemoryPlanner(object):
+
+    MODE_MEMORY = 'memory'
+    MODE_STREAM = 'stream'
+    MODE_DISK = 'disk'
+
+    # Interpreter, NumPy/GDAL libraries and small objects of one worker process
+    PROCESS_OVERHEAD_BYTES = 512 << 20
+    # Smallest and largest useful GDAL block cache in streaming modes
+    MIN_CACHE_BYTES = 64 << 20
+    MAX_CACHE_BYTES = 2 << 30
+    # Masked arrays carry one mask byte per pixel
+    MASK_BYTES = 1
+
+    # -------------------------------------------------------------------------
+    # __init__
+    # -------------------------------------------------------------------------
+    def __init__(self, max_bytes, workers=1):
+        self._max_bytes = int(max_bytes)
+        self._workers = max(1, int(workers))
+
+    def getSceneBudget(self, workers=None):
+        workers = self._workers if workers is None else max(1, int(workers))
+        return self._max_bytes // workers - self.PROCESS_OVERHEAD_BYTES
+
+    # -------------------------------------------------------------------------
+    # estimate()
+    #
+    # Peak bytes of each stage of one scene
+    # -------------------------------------------------------------------------
+    def estimate(self, toa_shape, target_shape, band_pairs, res_ratio, pred_itemsize=8):
+        """
+        :param toa_shape: (band count, rows, cols, itemsize) of the 2m TOA
+        :param target_shape: (band count, rows, cols, itemsize) of the target
+        :param band_pairs: number of band pairs
+        :param res_ratio: ratio of the warp resolution to the TOA resolution (e.g., 15 for 30m/2m)
+        :param pred_itemsize: bytes per predicted pixel
+        :return: dict of stage name to bytes
+        """
+        toa_count, rows, cols, toa_itemsize = toa_shape
+        target_count, target_itemsize = target_shape[0], target_shape[3]
+        pixels = rows * cols
+        warp_pixels = math.ceil(rows / res_ratio) * math.ceil(cols / res_ratio)
+
+        estimate = {}
+        # Warped MEM datasets plus their masked-array copies
+        estimate['reprojection'] = warp_pixels * (
+            toa_count * (2 * toa_itemsize + self.MASK_BYTES) + target_count * (2 * target_itemsize + self.MASK_BYTES))
+        # Float64 (bands, pixels) stacks, shared masks and temporaries of the fit
+        estimate['fit'] = warp_pixels * band_pairs * (4 * 8 + 2 * self.MASK_BYTES)
+        # 2m TOA stack, per-band predictions (all held until written) and one float64 temporary
+        estimate['apply'] = pixels * (band_pairs * (toa_itemsize + self.MASK_BYTES)
+                                      + band_pairs * (pred_itemsize + self.MASK_BYTES) + 8)
+        # MEM output dataset filled from the predictions (released band by band)
+        estimate['image'] = pixels * band_pairs * (toa_itemsize + pred_itemsize + self.MASK_BYTES)
+        return estimate
+
+    # -------------------------------------------------------------------------
+    # plan()
+    #
+    # Choose the execution mode (and GDAL cache size) of one scene
+    # -------------------------------------------------------------------------
+    def plan(self, estimate, workers=None):
+        budget = self.getSceneBudget(workers)
+        # Warped arrays stay referenced by the context for the whole scene; fit temporaries do not
+        fit_peak = estimate['reprojection'] + estimate['fit']
+        in_memory = max(fit_peak, estimate['reprojection'] + max(estimate['apply'], estimate['image']))
+        streaming = max(fit_peak, estimate['reprojection'] + self.MIN_CACHE_BYTES)
+
+        if in_memory <= budget:
+            mode, cache_bytes = self.MODE_MEMORY, None
+        elif streaming <= budget:
+            mode, cache_bytes = self.MODE_STREAM, int(min(budget - estimate['reprojection'], self.MAX_CACHE_BYTES))
+        else:
+            # Nothing but the 30m fit stays in memory
+            mode, cache_bytes = self.MODE_DISK, self.MIN_CACHE_BYTES
+
+        return {'mode': mode, 'budget': budget, 'cache_bytes': cache_bytes,
+                'in_memory_bytes': in_memory, 'stream_bytes': streaming,
+                'estimate': estimate}
+
+    # -------------------------------------------------------------------------
+    # getWorkers()
+    #
+    # Largest number of concurrent scenes (up to the requested workers) whose minimum
+    # footprint fits in the budget
+    # -------------------------------------------------------------------------
+    def getWorkers(self, estimate):
+        footprint = max(estimate['reprojection'] + estimate['fit'], estimate['reprojection'] + self.MIN_CACHE_BYTES) \
+                    + self.PROCESS_OVERHEAD_BYTES
+        return max(1, min(self._workers, self._max_bytes // footprint))
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# coding: utf-8
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# class QualityMask
+#
+# This class turns a quality (QA/QF) band into a boolean mask (True = masked)
+# with a lookup table indexed by the band values, in one pass.  The table is
+# built from masked values (e.g., GLAD ARD QF classes 0, 3 and 4) and/or bits
+# (e.g., Landsat QA_PIXEL bit 3 = cloud, bit 4 = cloud shadow): 256 entries for
+# 8-bit classes, 65536 for bits (16-bit QA bands) or values above 255.
+# -----------------------------------------------------------------------------
+class QualityMask(object):
+
+    # -------------------------------------------------------------------------
+    # __init__
+    # -------------------------------------------------------------------------
+    def __init__(self, values=(), bits=()):
+        """
+        :param values: band values to mask
+        :param bits: bit positions - values with any of these bits set are masked
+        """
+        self.values = sorted(set(int(value) for value in values))
+        self.bits = sorted(set(int(bit) for bit in bits))
+        if any(value < 0 for value in self.values) or any(bit < 0 for bit in self.bits):
+            raise ValueError('Quality mask values and bits must not be negative')
+        wide = any(value > 0xFF for value in self.values) or len(self.bits) > 0
+        if any(value > 0xFFFF for value in self.values) or any(bit > 15 for bit in self.bits):
+            raise ValueError('Quality mask values and bits are limited to 16 bits')
+
+        self.size = 1 << (16 if wide else 8)
+        lut = np.zeros(self.size, dtype=bool)
+        lut[self.values] = True
+        if self.bits:
+            bit_mask = sum(1 << bit for bit in self.bits)
+            lut |= (np.arange(self.size) & bit_mask) != 0
+        self.lut = lut
+
+    @classmethod
+    def fromList(cls, mask_list):
+        """
+        :param mask_list: comma-separated values and 'b<N>' bits, e.g. '0,3,4' or 'b3,b4'
+        """
+        values, bits = [], []
+        for token in str(mask_list).replace(' ', '').split(','):
+            if token == '':
+                continue
+            if token.lower().startswith('b'):
+                bits.append(int(token[1:]))
+            else:
+                values.append(int(float(token)))
+        return cls(values, bits)
+
+    # -------------------------------------------------------------------------
+    # getMask()
+    #
+    # Boolean mask of a QA band - values outside the table (e.g., nodata) and
+    # non-integer values are not masked
+    # -------------------------------------------------------------------------
+    def getMask(self, qa_array):
+        data = np.ma.getdata(qa_array)
+        if (data.dtype == np.uint8) or ((data.dtype == np.uint16) and (self.size == 0xFFFF + 1)):
+            return self.lut[data]
+
+        in_range = (data >= 0) & (data < self.size)
+        if data.dtype.kind == 'f':
+            in_range &= (data == np.floor(data))
+        mask = np.zeros(data.shape, dtype=bool)
+        mask[in_range] = self.lut[data[in_range].astype(np.intp)]
+        return mask
+
+    def __repr__(self):
+        return 'QualityMask(values={}, bits={})'.format(self.values, self.bits)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from osgeo import gdal
+
+# -----------------------------------------------------------------------------
+# class RasterCatalog
+#
+# This class is a persistent SQLite index of raster metadata (dimensions, band
+# names, nodata, CRS, geotransform, footprint) keyed on absolute path.  Input
+# directories are streamed with os.scandir and only new or modified files (by
+# size and mtime) are opened, in parallel, so refreshing a large archive costs
+# one stat per file.  Lookups re-validate the entry against the file on disk.
+#
+# Only the driver process writes the catalog; workers open it read-only and
+# read changed files without updating it.  SQLite locking is unreliable on
+# network filesystems, so a catalog written by several nodes must be on a
+# node-local path (see isShared()).
+# -----------------------------------------------------------------------------
+class RasterCatalog(object):
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS rasters (
+            path TEXT PRIMARY KEY,
+            dir TEXT NOT NULL,
+            name TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            count INTEGER,
+            dtype TEXT,
+            driver TEXT,
+            nodata TEXT,
+            crs TEXT,
+            geotransform TEXT,
+            footprint TEXT,
+            bands TEXT
+        );
+        CREATE INDEX IF NOT EXISTS rasters_dir_name ON rasters (dir, name);
+    '''
+    COLUMNS = ('path', 'dir', 'name', 'size', 'mtime_ns', 'width', 'height', 'count', 'dtype',
+               'driver', 'nodata', 'crs', 'geotransform', 'footprint', 'bands')
+
+    # Filesystem types (/proc/mounts) shared between nodes
+    SHARED_FS_TYPES = ('nfs', 'nfs4', 'gpfs', 'lustre', 'cifs', 'smb3', 'beegfs', 'panfs', 'ceph', 'fuse.sshfs')
+
+    # -------------------------------------------------------------------------
+    # __init__
+    # -------------------------------------------------------------------------
+    def __init__(self, catalog_fn, max_workers=None, readonly=False):
+        self._catalog_fn = catalog_fn
+        self._max_workers = max_workers
+        self.readonly = readonly
+        if readonly:
+            self._connection = sqlite3.connect('file:{}?mode=ro'.format(os.path.abspath(catalog_fn)),
+                                               timeout=60, uri=True)
+        else:
+            # Rollback journal - WAL needs shared memory, which network filesystems do not provide
+            self._connection = sqlite3.connect(catalog_fn, timeout=60)
+            self._connection.execute('PRAGMA journal_mode=DELETE')
+            self._connection.executescript(self.SCHEMA)
+            self._connection.commit()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    @classmethod
+    def isShared(cls, fn):
+        # True if fn is on a network filesystem (per the longest matching mount point of /proc/mounts)
+        path = os.path.realpath(os.path.dirname(os.path.abspath(str(fn))))
+        fs_type, mount_len = None, -1
+        try:
+            with open('/proc/mounts') as mounts:
+                for line in mounts:
+                    fields = line.split()
+                    mount_point = fields[1].replace('\\040', ' ')
+                    if (len(mount_point) > mount_len) and \
+                            ((path == mount_point) or path.startswith(mount_point.rstrip('/') + '/')):
+                        fs_type, mount_len = fields[2], len(mount_point)
+        except (OSError, IndexError):
+            return False
+        return fs_type in cls.SHARED_FS_TYPES
+
+    # -------------------------------------------------------------------------
+    # scan()
+    #
+    # Incrementally refresh the entries of dir_name whose names end with suffix
+    # -------------------------------------------------------------------------
+    def scan(self, dir_name, suffix=''):
+        """
+        :param dir_name: directory to index (not recursive)
+        :param suffix: only file names ending with suffix are indexed
+        :return: (number of files, number of files (re)read)
+        """
+        dir_name = os.path.abspath(dir_name)
+        known = {row[0]: (row[1], row[2]) for row in self._connection.execute(
+            'SELECT name, size, mtime_ns FROM rasters WHERE dir = ?', (dir_name,))}
+
+        seen = set()
+        stale = []
+        with os.scandir(dir_name) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or not entry.name.endswith(suffix) or not entry.is_file():
+                    continue
+                seen.add(entry.name)
+                st = entry.stat()
+                if known.get(entry.name) != (st.st_size, st.st_mtime_ns):
+                    stale.append(entry.path)
+
+        # Entries of removed files (matching suffix only - other scans may share the directory)
+        removed = [(os.path.join(dir_name, name),) for name in known
+                   if name.endswith(suffix) and name not in seen]
+        self._connection.executemany('DELETE FROM rasters WHERE path = ?', removed)
+
+        # GDAL releases the GIL while reading headers, so threads overlap the (network) I/O
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            rows = [row for row in executor.map(self._readRow, stale) if row is not None]
+        self._upsert(rows)
+        return len(seen), len(rows)
+
+    # -------------------------------------------------------------------------
+    # listFiles()
+    #
+    # Sorted paths of catalogued files in dir_name whose names end with suffix
+    # -------------------------------------------------------------------------
+    def listFiles(self, dir_name, suffix=''):
+        rows = self._connection.execute('SELECT path, name FROM rasters WHERE dir = ? ORDER BY name',
+                                        (os.path.abspath(dir_name),))
+        return [path for path, name in rows if name.endswith(suffix)]
+
+    # -------------------------------------------------------------------------
+    # get()
+    #
+    # Metadata of fn as a dict, or None if fn does not exist or is not a raster
+    # -------------------------------------------------------------------------
+    def get(self, fn):
+        path = os.path.abspath(str(fn))
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        row = self._connection.execute('SELECT * FROM rasters WHERE path = ?', (path,)).fetchone()
+        if (row is None) or (row[3], row[4]) != (st.st_size, st.st_mtime_ns):
+            row = self._readRow(path)
+            if row is None:
+                return None
+            if not self.readonly:
+                self._upsert([row])
+        return self._toDict(row)
+
+    def exists(self, fn):
+        return self.get(fn) is not None
+
+    def getNdv(self, fn):
+        entry = self.get(fn)
+        return None if entry is None else entry['nodata']
+
+    # -------------------------------------------------------------------------
+    # _readRow()
+    # -------------------------------------------------------------------------
+    def _readRow(self, path):
+        try:
+            st = os.stat(path)
+            ds = gdal.Open(path, gdal.GA_ReadOnly)
+        except (OSError, RuntimeError):
+            return None
+        if ds is None:
+            return None
+
+        gt = ds.GetGeoTransform()
+        corners_x = [gt[0], gt[0] + ds.RasterXSize * gt[1] + ds.RasterYSize * gt[2]]
+        corners_y = [gt[3], gt[3] + ds.RasterXSize * gt[4] + ds.RasterYSize * gt[5]]
+        band = ds.GetRasterBand(1)
+        # NaN is not representable as a SQLite REAL - nodata is stored as text
+        nodata = band.GetNoDataValue() if band is not None else None
+        row = (path, os.path.dirname(path), os.path.basename(path), st.st_size, st.st_mtime_ns,
+               ds.RasterXSize, ds.RasterYSize, ds.RasterCount,
+               gdal.GetDataTypeName(band.DataType) if band is not None else None,
+               ds.GetDriver().ShortName,
+               None if nodata is None else repr(nodata),
+               ds.GetProjection(),
+               json.dumps(list(gt)),
+               json.dumps([min(corners_x), min(corners_y), max(corners_x), max(corners_y)]),
+               json.dumps([ds.GetRasterBand(index).GetDescription() for index in range(1, ds.RasterCount + 1)]))
+        ds = None
+        return row
+
+    def _upsert(self, rows):
+        self._connection.executemany(
+            'INSERT OR REPLACE INTO rasters VALUES ({})'.format(', '.join('?' * len(self.COLUMNS))), rows)
+        self._connection.commit()
+
+    def _toDict(self, row):
+        entry = dict(zip(self.COLUMNS, row))
+        entry['nodata'] = None if entry['nodata'] is None else float(entry['nodata'])
+        for key in ('geotransform', 'footprint', 'bands'):
+            entry[key] = json.loads(entry[key])
+        return entry
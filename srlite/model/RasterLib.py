@@ -4,19 +4,31 @@ import os
 import os.path
 import sys
 import ast
-from datetime import datetime
+import shutil
+import tempfile
+from contextlib import nullcontext, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax import saxutils
 import osgeo
-from osgeo import gdal, osr
+from osgeo import gdal, gdal_array, osr
 from pygeotools.lib import iolib, warplib, malib
 import rasterio
+from rasterio.windows import Window
 import numpy as np
 from srlite.model.Context import Context
-from sklearn.linear_model import HuberRegressor, LinearRegression
+from srlite.model.WarpCache import WarpCache
+from srlite.model.RasterCatalog import RasterCatalog
+from srlite.model.BatchManifest import BatchManifest
+from srlite.model.StageProfiler import StageProfiler
+from srlite.model.MemoryPlanner import MemoryPlanner
+from srlite.model.GridPlanner import GridPlanner
+from srlite.model.MaskEngine import MaskEngine
+from srlite.model.QualityMask import QualityMask
+from srlite.model.regression.linear.ClosedFormRegression import ClosedFormRegression, SufficientStatistics
+from srlite.model.regression.RegressionMetrics import RegressionMetrics
+from sklearn.linear_model import HuberRegressor
 
-#Not in current ilab kernel (or introduced from diagnostics
-from pylr2 import regress2
 import pandas as pd
-import sklearn
 
 # -----------------------------------------------------------------------------
 # class Context
@@ -26,6 +38,8 @@ import sklearn
 class RasterLib(object):
 
     DIR_TOA = 'toa'
+    # Rows of predictions copied per write
+    WRITE_STRIP_ROWS = 1024
 
     # -------------------------------------------------------------------------
     # __init__
@@ -35,6 +49,11 @@ class RasterLib(object):
         # Initialize serializable context for orchestration
         self._debug_level = debug_level
         self._plot_lib = plot_lib
+        self._warp_cache = None
+        self._catalog = None
+        self._manifest = None
+        self._profiler = None
+        self._default_cache_max = None
 
         try:
             if (self._debug_level >= 1):
@@ -58,6 +77,51 @@ class RasterLib(object):
                 print("Error: Missing required parameter: " + str(parm))
                 exit(1)
 
+    def openCatalog(self, context, readonly=False):
+        # One catalog connection per process - SQLite handles are not shared across workers.  Only the
+        # driver writes, and not to a shared filesystem when several nodes run the batch.
+        catalog_fn = str(context[Context.FN_CATALOG])
+        if (self._catalog is None) and (catalog_fn != 'None'):
+            multi_node = (int(context[Context.SHARD_COUNT]) > 1) or (context[Context.QUEUE_DIR] != 'None')
+            if multi_node and not readonly and RasterCatalog.isShared(catalog_fn):
+                print(f'Catalog {catalog_fn} is on a shared filesystem - opened read-only '
+                      f'(use a node-local path to update it)')
+                readonly = True
+            if readonly and not os.path.exists(catalog_fn):
+                return None
+            self._catalog = RasterCatalog(catalog_fn, readonly=readonly)
+        return self._catalog
+
+    def getCatalog(self):
+        return self._catalog
+
+    def openManifest(self, context):
+        # One manifest handle per process (and prefetch thread), appending to the file of the process
+        if (self._manifest is None) and (str(context.get(Context.FN_MANIFEST, 'None')) != 'None'):
+            self._manifest = BatchManifest(str(context[Context.FN_MANIFEST]))
+        return self._manifest
+
+    def getManifest(self):
+        return self._manifest
+
+    def profileStage(self, context, name):
+        # Measure a workflow stage when profiling is enabled (no-op otherwise)
+        if not (eval(context[Context.PROFILE_FLAG])):
+            return nullcontext({})
+        if (self._profiler is None):
+            self._profiler = StageProfiler(context[Context.FN_PROFILE_EVENTS])
+        return self._profiler.stage(context.get(Context.FN_PREFIX), name,
+                                    context.setdefault(Context.PROFILE_LIST, []))
+
+    def _getBandDescriptions(self, fn):
+        entry = None if self._catalog is None else self._catalog.get(fn)
+        if (entry is not None):
+            return entry['bands']
+        ds = gdal.Open(fn, gdal.GA_ReadOnly)
+        bandDescriptions = [ds.GetRasterBand(index).GetDescription() for index in range(1, ds.RasterCount + 1)]
+        ds = None
+        return bandDescriptions
+
     def _representsInt(self, s):
         try:
             int(s)
@@ -73,10 +137,10 @@ class RasterLib(object):
         bandNamePairList = list(ast.literal_eval(context[Context.LIST_BAND_PAIRS]))
 
         fn_list = context[Context.FN_LIST]
-        ccdcDs = gdal.Open(fn_list[context[Context.LIST_INDEX_TARGET]], gdal.GA_ReadOnly)
-        ccdcBands = ccdcDs.RasterCount
-        evhrDs = gdal.Open(fn_list[context[Context.LIST_INDEX_TOA]], gdal.GA_ReadOnly)
-        evhrBands = evhrDs.RasterCount
+        ccdcBandDescriptions = self._getBandDescriptions(fn_list[context[Context.LIST_INDEX_TARGET]])
+        ccdcBands = len(ccdcBandDescriptions)
+        evhrBandDescriptions = self._getBandDescriptions(fn_list[context[Context.LIST_INDEX_TOA]])
+        evhrBands = len(evhrBandDescriptions)
 
         numBandPairs = len(bandNamePairList)
         bandIndices = [numBandPairs]
@@ -90,8 +154,7 @@ class RasterLib(object):
 
             for ccdcIndex in range(1, ccdcBands + 1):
                 # read in bands from image
-                band = ccdcDs.GetRasterBand(ccdcIndex)
-                bandDescription = band.GetDescription()
+                bandDescription = ccdcBandDescriptions[ccdcIndex - 1]
                 bandName = currentBandPair[context[Context.LIST_INDEX_TARGET]]
                 if (self._representsInt(bandName)):
                     ccdcBandIndex = int(bandName)
@@ -107,8 +170,7 @@ class RasterLib(object):
 
             for evhrIndex in range(1, evhrBands + 1):
                 # read in bands from image
-                band = evhrDs.GetRasterBand(evhrIndex)
-                bandDescription = band.GetDescription()
+                bandDescription = evhrBandDescriptions[evhrIndex - 1]
                 bandName = currentBandPair[context[Context.LIST_INDEX_TOA]]
                 if (self._representsInt(bandName)):
                     evhrBandIndex = int(bandName)
@@ -124,7 +186,6 @@ class RasterLib(object):
                             break
 
             if ((ccdcBandIndex == -1) or (evhrBandIndex == -1)):
-                ccdcDs = evhrDs = None
                 self._plot_lib.trace(f"Invalid band pairs - verify correct name and case {currentBandPair}")
                 exit(f"Invalid band pairs - verify correct name and case {currentBandPair}")
 
@@ -135,7 +196,6 @@ class RasterLib(object):
         context[Context.LIST_TOA_BANDS] = toaBandNames
         context[Context.LIST_TARGET_BANDS] = targetBandNames
 
-        ccdcDs = evhrDs = None
         self._plot_lib.trace(f'Band Names: {str(bandNamePairList)} Indices: {str(bandIndices)}')
         return bandIndices
 
@@ -171,15 +231,87 @@ class RasterLib(object):
         iolib.writeGTiff(bma.filled(), out_fn, ds, ndv=new_ndv)
         return out_fn
 
+    def getNdvOverrideDs(self, src_fn, new_ndv, vrt_fn=None):
+        """
+        Zero-copy alternative to replaceNdv(): an in-memory VRT over src_fn whose bands declare new_ndv.
+        Each band is a ComplexSource with the old nodata (NaN for float bands without one), so those
+        pixels are never composited and read back as new_ndv - the source raster is not rewritten.
+        If vrt_fn is given the (small) VRT is saved there instead, e.g., for warps written to disk.
+        """
+        src_fn = os.path.abspath(src_fn)
+        ds = gdal.Open(src_fn, gdal.GA_ReadOnly)
+        old_ndv = iolib.get_ndv_b(ds.GetRasterBand(1))
+        self._plot_lib.trace(f"Overriding old ndv {old_ndv} with new ndv {new_ndv} in {src_fn}")
+
+        vrt = [f'<VRTDataset rasterXSize="{ds.RasterXSize}" rasterYSize="{ds.RasterYSize}">',
+               f'  <SRS>{saxutils.escape(ds.GetProjection())}</SRS>',
+               '  <GeoTransform>' + ', '.join(repr(value) for value in ds.GetGeoTransform()) + '</GeoTransform>']
+        for bandIndex in range(1, ds.RasterCount + 1):
+            band = ds.GetRasterBand(bandIndex)
+            band_ndv = band.GetNoDataValue()
+            if (band_ndv is None) and (gdal.GetDataTypeName(band.DataType).startswith('Float')):
+                band_ndv = np.nan
+            # The VRT type must hold new_ndv, or GDAL clamps it (e.g., -9999 over Byte)
+            data_type = self._getNdvDataType(band.DataType, new_ndv)
+            vrt += [f'  <VRTRasterBand dataType="{gdal.GetDataTypeName(data_type)}" band="{bandIndex}">',
+                    f'    <NoDataValue>{new_ndv!r}</NoDataValue>']
+            if (band.GetDescription()):
+                vrt += [f'    <Description>{saxutils.escape(band.GetDescription())}</Description>']
+            vrt += ['    <ComplexSource>',
+                    f'      <SourceFilename relativeToVRT="0">{saxutils.escape(src_fn)}</SourceFilename>',
+                    f'      <SourceBand>{bandIndex}</SourceBand>']
+            if (band_ndv is not None):
+                vrt += [f'      <NODATA>{band_ndv!r}</NODATA>']
+            vrt += ['    </ComplexSource>',
+                    '  </VRTRasterBand>']
+        vrt += ['</VRTDataset>']
+        ds = None
+
+        if (vrt_fn is not None):
+            with open(vrt_fn, 'w') as vrtFile:
+                vrtFile.write('\n'.join(vrt))
+            return gdal.Open(vrt_fn, gdal.GA_ReadOnly)
+
+        vrt_ds = gdal.Open('\n'.join(vrt))
+        vrt_ds.SetDescription(src_fn)
+        return vrt_ds
+
+    def _getNdvDataType(self, data_type, ndv):
+        # data_type if it can represent ndv, otherwise the smallest GDAL type holding both
+        dtype = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(data_type))
+        if np.issubdtype(dtype, np.integer):
+            if (not np.isnan(ndv)) and (float(ndv).is_integer()) and \
+                    (np.iinfo(dtype).min <= ndv <= np.iinfo(dtype).max):
+                return data_type
+            ndv_dtype = np.min_scalar_type(int(ndv)) if (np.isfinite(ndv) and float(ndv).is_integer()) \
+                else np.dtype(np.float32)
+        else:
+            if np.isnan(ndv) or (abs(ndv) <= float(np.finfo(dtype).max)):
+                return data_type
+            ndv_dtype = np.dtype(np.float64)
+
+        promoted = np.promote_types(dtype, ndv_dtype)
+        if np.issubdtype(promoted, np.floating):
+            promoted = np.promote_types(promoted, np.float32)
+        elif (promoted.itemsize > 4):
+            # 64-bit integer rasters are not supported by every GDAL driver
+            promoted = np.dtype(np.float64)
+        return gdal_array.NumericTypeCodeToGDALTypeCode(promoted.type)
+
     def getAttributes(self, r_fn, title=None):
         geotransform = None
-        r_ds = iolib.fn_getds(r_fn)
+        entry = None if self._catalog is None else self._catalog.get(r_fn)
         if (self._debug_level >= 1):
+            if (entry is None):
+                r_ds = iolib.fn_getds(r_fn)
+                entry = {'count': r_ds.RasterCount, 'height': r_ds.RasterYSize, 'width': r_ds.RasterXSize,
+                         'crs': r_ds.GetProjection(), 'geotransform': r_ds.GetGeoTransform()}
+                r_ds = None
             self._plot_lib.trace("\nFile Name is {}".format(r_fn))
             self._plot_lib.trace("Raster Count is: {},  Size is: ({} x {})".format(
-                r_ds.RasterCount, r_ds.RasterYSize, r_ds.RasterXSize))
-            self._plot_lib.trace("Projection is {}".format(r_ds.GetProjection()))
-            geotransform = r_ds.GetGeoTransform()
+                entry['count'], entry['height'], entry['width']))
+            self._plot_lib.trace("Projection is {}".format(entry['crs']))
+            geotransform = entry['geotransform']
             if geotransform:
                 self._plot_lib.trace(f'Origin: ({geotransform[0]}, {geotransform[3]}), Resolution: ({geotransform[1]}, {geotransform[5]})  ')
                 # self._plot_lib.trace("Origin = ({}, {})".format(geotransform[0], geotransform[3])) \
@@ -188,11 +320,21 @@ class RasterLib(object):
         if (self._debug_level >= 2):
             self._plot_lib.plot_combo(r_fn, figsize=(14, 7), title=title)
 
-        r_ds = None
         return geotransform
 
     def setTargetAttributes(self, context, r_fn):
 
+        entry = None if self._catalog is None else self._catalog.get(r_fn)
+        if (entry is not None):
+            context[Context.TARGET_GEO_TRANSFORM] = tuple(entry['geotransform'])
+            context[Context.TARGET_DRIVER] = gdal.GetDriverByName(entry['driver'])
+            context[Context.TARGET_PRJ] = entry['crs']
+            context[Context.TARGET_SRS] = osr.SpatialReference(wkt=entry['crs']) if entry['crs'] else None
+            context[Context.TARGET_RASTERX_SIZE] = entry['width']
+            context[Context.TARGET_RASTERY_SIZE] = entry['height']
+            context[Context.TARGET_RASTER_COUNT] = entry['count']
+            return
+
         r_ds = iolib.fn_getds(r_fn)
         context[Context.TARGET_GEO_TRANSFORM] = r_ds.GetGeoTransform()
         context[Context.TARGET_DRIVER] = r_ds.GetDriver()
@@ -323,33 +465,216 @@ class RasterLib(object):
         # ########################################
         ndv_list = [self.get_ndv(fn) for fn in context[Context.FN_REPROJECTION_LIST]]
         self._plot_lib.trace(f'Fill values before re-projection:  {ndv_list}')
-
-    # Ensure that all NoData values match TARGET_FN (e.g., TOA)
         dst_ndv = self.get_ndv(str(context[Context.TARGET_FN]))
-#        index = 0
-        for fn in context[Context.FN_REPROJECTION_LIST]:
-            current_ndv = self.get_ndv(fn)
-            if (current_ndv != dst_ndv):
-                out_fn = self.replaceNdv(fn, dst_ndv)
-                index = context[Context.FN_LIST].index(fn)
-                context[Context.FN_LIST][index] = out_fn
-                index = context[Context.FN_REPROJECTION_LIST].index(fn)
-                context[Context.FN_REPROJECTION_LIST][index] = out_fn
-#               index = index+1
-
-        # Reproject inputs to TOA attributes (res, extent, srs, nodata)
-        warp_ds_list = warplib.memwarp_multi_fn(context[Context.FN_REPROJECTION_LIST],
-                                                res=context[Context.TARGET_XRES],
-                                                extent=str(context[Context.TARGET_FN]),
-                                                t_srs=str(context[Context.TARGET_FN]),
-                                                r=context[Context.TARGET_SAMPLING_METHOD],
-                                                dst_ndv=dst_ndv)
+
+        # Reuse previously warped stacks when the inputs and warp parameters are unchanged
+        warp_cache = self._getWarpCache(context)
+        if (warp_cache is not None):
+            cache_key = warp_cache.getKey(context[Context.FN_REPROJECTION_LIST], context[Context.TARGET_FN],
+                                          context[Context.TARGET_XRES], context[Context.TARGET_SAMPLING_METHOD],
+                                          dst_ndv)
+            warp_ds_list = warp_cache.get(cache_key)
+            context.setdefault(Context.WARP_CACHE_STATUS, []).append('miss' if warp_ds_list is None else 'hit')
+            self._plot_lib.trace(f'Warp cache {context[Context.WARP_CACHE_STATUS][-1]}: {cache_key} {warp_cache.getStats()}')
+            if (warp_ds_list is not None):
+                warp_ma_list = [iolib.ds_getma(ds) for ds in warp_ds_list]
+                return warp_ds_list, warp_ma_list
+
+        # Ensure that all NoData values match TARGET_FN (e.g., TOA) - mismatched inputs are wrapped in a
+        # nodata-override VRT rather than rewritten, so the file lists (and warp cache keys) are unchanged
+        if not iolib.fn_list_check(context[Context.FN_REPROJECTION_LIST]):
+            sys.exit('Missing input file(s)')
+        fileStorage = (context[Context.STORAGE_TYPE] == Context.STORAGE_TYPE_FILE)
+        src_ds_list = []
+        for fn, current_ndv in zip(context[Context.FN_REPROJECTION_LIST], ndv_list):
+            if (dst_ndv is not None) and (current_ndv != dst_ndv):
+                vrt_fn = None
+                if (fileStorage):
+                    vrt_fn = os.path.join(self.getScratchDir(context),
+                                          os.path.splitext(os.path.basename(fn))[0] + '_ndv.vrt')
+                src_ds_list.append(self.getNdvOverrideDs(fn, dst_ndv, vrt_fn))
+            else:
+                src_ds_list.append(gdal.Open(fn, gdal.GA_ReadOnly))
+
+        # Inputs already on (or block-aligned with) the 30m TOA grid skip the GDAL warp
+        warp_ds_list = [None] * len(src_ds_list)
+        grid = GridPlanner.fromDataset(gdal.Open(str(context[Context.TARGET_FN]), gdal.GA_ReadOnly),
+                                       context[Context.TARGET_XRES], dst_ndv)
+        for index, src_ds in enumerate(src_ds_list):
+            if (grid is None):
+                plan = {'path': GridPlanner.PATH_WARP, 'reason': 'rotated TOA grid'}
+            else:
+                plan = grid.plan(src_ds, context[Context.TARGET_SAMPLING_METHOD])
+            fn = os.path.basename(context[Context.FN_REPROJECTION_LIST][index])
+            self._plot_lib.trace(f"Resampling path for {fn} ({context[Context.TARGET_SAMPLING_METHOD]}): "
+                                 f"{plan['path']} {plan.get('reason', '')}")
+            context.setdefault(Context.GRID_PLAN_LIST, []).append(plan['path'])
+            if (plan['path'] != GridPlanner.PATH_WARP):
+                warp_ds_list[index] = grid.apply(src_ds, plan)
+        warp_index_list = [index for index in range(0, len(warp_ds_list)) if warp_ds_list[index] is None]
+        src_ds_list = [src_ds_list[index] for index in warp_index_list]
+
+        # Reproject remaining inputs to TOA attributes (res, extent, srs, nodata) - to scratch GeoTIFFs for file storage
+        if (len(src_ds_list) == 0):
+            gdal_warp_ds_list = []
+        elif (fileStorage):
+            gdal_warp_ds_list = warplib.diskwarp_multi(src_ds_list,
+                                                       res=context[Context.TARGET_XRES],
+                                                       extent=str(context[Context.TARGET_FN]),
+                                                       t_srs=str(context[Context.TARGET_FN]),
+                                                       r=context[Context.TARGET_SAMPLING_METHOD],
+                                                       outdir=self.getScratchDir(context),
+                                                       dst_ndv=dst_ndv)
+        else:
+            gdal_warp_ds_list = warplib.memwarp_multi(src_ds_list,
+                                                      res=context[Context.TARGET_XRES],
+                                                      extent=str(context[Context.TARGET_FN]),
+                                                      t_srs=str(context[Context.TARGET_FN]),
+                                                      r=context[Context.TARGET_SAMPLING_METHOD],
+                                                      dst_ndv=dst_ndv)
+        for index, ds in zip(warp_index_list, gdal_warp_ds_list):
+            warp_ds_list[index] = ds
+        src_ds_list = None
+        if (warp_cache is not None):
+            warp_ds_list = warp_cache.put(cache_key, warp_ds_list)
 
         warp_ma_list = [iolib.ds_getma(ds) for ds in warp_ds_list]
         self._plot_lib.trace(f'Fill values after re-projection:  { [ma.get_fill_value() for ma in warp_ma_list]}')
 
         return warp_ds_list, warp_ma_list
 
+    def getCloudmaskReprojection(self, context):
+        """
+        Downsample the 2m cloudmask to the 30m grid by counting cloudy and valid pixels per cell.
+        Sets context[Context.MA_CLOUD_FRACTION] and returns ([mask ds], [mask ma]) - a uint8 mask that is
+        1 where the cloud fraction exceeds --cloudfrac.  Inputs that are not block-aligned with the grid
+        fall back to a GDAL 'mode' warp (the fraction is then 0 or 1).
+        """
+        self._validateParms(context, [Context.FN_CLOUDMASK, Context.FN_TOA, Context.TARGET_XRES])
+
+        src_ds = gdal.Open(str(context[Context.FN_CLOUDMASK]), gdal.GA_ReadOnly)
+        grid = GridPlanner.fromDataset(gdal.Open(str(context[Context.FN_TOA]), gdal.GA_ReadOnly),
+                                       context[Context.TARGET_XRES])
+        if (grid is None):
+            plan = {'path': GridPlanner.PATH_WARP, 'reason': 'rotated TOA grid'}
+        else:
+            plan = grid.plan(src_ds, 'mode')
+            if (plan['path'] != GridPlanner.PATH_WARP):
+                plan['path'] = GridPlanner.PATH_REDUCE
+        self._plot_lib.trace(f"Resampling path for {os.path.basename(context[Context.FN_CLOUDMASK])} (cloud fraction): "
+                             f"{plan['path']} {plan.get('reason', '')}")
+
+        if (plan['path'] == GridPlanner.PATH_WARP):
+            context[Context.FN_REPROJECTION_LIST] = [str(context[Context.FN_CLOUDMASK])]
+            context[Context.TARGET_FN] = str(context[Context.FN_TOA])
+            context[Context.TARGET_SAMPLING_METHOD] = 'mode'
+            warp_ds_list, warp_ma_list = self.getReprojection(context)
+            cloud_ma = warp_ma_list[0]
+            fraction = np.ma.array((np.ma.getdata(cloud_ma) == Context.CLOUDMASK_CLOUD_VALUE).astype(np.float32),
+                                   mask=np.ma.getmaskarray(cloud_ma))
+        else:
+            context.setdefault(Context.GRID_PLAN_LIST, []).append(plan['path'])
+            cloud_count, valid_count = grid.countCategory(src_ds, plan, Context.CLOUDMASK_CLOUD_VALUE)
+            fraction = np.ma.array(cloud_count / np.maximum(valid_count, 1, dtype=np.float32),
+                                   mask=(valid_count == 0), dtype=np.float32)
+            cloud_count = valid_count = None
+
+        ndv = src_ds.GetRasterBand(1).GetNoDataValue()
+        ndv = 255 if ndv is None else ndv
+        src_ds = None
+        context[Context.MA_CLOUD_FRACTION] = fraction
+        self._plot_lib.trace(f'Cloud fraction of valid 30m cells: {fraction.mean()}')
+
+        # Binary uint8 mask (1 = cloud) on the grid
+        cloud_ma = np.ma.array((np.ma.getdata(fraction) > float(context[Context.CLOUD_FRACTION_THRESHOLD]))
+                               .astype(np.uint8), mask=np.ma.getmaskarray(fraction), fill_value=ndv)
+        if (plan['path'] == GridPlanner.PATH_WARP):
+            return warp_ds_list, [cloud_ma]
+        cloud_ds = grid.createDataset(1, gdal.GDT_Byte, os.path.basename(context[Context.FN_CLOUDMASK]))
+        cloud_ds.GetRasterBand(1).SetNoDataValue(ndv)
+        cloud_ds.GetRasterBand(1).WriteArray(cloud_ma.filled())
+        return [cloud_ds], [cloud_ma]
+
+    def getScratchDir(self, context):
+        # Per-scene scratch directory under --warp_dir, removed by refresh()
+        if (context.get(Context.DIR_SCRATCH) is None):
+            context[Context.DIR_SCRATCH] = tempfile.mkdtemp(prefix=str(context[Context.FN_PREFIX]) + '-scratch-',
+                                                            dir=context[Context.DIR_WARP])
+        return context[Context.DIR_SCRATCH]
+
+    def getRasterShape(self, fn):
+        """
+        :return: (band count, rows, cols, itemsize, x resolution) of fn - from the catalog when available
+        """
+        entry = None if self._catalog is None else self._catalog.get(fn)
+        if (entry is not None):
+            itemsize = gdal.GetDataTypeSize(gdal.GetDataTypeByName(entry['dtype'])) // 8
+            return entry['count'], entry['height'], entry['width'], itemsize, abs(entry['geotransform'][1])
+        ds = gdal.Open(str(fn), gdal.GA_ReadOnly)
+        shape = (ds.RasterCount, ds.RasterYSize, ds.RasterXSize,
+                 gdal.GetDataTypeSize(ds.GetRasterBand(1).DataType) // 8, abs(ds.GetGeoTransform()[1]))
+        ds = None
+        return shape
+
+    def getMemoryEstimate(self, context, planner):
+        self._validateParms(context, [Context.FN_TOA, Context.FN_TARGET, Context.LIST_BAND_PAIRS])
+
+        toa_shape = self.getRasterShape(context[Context.FN_TOA])
+        target_shape = self.getRasterShape(context[Context.FN_TARGET])
+        band_pairs = len(list(ast.literal_eval(context[Context.LIST_BAND_PAIRS])))
+        return planner.estimate(toa_shape[:4], target_shape[:4], band_pairs,
+                                float(context[Context.TARGET_XRES]) / toa_shape[4],
+                                np.dtype(self.getWorkingDtype(context)).itemsize)
+
+    def planMemory(self, context):
+        """
+        Choose in-memory, streaming or disk-backed execution of the scene to stay within --max-memory
+        """
+        if (float(context[Context.MAX_MEMORY]) <= 0):
+            return None
+
+        # Scenes resident at once - one per worker process, or the computed scene and its prefetched followers
+        scenes = max(int(context[Context.WORKERS]), int(context[Context.PREFETCH]) + 1)
+        planner = MemoryPlanner(float(context[Context.MAX_MEMORY]) * (1 << 30), scenes)
+        plan = planner.plan(self.getMemoryEstimate(context, planner))
+        context[Context.MEMORY_PLAN] = plan
+
+        if (plan['mode'] != MemoryPlanner.MODE_MEMORY):
+            context[Context.STREAM_FLAG] = str(True)
+        if (plan['mode'] == MemoryPlanner.MODE_DISK):
+            context[Context.STORAGE_TYPE] = Context.STORAGE_TYPE_FILE
+
+        self._plot_lib.trace(f"Memory plan: {plan['mode']} (budget {plan['budget'] / (1 << 30):.1f} GB, "
+                             f"in-memory {plan['in_memory_bytes'] / (1 << 30):.1f} GB, "
+                             f"streaming {plan['stream_bytes'] / (1 << 30):.1f} GB)")
+        return plan
+
+    def setCacheMax(self, context):
+        """
+        Size the GDAL block cache for the memory plan of the scene being computed.  The cache is
+        process-wide, so this is only called from the compute thread (never by prefetch threads).
+        """
+        plan = context.get(Context.MEMORY_PLAN)
+        if (plan is None):
+            return
+        # Restore the default for in-memory scenes
+        if (self._default_cache_max is None):
+            self._default_cache_max = gdal.GetCacheMax()
+        gdal.SetCacheMax(plan['cache_bytes'] or self._default_cache_max)
+
+    def _getWarpCache(self, context):
+        # One cache handle per process, created on first use
+        if not (eval(context[Context.WARP_CACHE_FLAG])):
+            return None
+        if (self._warp_cache is None):
+            self._warp_cache = WarpCache(context[Context.DIR_WARP],
+                                         float(context[Context.WARP_CACHE_SIZE]) * (1 << 30),
+                                         eval(context[Context.WARP_CACHE_HASH_FLAG]))
+        return self._warp_cache
+
+    def getWarpCacheStats(self):
+        return None if self._warp_cache is None else self._warp_cache.getStats()
+
     def __getReprojection(self, context):
         self._validateParms(context, [Context.FN_LIST])
 
@@ -439,30 +764,23 @@ class RasterLib(object):
 
     def prepareQualityFlagMask(self, context):
         self._validateParms(context,
-                            [Context.MA_WARP_LIST, Context.LIST_INDEX_CLOUDMASK])
-
-        # Mask out clouds
-        cloudmask_warp_ds_target = context[Context.DS_WARP_LIST][context[Context.LIST_INDEX_TARGET]]
-        cloudmask_warp_ma = iolib.ds_getma(cloudmask_warp_ds_target, 8)
-        # cloudmaskWarpExternalBandMaArray = iolib.fn_getma(context[Context.FN_TARGET_DOWNSCALE], 8)
-        # cloudmaskWarpExternalBandMaArrayMasked = \
-        #     np.ma.masked_where(cloudmask_warp_ma == 1.0, cloudmask_warp_ma)
-
-        # Create a mask where the pixel values equal to '0, 3, 4' are suppressed because these correspond to NoData, Clouds, and Cloud Shadows
-        self._plot_lib.trace(
-            f'\nSuppress values=[0, 3, 4] according to Band #8 because they correspond to NoData, Clouds, and Cloud Shadows')
-        #        cloudmaskWarpExternalBandMaArrayMasked = (cloudmaskWarpExternalBandMaArray == 0) & (cloudmaskWarpExternalBandMaArray == 3) & (cloudmaskWarpExternalBandMaArray == 4)
-
-        ndv = int(Context.DEFAULT_NODATA_VALUE)
-        cloudmaskWarpExternalBandArrayData = np.ma.getdata(cloudmask_warp_ma)
-        cloudmaskWarpExternalBandArrayDataQfFiltered = np.select(
-            [cloudmaskWarpExternalBandArrayData == 0, cloudmaskWarpExternalBandArrayData == 3,
-             cloudmaskWarpExternalBandArrayData == 4], [ndv, ndv, ndv], cloudmaskWarpExternalBandArrayData)
-        cloudmaskWarpExternalBandArrayDataQfNdvFiltered = np.select([cloudmaskWarpExternalBandArrayDataQfFiltered != ndv], [0.0],
-                                                         cloudmaskWarpExternalBandArrayDataQfFiltered)
-        cloudmaskWarpExternalBandMaArrayMasked = np.ma.masked_where(cloudmaskWarpExternalBandArrayDataQfNdvFiltered == ndv,
-                                                                    cloudmaskWarpExternalBandArrayDataQfNdvFiltered)
-        return cloudmaskWarpExternalBandMaArrayMasked
+                            [Context.DS_WARP_LIST, Context.LIST_QUALITY_MASK])
+
+        #  Get Band 8 of the warped target (https://glad.umd.edu/Potapov/ARD/ARD_manual_v1.1.pdf)
+        qf_warp_ds_target = context[Context.DS_WARP_LIST][context[Context.LIST_INDEX_TARGET]]
+        qf_band = qf_warp_ds_target.GetRasterBand(8)
+        qf_ndv_list = [ndv for ndv in (qf_band.GetNoDataValue(), Context.DEFAULT_NODATA_VALUE) if ndv is not None]
+        qf_band = qf_band.ReadAsArray()
+
+        # Suppress the --qfmasklist values (default 0, 3, 4 = NoData, Clouds and Cloud Shadows) with one table
+        # lookup, and the nodata of band 8 (outside the table)
+        quality_mask = QualityMask.fromList(context[Context.LIST_QUALITY_MASK])
+        self._plot_lib.trace(f'\nSuppress {quality_mask} and nodata {sorted(set(qf_ndv_list))} according to Band #8')
+        qf_mask = quality_mask.getMask(qf_band)
+        for qf_ndv in qf_ndv_list:
+            qf_mask |= np.isnan(qf_band) if np.isnan(qf_ndv) else (qf_band == qf_ndv)
+        qf_band = None
+        return np.ma.array(np.zeros(qf_mask.shape, dtype=np.uint8), mask=qf_mask)
 
     def _prepareQualityFlagMask(self, context):
         self._validateParms(context,
@@ -512,16 +830,12 @@ class RasterLib(object):
                                  title='cloudmaskWarpExternalBandMaArrayMasked')
         return cloudmaskWarpExternalBandMaArrayMasked
 
-    def ma2df(self, ma, product, band):
-        raveled = ma.ravel()
-        unmasked = raveled[raveled.mask == False]
-        df = pd.DataFrame(unmasked)
-        df.columns = [product + band]
-        df[product + band] = df[product + band] * 0.0001
-        return df
-
     def generateCSV(self, context, sr_metrics_list):
         if (eval(context[Context.CSV_FLAG])):
+            # Scene-level stage measurements (same value on every band row)
+            if (eval(context[Context.PROFILE_FLAG])):
+                for column, value in StageProfiler.getColumns(context.get(Context.PROFILE_LIST, [])).items():
+                    sr_metrics_list[column] = value
             batch = context[Context.BATCH_NAME]
             if (batch == 'None'):
                 batch = os.path.basename(context[Context.DIR_TOA])
@@ -529,62 +843,62 @@ class RasterLib(object):
                          + '_' + context[Context.REGRESSION_MODEL]
             path = os.path.join(context[Context.DIR_OUTPUT_CSV],
                                             figureBase + '_SRLite_metrics.csv')
-            sr_metrics_list.to_csv(path)
+            with self.atomicOutput(path) as tmp_path:
+                sr_metrics_list.to_csv(tmp_path)
             self._plot_lib.trace(f"\nCreated CSV with coefficients...\n   {path}")
 
     def prepareMasks(self, context):
+        self._validateParms(context, [Context.DS_WARP_LIST, Context.LIST_BAND_PAIR_INDICES])
+
+        # Band-independent masks are built once per scene and bit-packed; nodata and negative
+        # values of each band pair are added in _getCommonMask()
+        warp_ds = context[Context.DS_WARP_LIST][context[Context.LIST_INDEX_TOA]]
+        engine = MaskEngine((warp_ds.RasterYSize, warp_ds.RasterXSize))
+        positive = eval(context[Context.POSITIVE_MASK_FLAG])
 
         # Get optional Cloudmask
         if (eval(context[Context.CLOUD_MASK_FLAG])):
-            context['cloudmaskEVHRWarpExternalBandMaArrayMasked'] = self.prepareEVHRCloudmask(context)
+            engine.add('cloudmask', self.prepareEVHRCloudmask(context), positive)
 
         # Get optional Quality flag mask
         if (eval(context[Context.QUALITY_MASK_FLAG])):
-            context['cloudmaskQFWarpExternalBandMaArrayMasked'] = self.prepareQualityFlagMask(context)
+            engine.add('qf', self.prepareQualityFlagMask(context), positive)
+
+        #  Create single mask for all bands based on Blue-band threshold values
+        #  Assumes Blue-band is first indice pair
+        if (eval(context[Context.THRESHOLD_MASK_FLAG])):
+            blueBandIndex = context[Context.LIST_BAND_PAIR_INDICES][1][context[Context.LIST_INDEX_TOA]]
+            toaBlueBandMaArray = iolib.ds_getma(warp_ds, blueBandIndex)
+            engine.add('threshold', self._applyThreshold(context[Context.THRESHOLD_MIN],
+                                                         context[Context.THRESHOLD_MAX],
+                                                         toaBlueBandMaArray), positive)
+            toaBlueBandMaArray = None
+
+        self._plot_lib.trace(f'Scene masks (masked pixels): {engine.getCounts()}, combined: {engine.getCount()}')
+        context[Context.MASK_ENGINE] = engine
+        return engine
 
     def _getCommonMask(self, context, targetBandArray, toaBandArray):
 
-        context['evhrBandMaThresholdArray'] = None
         #  Create a common mask that intersects the CCDC/QF, EVHR, and Cloudmasks - this will then be used to correct the input EVHR & CCDC/QF
-        warp_ma_band_list_all = [targetBandArray, toaBandArray]
-        if (eval(context[Context.CLOUD_MASK_FLAG])):
-            warp_ma_band_list_all.append(context['cloudmaskEVHRWarpExternalBandMaArrayMasked'])
-        if (eval(context[Context.QUALITY_MASK_FLAG])):
-            warp_ma_band_list_all.append(context['cloudmaskQFWarpExternalBandMaArrayMasked'])
-        if (eval(context[Context.THRESHOLD_MASK_FLAG])):
-            if (context['evhrBandMaThresholdArray']  == None):
-                #  Create single mask for all bands based on Blue-band threshold values
-                #  Assumes Blue-band is first indice pair, so collect mask on 1st iteration only.
-                context['evhrBandMaThresholdArray'] = self._applyThreshold(context[Context.THRESHOLD_MIN],
-                                                                           context[Context.THRESHOLD_MAX],
-                                                                           toaBandArray)
-                firstBand = False
-            warp_ma_band_list_all.append(context['evhrBandMaThresholdArray'])
+        band_mask = np.ma.getmaskarray(targetBandArray) | np.ma.getmaskarray(toaBandArray)
 
         # Mask negative values in input (if requested)
         if (eval(context[Context.POSITIVE_MASK_FLAG])):
-            warp_valid_ma_band_list_all = [np.ma.masked_where(ma < 0, ma) for ma in warp_ma_band_list_all]
-        else:
-            warp_valid_ma_band_list_all = warp_ma_band_list_all
-
-        # Create common mask
-        common_mask_band_all = malib.common_mask(warp_valid_ma_band_list_all)
+            band_mask |= (np.ma.getdata(targetBandArray) < 0) | (np.ma.getdata(toaBandArray) < 0)
 
-        return common_mask_band_all
+        return context[Context.MASK_ENGINE].getMask(band_mask)
 
-    def predictSurfaceReflectance(self, context, band_name, toa_hr_band, target_sr_band, toa_sr_band):
+    def fitSurfaceReflectance(self, context, band_name, target_sr_band, toa_sr_band):
 
         # Perform regression fit based on model type (TARGET against TOA)
         target_sr_band = target_sr_band.ravel()
         toa_sr_band = toa_sr_band.ravel()
-        sr_prediction_band = None
         model_data_only_band = None
         metadata = {}
 
         target_sr_data_only_band = target_sr_band[target_sr_band.mask == False]
-        target_sr_data_only_band_reshaped = target_sr_data_only_band.reshape(-1, 1)
         toa_sr_data_only_band = toa_sr_band[toa_sr_band.mask == False]
-        toa_sr_data_only_band_reshaped = toa_sr_data_only_band.reshape(-1, 1)
 
         ####################
         ### Huber (robust) Regressor
@@ -593,49 +907,29 @@ class RasterLib(object):
             # ravel the Y band (e.g., CCDC) - /home/gtamkin/.conda/envs/ilab_gt/lib/python3.7/site-packages/sklearn/utils/validation.py:993: DataConversion
             # Warning: A column-vector y was passed when a 1d array was expected. Please change the shape of y to (n_samples, ), for example using ravel().
             model_data_only_band = HuberRegressor().fit(
-                toa_sr_data_only_band_reshaped, target_sr_data_only_band_reshaped.ravel())
+                toa_sr_data_only_band.reshape(-1, 1), target_sr_data_only_band)
 
             #  band-specific metadata
-            metadata = self._model_metrics_(model_data_only_band.intercept_,
+            metadata = self._model_metrics_(context, model_data_only_band.intercept_,
                                             model_data_only_band.coef_[0],
                                             toa_sr_data_only_band,
                                             target_sr_data_only_band)
 
-            sr_prediction_band = model_data_only_band.predict(toa_hr_band.reshape(-1, 1))
-
         ####################
-        ### OLS (simple) Regressor
+        ### OLS (simple) and Reduced Major Axis (rma) Regressors - closed form from sufficient statistics
         ####################
-        elif (context[Context.REGRESSION_MODEL] == Context.REGRESSOR_MODEL_OLS):
-            model_data_only_band = LinearRegression().fit(
-                toa_sr_data_only_band_reshaped, target_sr_data_only_band_reshaped)
+        elif (context[Context.REGRESSION_MODEL] in (Context.REGRESSOR_MODEL_OLS, Context.REGRESSOR_MODEL_RMA)):
+            model_data_only_band = ClosedFormRegression(context[Context.REGRESSION_MODEL],
+                                                        self.getWorkingDtype(context)).fit(
+                toa_sr_data_only_band, target_sr_data_only_band)
 
             #  band-specific metadata
-            metadata = self._model_metrics_(model_data_only_band.intercept_,
-                                            model_data_only_band.coef_[0],
+            metadata = self._model_metrics_(context, model_data_only_band.intercept_,
+                                            model_data_only_band.slope_,
                                             toa_sr_data_only_band,
-                                            target_sr_data_only_band)
-
-            sr_prediction_band = model_data_only_band.predict(toa_hr_band.reshape(-1, 1))
-
-        ####################
-        ### Reduced Major Axis (rma) Regressor
-        ####################
-        elif (context[Context.REGRESSION_MODEL] == Context.REGRESSOR_MODEL_RMA):
-
-            reflect_df = pd.concat([
-                self.ma2df(toa_sr_data_only_band, 'EVHR_TOA', 'Band'),
-                self.ma2df(target_sr_data_only_band, 'CCDC_SR', 'Band')],
-                axis=1)
-            model_data_only_band = regress2(np.array(reflect_df['EVHR_TOABand']), np.array(reflect_df['CCDC_SRBand']),
-                                            _method_type_2="reduced major axis")
-
-            metadata = self._model_metrics_(model_data_only_band['slope'],
-                                            model_data_only_band['intercept'],
-                                            toa_sr_data_only_band,
-                                            target_sr_data_only_band)
-
-            sr_prediction_band = (toa_hr_band * metadata['slope']) + (metadata['intercept'] * 10000)
+                                            target_sr_data_only_band,
+                                            model_data_only_band.score_,
+                                            model_data_only_band.stats_)
 
         else:
             print('Invalid regressor specified %s' % context[Context.REGRESSION_MODEL])
@@ -647,6 +941,39 @@ class RasterLib(object):
         # add context-sensitive
         metadata['band'] = band_name
         metadata['regressor'] = context[Context.REGRESSION_MODEL]
+        return model_data_only_band, metadata
+
+    def applySurfaceReflectance(self, model, toa_hr_band, dtype=np.float64):
+
+        # Apply the fitted (linear) model to (a window of) the 2m TOA band in the working precision
+        slope, intercept = self._getLinearCoefficients(model)
+        dtype = np.dtype(dtype)
+        prediction = np.ma.getdata(toa_hr_band).reshape(-1).astype(dtype)
+        prediction *= dtype.type(slope)
+        prediction += dtype.type(intercept)
+        return prediction
+
+    def getWorkingDtype(self, context):
+        # float32 halves the memory of fits and predictions (sums are still accumulated in float64)
+        if (context[Context.PRECISION] == Context.PRECISION_FLOAT64):
+            return np.float64
+        return np.float32
+
+    def _getOutputType(self, context, toa_data_type):
+        """
+        :return: (GDAL data type, scale) of the SR-Lite bands - scale is None unless written as scaled int16
+        """
+        if (context[Context.PRECISION] != Context.PRECISION_INT16):
+            return toa_data_type, None
+        # Integer TOA is already in scaled reflectance units
+        if (gdal.GetDataTypeName(toa_data_type).startswith('Float')):
+            return gdal.GDT_Int16, Context.DEFAULT_INT16_SCALE
+        return gdal.GDT_Int16, 1.0
+
+    def predictSurfaceReflectance(self, context, band_name, toa_hr_band, target_sr_band, toa_sr_band):
+
+        model_data_only_band, metadata = self.fitSurfaceReflectance(context, band_name, target_sr_band, toa_sr_band)
+        sr_prediction_band = self.applySurfaceReflectance(model_data_only_band, toa_hr_band)
         return sr_prediction_band, metadata
 
     def mean_bias_error(self, y_true, y_pred):
@@ -667,49 +994,178 @@ class RasterLib(object):
             # print('MBE = ', mbe)
             return mbe
 
+    def _isMetricsRequired(self, context):
+        # Full metrics are only consumed by the CSV and by tracing
+        return (eval(context[Context.CSV_FLAG])) or (self._debug_level >= 1)
+
 #    def _sr_performance_(self, context, df, sr_model, bandName):
-    def _model_metrics_(self, slope, intercept, toa_sr_data_only_band, target_sr_data_only_band):
+    def _model_metrics_(self, context, intercept, slope, toa_sr_data_only_band, target_sr_data_only_band,
+                        score=None, stats=None):
 
             metadata = {}
             metadata['intercept'] = intercept
             metadata['slope']  = slope
-
-            sr_model = LinearRegression().fit(toa_sr_data_only_band.reshape(-1,1), target_sr_data_only_band)
-#            sr_model = LinearRegression().fit(toa_sr_data_only_band.values.reshape(-1,1), target_sr_data_only_band)
-            metadata['score']  = sr_model.score(toa_sr_data_only_band.reshape(-1, 1), target_sr_data_only_band)
-            metadata['r2_score']  = sklearn.metrics.r2_score(target_sr_data_only_band.reshape(-1, 1), toa_sr_data_only_band)
-            metadata['explained_variance']  = sklearn.metrics.explained_variance_score(target_sr_data_only_band.reshape(-1, 1),
-                                                                          toa_sr_data_only_band)
-            metadata['mbe']  = self.mean_bias_error(target_sr_data_only_band.reshape(-1, 1), toa_sr_data_only_band)
-            metadata['mae']  = sklearn.metrics.mean_absolute_error(target_sr_data_only_band.reshape(-1, 1), toa_sr_data_only_band)
-            metadata['mape']  = sklearn.metrics.mean_absolute_percentage_error(target_sr_data_only_band.reshape(-1, 1),
-                                                                 toa_sr_data_only_band)
-            metadata['medae']  = sklearn.metrics.median_absolute_error(target_sr_data_only_band.reshape(-1, 1), toa_sr_data_only_band)
-            metadata['mse']  = sklearn.metrics.mean_squared_error(target_sr_data_only_band.reshape(-1, 1), toa_sr_data_only_band)
-            metadata['rmse']  = metadata['mse'] ** 0.5
-            metadata['mean_ccdc_sr']  = target_sr_data_only_band.mean()
-            metadata['mean_evhr_srlite']  = toa_sr_data_only_band.mean()
-            metadata['mae_norm']  = metadata['mae'] / metadata['mean_ccdc_sr']
-            metadata['rmse_norm']  = metadata['rmse'] / metadata['mean_ccdc_sr']
+            if not (self._isMetricsRequired(context)):
+                if score is not None:
+                    metadata['score'] = score
+                return metadata
+
+            # OLS coefficient of determination (r^2) - from sufficient statistics unless the fit already has it
+            if stats is None:
+                stats = SufficientStatistics.fromArrays(toa_sr_data_only_band, target_sr_data_only_band)
+            if score is None:
+                score = ClosedFormRegression().fitStatistics(stats).score_
+            metadata['score']  = score
+            metadata.update(RegressionMetrics.fromArrays(target_sr_data_only_band, toa_sr_data_only_band, stats))
 
             return metadata
 
     def simulateSurfaceReflectance(self, context):
         self._validateParms(context,
-                            [Context.MA_WARP_LIST, Context.LIST_BAND_PAIRS, Context.LIST_BAND_PAIR_INDICES,
-                             Context.REGRESSION_MODEL, Context.FN_LIST])
-
-        bandPairIndicesList = context[Context.LIST_BAND_PAIR_INDICES]
-#        numBandPairs = len(bandPairIndicesList)
+                            [Context.MA_WARP_LIST, Context.DS_WARP_LIST, Context.LIST_BAND_PAIRS,
+                             Context.LIST_BAND_PAIR_INDICES, Context.REGRESSION_MODEL, Context.FN_LIST])
 
         sr_prediction_list = []
         sr_metrics_list = []
+
+        warp_ds = context[Context.DS_WARP_LIST][context[Context.LIST_INDEX_TOA]]
+        with self.profileStage(context, 'masks') as stage:
+            self.prepareMasks(context)
+            stage['pixels'] = warp_ds.RasterXSize * warp_ds.RasterYSize
+
+        ########################################
+        # ### FIT - capture coefficients for each band pair from the 30m intersected pixels
+        ########################################
+        with self.profileStage(context, 'fit') as stage:
+            if (eval(context[Context.BATCH_FIT_FLAG])):
+                model_list = self.fitSurfaceReflectanceBatch(context)
+            else:
+                model_list = self.fitSurfaceReflectanceByBand(context)
+            stage['pixels'] = warp_ds.RasterXSize * warp_ds.RasterYSize * len(model_list)
+        context[Context.MODEL_LIST] = model_list
+
+        ########################################
+        # ### APPLY - predict surface reflectance from the 2m EVHR
+        # In streaming mode the predictions are computed by GDAL from a VRT in createImage()
+        ########################################
+        if not (eval(context[Context.STREAM_FLAG])):
+            with self.profileStage(context, 'apply') as stage:
+                sr_prediction_list = self.applySurfaceReflectanceStack(context, model_list)
+                stage['pixels'] = sum(band.size for band in sr_prediction_list)
+
+        ########### save metadata for each band #############
+        for bandPairIndex in range(0, len(model_list)):
+            metadata = model_list[bandPairIndex][1]
+            if (bandPairIndex == 0):
+               sr_metrics_list = pd.concat([pd.DataFrame([metadata], index=[bandPairIndex])])
+            else:
+                sr_metrics_list = pd.concat([sr_metrics_list, pd.DataFrame([metadata], index=[bandPairIndex])])
+
+        sr_metrics_list.reset_index()
+        return sr_prediction_list, sr_metrics_list
+
+    def applySurfaceReflectanceStack(self, context, model_list):
+
+        if (int(context[Context.THREADS]) > 1) or (context[Context.STORAGE_TYPE] == Context.STORAGE_TYPE_FILE):
+            return self.applySurfaceReflectanceWindows(context, model_list)
+
+        bandNamePairList = list(ast.literal_eval(context[Context.LIST_BAND_PAIRS]))
+        sr_prediction_list = []
+
+        # Get 2m TOA Masked Array stack - each TOA block is decoded once for all bands
+        toaStackMaArray = self.readToaStack(context)
+
+        for bandPairIndex in range(0, len(model_list)):
+            model, metadata = model_list[bandPairIndex]
+            toaBandMaArrayRaw = toaStackMaArray[bandPairIndex]
+
+            ########################################
+            # #### Apply the model to the original EVHR (2m) to predict surface reflectance
+            ########################################
+            self._plot_lib.trace(
+                f'Applying model to {str(bandNamePairList[bandPairIndex])} in file '
+                f'{os.path.basename(context[Context.FN_LIST][context[Context.LIST_INDEX_TOA]])}')
+            sr_prediction_band = self.applySurfaceReflectance(model, toaBandMaArrayRaw, self.getWorkingDtype(context))
+
+            # Return to original shape and apply original mask
+            toa_sr_ma_band = np.ma.array(sr_prediction_band.reshape(toaBandMaArrayRaw.shape), mask=toaBandMaArrayRaw.mask)
+
+            # Check resulting ma
+            self._plot_lib.trace(f'Final masked array shape: {toa_sr_ma_band.shape}')
+            sr_prediction_list.append(toa_sr_ma_band)
+
+        toaStackMaArray = None
+        return sr_prediction_list
+
+    def applySurfaceReflectanceWindows(self, context, model_list):
+        """
+        Apply the models to row windows of the 2m TOA on a thread pool.  GDAL reads and NumPy
+        arithmetic release the GIL; every window is written to its own rows of preallocated
+        band arrays, so the result does not depend on the order in which windows complete.
+        With --storage file the band arrays are memory-mapped scratch files.
+        """
+        threads = int(context[Context.THREADS])
+        dtype = self.getWorkingDtype(context)
+        toa_fn = str(context[Context.FN_TOA])
+
+        with rasterio.open(toa_fn) as src:
+            height, width = src.height, src.width
+            block_rows = src.block_shapes[0][0]
+        # Working set of a window row: TOA and prediction values plus the mask of every band pair
+        row_bytes = width * len(model_list) * (2 * np.dtype(dtype).itemsize + 1)
+        window_list = self._getRowWindows(context, height, width, block_rows, row_bytes)
+        self._plot_lib.trace(f'Applying models to {len(window_list)} windows of '
+                             f'{os.path.basename(toa_fn)} on {threads} threads')
+
+        prediction_list = [self._allocate(context, f'prediction-{index}', (height, width), dtype)
+                           for index in range(0, len(model_list))]
+        mask_list = [self._allocate(context, f'mask-{index}', (height, width), bool)
+                     for index in range(0, len(model_list))]
+
+        def applyWindow(window):
+            # Datasets are not shared between threads
+            with rasterio.open(toa_fn) as window_src:
+                toaStackMaArray = self.readToaStack(context, window, window_src)
+            rows = slice(window.row_off, window.row_off + window.height)
+            for bandPairIndex in range(0, len(model_list)):
+                toaBandMaArray = toaStackMaArray[bandPairIndex]
+                prediction_list[bandPairIndex][rows] = self.applySurfaceReflectance(
+                    model_list[bandPairIndex][0], toaBandMaArray, dtype).reshape(toaBandMaArray.shape)
+                mask_list[bandPairIndex][rows] = np.ma.getmaskarray(toaBandMaArray)
+            return window.height * window.width
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            # list() re-raises the first failure of any window
+            list(executor.map(applyWindow, window_list))
+
+        return [np.ma.array(prediction_list[index], mask=mask_list[index]) for index in range(0, len(model_list))]
+
+    def _allocate(self, context, name, shape, dtype):
+        # Memory-mapped scratch file for --storage file (removed by refresh()), otherwise an in-memory array
+        if (context[Context.STORAGE_TYPE] == Context.STORAGE_TYPE_FILE):
+            return np.memmap(os.path.join(self.getScratchDir(context), name + '.dat'),
+                             dtype=dtype, mode='w+', shape=shape)
+        return np.empty(shape, dtype=dtype)
+
+    def _getRowWindows(self, context, height, width, block_rows, row_bytes):
+        # Full-width windows of about --window squared pixels, capped so that the windows in flight fit the
+        # cache bytes of the memory plan, and aligned to the TOA blocks.  Threads only set how many run at once.
+        window_rows = max(1, int(context[Context.WINDOW_SIZE]) ** 2 // width)
+        plan = context.get(Context.MEMORY_PLAN)
+        if (plan is not None) and (plan['cache_bytes'] is not None):
+            window_rows = min(window_rows, plan['cache_bytes'] // (int(context[Context.THREADS]) * row_bytes))
+        window_rows = max(1, window_rows // block_rows) * block_rows
+        return [Window(0, row, width, min(window_rows, height - row))
+                for row in range(0, height, window_rows)]
+
+    def fitSurfaceReflectanceByBand(self, context):
+
+        bandPairIndicesList = context[Context.LIST_BAND_PAIR_INDICES]
         warp_ds_list = context[Context.DS_WARP_LIST]
         bandNamePairList = list(ast.literal_eval(context[Context.LIST_BAND_PAIRS]))
+        model_list = []
         minWarning = 0
 
-        self.prepareMasks(context)
-
         ########################################
         # ### FOR EACH BAND PAIR,
         # now, each input should have same exact dimensions, grid, projection. They ony differ in their values (CCDC is surface reflectance, EVHR is TOA reflectance)
@@ -746,41 +1202,85 @@ class RasterLib(object):
             # ### WARPED MASKED ARRAY WITH COMMON MASK, DATA VALUES ONLY
             # CCDC SR is first element in list, which needs to be the y-var: b/c we are predicting SR from TOA ++++++++++[as per PM - 01/05/2022]
             ########################################
+            model, metadata = self.fitSurfaceReflectance(context,
+                                                         bandNamePairList[bandPairIndex][1],
+                                                         warp_ma_masked_band_list[context[Context.LIST_INDEX_TARGET]],
+                                                         warp_ma_masked_band_list[context[Context.LIST_INDEX_TOA]])
+            self._plot_lib.trace(f'Metrics: {metadata}')
+            model_list.append([model, metadata])
 
-            # Get 2m TOA Masked Array
-            toaBandMaArrayRaw = iolib.fn_getma(context[Context.FN_TOA], bandPairIndices[context[Context.LIST_INDEX_TOA]])
-            sr_prediction_band, metadata = self.predictSurfaceReflectance(context,
-                                                                bandNamePairList[bandPairIndex][1],
-                                                                toaBandMaArrayRaw,
-                                                                warp_ma_masked_band_list[context[Context.LIST_INDEX_TARGET]],
-                                                                warp_ma_masked_band_list[context[Context.LIST_INDEX_TOA]])
-
-            ########################################
-            # #### Apply the model to the original EVHR (2m) to predict surface reflectance
-            ########################################
-            self._plot_lib.trace(
-                f'Applying model to {str(bandNamePairList[bandPairIndex])} in file '
-                f'{os.path.basename(context[Context.FN_LIST][context[Context.LIST_INDEX_TOA]])}')
+            print(f"Finished with {str(bandNamePairList[bandPairIndex])} Band")
 
-            # Return to original shape and apply original mask
-            toa_sr_ma_band = np.ma.array(sr_prediction_band.reshape(toaBandMaArrayRaw.shape), mask=toaBandMaArrayRaw.mask)
+        return model_list
 
-            # Check resulting ma
-            self._plot_lib.trace(f'Input masked array shape: {toaBandMaArray.shape} and Final masked array shape: {toa_sr_ma_band.shape}')
-            self._plot_lib.trace(f'Metrics: {metadata}')
+    def _getWarpStack(self, ds, bandIndices):
+        """
+        Read the requested bands of a warped dataset in one call as (bands, pixels) data and nodata mask
+        """
+        data = ds.ReadAsArray().reshape(ds.RasterCount, -1)[np.asarray(bandIndices) - 1]
+        mask = np.zeros(data.shape, dtype=bool)
+        for row, bandIndex in enumerate(bandIndices):
+            ndv = ds.GetRasterBand(int(bandIndex)).GetNoDataValue()
+            if ndv is not None:
+                mask[row] |= (data[row] == ndv)
+        if data.dtype.kind == 'f':
+            mask |= ~np.isfinite(data)
+        return data, mask
+
+    def fitSurfaceReflectanceBatch(self, context):
+        self._validateParms(context, [Context.DS_WARP_LIST, Context.LIST_BAND_PAIR_INDICES])
+
+        bandPairIndicesList = context[Context.LIST_BAND_PAIR_INDICES][1:]
+        warp_ds_list = context[Context.DS_WARP_LIST]
+        bandNamePairList = list(ast.literal_eval(context[Context.LIST_BAND_PAIRS]))
+        model_list = []
+        minWarning = 0
 
-            ########### save predictions and metadata for each band #############
-            sr_prediction_list.append(toa_sr_ma_band)
-            if (bandPairIndex == 0):
-               sr_metrics_list = pd.concat([pd.DataFrame([metadata], index=[bandPairIndex])])
-            else:
-                sr_metrics_list = pd.concat([sr_metrics_list, pd.DataFrame([metadata], index=[bandPairIndex])])
+        ########################################
+        # Read the warped 30m stacks once as (bands, pixels) arrays
+        ########################################
+        targetStack, targetMask = self._getWarpStack(warp_ds_list[context[Context.LIST_INDEX_TARGET]],
+                                                     [pair[context[Context.LIST_INDEX_TARGET]] for pair in bandPairIndicesList])
+        toaStack, toaMask = self._getWarpStack(warp_ds_list[context[Context.LIST_INDEX_TOA]],
+                                               [pair[context[Context.LIST_INDEX_TOA]] for pair in bandPairIndicesList])
 
-            print(f"Finished with {str(bandNamePairList[bandPairIndex])} Band")
+        # Band-independent masks were packed once by prepareMasks(); nodata (and negatives) are per band
+        common_mask = targetMask | toaMask
+        if (eval(context[Context.POSITIVE_MASK_FLAG])):
+            common_mask |= (targetStack < 0) | (toaStack < 0)
+        common_mask = context[Context.MASK_ENGINE].getMask(common_mask)
 
-        sr_metrics_list.reset_index()
-        return sr_prediction_list, sr_metrics_list
+        ########################################
+        # Per-band sufficient statistics in one vectorized pass
+        ########################################
+        stats = SufficientStatistics.fromArrays(toaStack, targetStack, mask=common_mask,
+                                                dtype=self.getWorkingDtype(context))
+        self._plot_lib.trace(f'Batched fit of {len(bandPairIndicesList)} band pairs, valid pixels per band: {stats.n}')
+
+        for bandPairIndex in range(0, len(bandPairIndicesList)):
+            valid = ~common_mask[bandPairIndex]
+            target_sr_data_only_band = targetStack[bandPairIndex][valid]
+            toa_sr_data_only_band = toaStack[bandPairIndex][valid]
+            if (min(target_sr_data_only_band.min(initial=0), toa_sr_data_only_band.min(initial=0)) < minWarning):
+                self._plot_lib.trace("Warning: Masked array values should be larger than " + str(minWarning))
+
+            if (context[Context.REGRESSION_MODEL] in (Context.REGRESSOR_MODEL_OLS, Context.REGRESSOR_MODEL_RMA)):
+                model = ClosedFormRegression(context[Context.REGRESSION_MODEL],
+                                             self.getWorkingDtype(context)).fitStatistics(stats[bandPairIndex])
+                metadata = self._model_metrics_(context, model.intercept_, model.slope_,
+                                                toa_sr_data_only_band, target_sr_data_only_band, model.score_,
+                                                stats[bandPairIndex])
+                metadata['band'] = bandNamePairList[bandPairIndex][1]
+                metadata['regressor'] = context[Context.REGRESSION_MODEL]
+            else:
+                # Iterative regressors (e.g., Huber) still need the pixels of each band
+                model, metadata = self.fitSurfaceReflectance(context, bandNamePairList[bandPairIndex][1],
+                                                             np.ma.array(target_sr_data_only_band, mask=False),
+                                                             np.ma.array(toa_sr_data_only_band, mask=False))
+            self._plot_lib.trace(f'Metrics: {metadata}')
+            model_list.append([model, metadata])
 
+        return model_list
 
     def createImage(self, context):
         self._validateParms(context, [Context.DIR_OUTPUT, Context.FN_PREFIX,
@@ -791,64 +1291,150 @@ class RasterLib(object):
                                       Context.LIST_TOA_BANDS])
 
         ########################################
-        # Create .tif image from band-based prediction layers
+        # Create COG image from band-based prediction layers in a single pass (no intermediate -noncog.tif)
         ########################################
         self._plot_lib.trace(f"\nAppy coefficients to High Res File...\n   {str(context[Context.FN_SRC])}")
 
-        now = datetime.now()  # current date and time
-
-        context[Context.FN_SUFFIX] = str(Context.FN_SRLITE_NONCOG_SUFFIX)
         context[Context.BAND_NUM] = len(list(context[Context.LIST_TOA_BANDS]))
         context[Context.BAND_DESCRIPTION_LIST] = list(context[Context.LIST_TOA_BANDS])
         context[Context.COG_FLAG] = True
         context[Context.TARGET_NODATA_VALUE] = int(Context.DEFAULT_NODATA_VALUE)
 
-        #  Derive file names for intermediate files
-        output_name = "{}/{}".format(
-            context[Context.DIR_OUTPUT], str(context[Context.FN_PREFIX])
-        ) + str(context[Context.FN_SUFFIX])
-
-        # Remove pre-COG image
-        fileExists = (os.path.exists(output_name))
-        if fileExists and (eval(context[Context.CLEAN_FLAG])):
-            self.removeFile(output_name, context[Context.CLEAN_FLAG])
+        with self.profileStage(context, 'image') as stage:
+            if (eval(context[Context.STREAM_FLAG])):
+                # Predictions are computed block by block by GDAL as the COG driver reads the VRT
+                src_ds = self._getPredictionVrt(context)
+            else:
+                src_ds = self._getPredictionMemDs(context)
+            stage['pixels'] = src_ds.RasterXSize * src_ds.RasterYSize * src_ds.RasterCount
 
-        # Read metadata of EVHR file
-        with rasterio.open(str(context[Context.FN_SRC])) as src0:
-            meta = src0.meta
+        # Create Cloud-optimized Geotiff (COG)
+        context[Context.FN_DEST] = "{}/{}".format(
+            context[Context.DIR_OUTPUT], str(context[Context.FN_PREFIX])
+        ) + str(Context.FN_SRLITE_SUFFIX)
+        with self.profileStage(context, 'cog') as stage:
+            cog_name = self.createCOG(context, src_ds)
+            stage['pixels'] = src_ds.RasterXSize * src_ds.RasterYSize * src_ds.RasterCount
+        src_ds = None
 
-        # Update meta to reflect the number of layers
-        numBandPairs = int(context[Context.BAND_NUM])
-        meta.update(count=numBandPairs)
+        self._plot_lib.trace(f"\nCreated COG from stack of regressed bands...\n   {cog_name}")
+        return cog_name
 
-        meta.update({
-            "nodata": context[Context.TARGET_NODATA_VALUE],
-            "descriptions": context[Context.BAND_DESCRIPTION_LIST]
-        })
+    def _getLinearCoefficients(self, model):
+        # (slope, intercept) of a fitted single-predictor linear model (closed form or sklearn)
+        return float(np.ravel(model.coef_)[0]), float(np.ravel(model.intercept_)[0])
 
+    def _getPredictionMemDs(self, context):
+        """
+        Copy the band predictions to a dataset on the grid of the 2m TOA - a MEM dataset, or a tiled
+        scratch GeoTIFF for --storage file
+        """
+        src_ds = gdal.Open(str(context[Context.FN_SRC]), gdal.GA_ReadOnly)
         band_data_list = context[Context.PRED_LIST]
         band_description_list = list(context[Context.BAND_DESCRIPTION_LIST])
+        numBandPairs = int(context[Context.BAND_NUM])
 
-        ########################################
-        # Read each layer and write it to stack
-        ########################################
-        with rasterio.open(output_name, 'w', **meta) as dst:
-            for id in range(0, numBandPairs):
-                bandPrediction = band_data_list[id]
-                dst.set_band_description(id+1, str(band_description_list[id]))
-                bandPrediction1 = np.ma.masked_values(bandPrediction, context[Context.TARGET_NODATA_VALUE])
-                dst.write_band(id+1, bandPrediction1)
-
-        if (context[Context.COG_FLAG]):
-            # Create Cloud-optimized Geotiff (COG)
-            context[Context.FN_SRC] = str(output_name)
-            context[Context.FN_DEST] = "{}/{}".format(
-                context[Context.DIR_OUTPUT], str(context[Context.FN_PREFIX])
-            ) + str(Context.FN_SRLITE_SUFFIX)
-            cog_name = self.createCOG(context)
+        data_type, scale = self._getOutputType(context, src_ds.GetRasterBand(1).DataType)
+        if (context[Context.STORAGE_TYPE] == Context.STORAGE_TYPE_FILE):
+            mem_ds = gdal.GetDriverByName('GTiff').Create(
+                os.path.join(self.getScratchDir(context), str(context[Context.FN_PREFIX]) + '-prediction.tif'),
+                src_ds.RasterXSize, src_ds.RasterYSize, numBandPairs, data_type,
+                options=['TILED=YES', 'BIGTIFF=IF_SAFER'])
+        else:
+            mem_ds = gdal.GetDriverByName('MEM').Create('', src_ds.RasterXSize, src_ds.RasterYSize, numBandPairs,
+                                                        data_type)
+        mem_ds.SetGeoTransform(src_ds.GetGeoTransform())
+        mem_ds.SetProjection(src_ds.GetProjection())
+        src_ds = None
+
+        for id in range(0, numBandPairs):
+            band = mem_ds.GetRasterBand(id+1)
+            band.SetNoDataValue(context[Context.TARGET_NODATA_VALUE])
+            band.SetDescription(str(band_description_list[id]))
+            if (scale is not None):
+                # Scaled int16: stored = round(sr / scale), recorded in the band scale/offset tags
+                band.SetScale(scale)
+                band.SetOffset(0.0)
+            # Copy in row strips so (memory-mapped) predictions are never filled as a whole
+            for row in range(0, mem_ds.RasterYSize, self.WRITE_STRIP_ROWS):
+                prediction = band_data_list[id][row:row + self.WRITE_STRIP_ROWS]
+                if (scale is not None):
+                    prediction = np.ma.array(np.clip(np.rint(np.ma.getdata(prediction) / scale),
+                                                     np.iinfo(np.int16).min + 1,
+                                                     np.iinfo(np.int16).max).astype(np.int16),
+                                             mask=np.ma.getmaskarray(prediction))
+                band.WriteArray(np.ma.filled(prediction, context[Context.TARGET_NODATA_VALUE]), 0, row)
+            prediction = None
+            # Release each prediction as soon as it is copied
+            band_data_list[id] = None
+        return mem_ds
+
+    def _getPredictionVrt(self, context):
+        """
+        Describe the predictions as a VRT over the 2m TOA: each band is a ComplexSource whose
+        ScaleRatio/ScaleOffset are the fitted slope/intercept and whose TOA nodata maps to the output nodata
+        """
+        self._validateParms(context, [Context.MODEL_LIST, Context.LIST_BAND_PAIR_INDICES])
 
-        self._plot_lib.trace(f"\nCreated COG from stack of regressed bands...\n   {cog_name}")
-        return cog_name
+        src_fn = os.path.abspath(str(context[Context.FN_SRC]))
+        src_ds = gdal.Open(src_fn, gdal.GA_ReadOnly)
+        band_description_list = list(context[Context.BAND_DESCRIPTION_LIST])
+        toaBandIndices = self.getToaBandIndices(context)
+        # GDAL computes (and caches) predictions one VRT block at a time - --window, on TOA block edges
+        block_x, block_y = self._getBlockWindowSize(src_ds.GetRasterBand(toaBandIndices[0]),
+                                                    int(context[Context.WINDOW_SIZE]))
+
+        vrt = [f'<VRTDataset rasterXSize="{src_ds.RasterXSize}" rasterYSize="{src_ds.RasterYSize}">',
+               f'  <SRS>{saxutils.escape(src_ds.GetProjection())}</SRS>',
+               '  <GeoTransform>' + ', '.join(repr(value) for value in src_ds.GetGeoTransform()) + '</GeoTransform>']
+        for id, (model, metadata) in enumerate(context[Context.MODEL_LIST]):
+            slope, intercept = self._getLinearCoefficients(model)
+            toa_band = src_ds.GetRasterBand(toaBandIndices[id])
+            toa_ndv = toa_band.GetNoDataValue()
+            data_type, scale = self._getOutputType(context, toa_band.DataType)
+            vrt += [f'  <VRTRasterBand dataType="{gdal.GetDataTypeName(data_type)}" band="{id + 1}" '
+                    f'blockXSize="{block_x}" blockYSize="{block_y}">',
+                    f'    <NoDataValue>{context[Context.TARGET_NODATA_VALUE]}</NoDataValue>',
+                    f'    <Description>{saxutils.escape(str(band_description_list[id]))}</Description>']
+            if (scale is not None):
+                # Scaled int16: the source scaling also divides by the output scale
+                slope, intercept = slope / scale, intercept / scale
+                vrt += ['    <Offset>0.0</Offset>',
+                        f'    <Scale>{scale!r}</Scale>']
+            vrt += [
+                    '    <ComplexSource>',
+                    f'      <SourceFilename relativeToVRT="0">{saxutils.escape(src_fn)}</SourceFilename>',
+                    f'      <SourceBand>{toaBandIndices[id]}</SourceBand>']
+            if (toa_ndv is not None):
+                vrt += [f'      <NODATA>{toa_ndv!r}</NODATA>']
+            vrt += [f'      <ScaleOffset>{intercept!r}</ScaleOffset>',
+                    f'      <ScaleRatio>{slope!r}</ScaleRatio>',
+                    '    </ComplexSource>',
+                    '  </VRTRasterBand>']
+        vrt += ['</VRTDataset>']
+        src_ds = None
+
+        return gdal.Open('\n'.join(vrt))
+
+    def _getBlockWindowSize(self, band, window_size):
+        # (columns, rows) of a window of about window_size pixels per side whose edges fall on block boundaries
+        block_x, block_y = band.GetBlockSize()
+        return (max(block_x, (window_size // block_x) * block_x),
+                max(block_y, (window_size // block_y) * block_y))
+
+    def getToaBandIndices(self, context):
+        # TOA band index of each band pair (first entry of LIST_BAND_PAIR_INDICES is the pair count)
+        return [int(bandPairIndices[context[Context.LIST_INDEX_TOA]])
+                for bandPairIndices in context[Context.LIST_BAND_PAIR_INDICES][1:]]
+
+    def readToaStack(self, context, window=None, src=None):
+        """
+        Read all band-pair TOA bands (optionally a window) as one (bands, rows, cols) masked array
+        """
+        if (src is None):
+            with rasterio.open(str(context[Context.FN_TOA])) as src:
+                return src.read(self.getToaBandIndices(context), window=window, masked=True)
+        return src.read(self.getToaBandIndices(context), window=window, masked=True)
 
     def removeFile(self, fileName, cleanFlag):
 
@@ -856,17 +1442,45 @@ class RasterLib(object):
             if os.path.exists(fileName):
                 os.remove(fileName)
 
-    def createCOG(self, context):
+    def createCOG(self, context, src_ds=None):
         self._validateParms(context, [Context.FN_SRC, Context.CLEAN_FLAG,
                             Context.FN_DEST])
 
         # Clean pre-COG image
         self.removeFile(context[Context.FN_DEST], context[Context.CLEAN_FLAG])
-        self.cog(context)
-        self.removeFile(context[Context.FN_SRC], context[Context.CLEAN_FLAG])
-        
+        dest = context[Context.FN_DEST]
+        with self.atomicOutput(dest) as tmp_path:
+            if (src_ds is not None):
+                # Write directly from an in-memory or virtual source - nothing to clean up.  The COG is closed
+                # as soon as it is returned, before it is published, and not published if the write failed.
+                if gdal.Translate(tmp_path, src_ds, format="COG",
+                                  creationOptions=self._getCogOptions(context)) is None:
+                    raise RuntimeError('Could not write COG ' + str(dest))
+            else:
+                context[Context.FN_DEST] = tmp_path
+                try:
+                    self.cog(context)
+                finally:
+                    context[Context.FN_DEST] = dest
+                self.removeFile(context[Context.FN_SRC], context[Context.CLEAN_FLAG])
+
         return context[Context.FN_DEST]
 
+    @contextmanager
+    def atomicOutput(self, path):
+        """
+        Temporary name in the directory of path, renamed to path once written - an interrupted write
+        never leaves a truncated output under its final name
+        """
+        tmp_path = os.path.join(os.path.dirname(path) or '.',
+                                '.{}.{}.part'.format(os.path.basename(path), os.getpid()))
+        try:
+            yield tmp_path
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
     def _getProjSrs(self, in_raster):
         # Get projection from raster
         ds = gdal.Open(in_raster)
@@ -974,8 +1588,15 @@ class RasterLib(object):
                                       Context.TARGET_XRES, Context.TARGET_YRES])
 
         self.removeFile(context[Context.FN_DEST], context[Context.CLEAN_FLAG])
-        ds = gdal.Translate(context[Context.FN_DEST], context[Context.FN_SRC], format="COG")
-        ds = None
+        # Raise rather than leave a partial COG for createCOG() to publish
+        if gdal.Translate(context[Context.FN_DEST], context[Context.FN_SRC], format="COG",
+                          creationOptions=self._getCogOptions(context)) is None:
+            raise RuntimeError('Could not write COG ' + str(context[Context.FN_DEST]))
+
+    def _getCogOptions(self, context):
+        # The COG driver compresses (and builds overviews of) blocks on NUM_THREADS threads
+        threads = int(context[Context.THREADS])
+        return [f'NUM_THREADS={threads}'] if (threads > 1) else []
 
     def _applyThreshold(self, min, max, bandMaArray):
         ########################################
@@ -989,11 +1610,26 @@ class RasterLib(object):
         return bandMaThresholdRangeArray
 
     def get_ndv(self, r_fn):
+        if (self._catalog is not None):
+            entry = self._catalog.get(r_fn)
+            if (entry is not None):
+                return entry['nodata']
         with rasterio.open(r_fn) as src:
             return src.profile['nodata']
 
+    def removeScratch(self, context):
+        # Remove scratch files of disk-backed storage (warps, memory-mapped predictions and masks) - also
+        # called when a scene fails, so the arrays mapping them are released first
+        context[Context.MASK_ENGINE] = None
+        context[Context.PRED_LIST] = None
+        if (context.get(Context.DIR_SCRATCH) is not None):
+            shutil.rmtree(context[Context.DIR_SCRATCH], ignore_errors=True)
+            context[Context.DIR_SCRATCH] = None
+
     def refresh(self, context):
 
+        self.removeScratch(context)
+
         #Restore handles to file pool and reset internal flags
         if str(Context.DS_TOA_DOWNSCALE) in context:
             context[Context.DS_TOA_DOWNSCALE] = None
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# class SceneScheduler
+#
+# This class orders the scenes of a batch by estimated cost so that a pool
+# does not end on a few giant scenes.  The cost of a scene is the number of
+# 2m pixels the workflow applies the models to (TOA rows x columns x band
+# pairs, from raster headers - no pixels are read), in megapixels.  Scenes
+# are dispatched largest first (LPT), ties broken by path so the order is
+# deterministic.  calibrate() fits elapsed seconds to the predicted cost of
+# completed scenes.
+# -----------------------------------------------------------------------------
+class SceneScheduler(object):
+
+    # -------------------------------------------------------------------------
+    # __init__
+    # -------------------------------------------------------------------------
+    def __init__(self, band_pairs):
+        self.band_pairs = int(band_pairs)
+
+    # -------------------------------------------------------------------------
+    # estimate()
+    #
+    # Predicted cost (megapixels) of a scene from the header of its TOA
+    # -------------------------------------------------------------------------
+    def estimate(self, toa_shape):
+        """
+        :param toa_shape: (band count, rows, cols, ...) of the 2m TOA
+        """
+        count, rows, cols = toa_shape[:3]
+        return rows * cols * min(int(count), self.band_pairs) / 1E6
+
+    # -------------------------------------------------------------------------
+    # order()
+    #
+    # Largest scenes first - scenes of unknown cost last
+    # -------------------------------------------------------------------------
+    def order(self, items, costs):
+        """
+        :param items: TOA paths
+        :param costs: predicted cost of each item (dict keyed by str(item))
+        :return: ordered list of items
+        """
+        return sorted(items, key=lambda item: (-costs.get(str(item), 0.0), str(item)))
+
+    # -------------------------------------------------------------------------
+    # calibrate()
+    #
+    # Least-squares fit of elapsed = seconds_per_mpx * cost + overhead
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def calibrate(predicted, actual):
+        """
+        :param predicted: predicted costs (megapixels)
+        :param actual: elapsed seconds of the same scenes
+        :return: dict with the fitted seconds_per_mpx, overhead (s) and r2, or None if under-determined
+        """
+        pairs = [(float(x), float(y)) for x, y in zip(predicted, actual) if (x is not None) and (y is not None)]
+        count = len(pairs)
+        if (count < 2):
+            return None
+        mean_x = sum(x for x, y in pairs) / count
+        mean_y = sum(y for x, y in pairs) / count
+        sxx = sum((x - mean_x) ** 2 for x, y in pairs)
+        if (sxx == 0.0):
+            return None
+        slope = sum((x - mean_x) * (y - mean_y) for x, y in pairs) / sxx
+        overhead = mean_y - slope * mean_x
+        ss_tot = sum((y - mean_y) ** 2 for x, y in pairs)
+        ss_res = sum((y - (slope * x + overhead)) ** 2 for x, y in pairs)
+        return {'scenes': count, 'seconds_per_mpx': slope, 'overhead': overhead,
+                'r2': 1.0 - ss_res / ss_tot if ss_tot > 0 else 1.0}
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# coding: utf-8
+import heapq
+import os
+
+# -----------------------------------------------------------------------------
+# class ShardPlanner
+#
+# This class splits a batch of scenes into N deterministic, size-balanced
+# shards for multi-node job arrays.  Scenes are assigned largest first to the
+# least loaded shard (LPT scheduling), with ties broken by path and shard
+# index, so every task computes the same assignment from the same inputs.
+# The shard of a task comes from '--shard i/N' or from the SLURM job-array
+# environment ('--shard slurm').
+# -----------------------------------------------------------------------------
+class ShardPlanner(object):
+
+    SHARD_SLURM = 'slurm'
+    SLURM_TASK_ID = 'SLURM_ARRAY_TASK_ID'
+    SLURM_TASK_COUNT = 'SLURM_ARRAY_TASK_COUNT'
+    SLURM_TASK_MIN = 'SLURM_ARRAY_TASK_MIN'
+    SLURM_TASK_MAX = 'SLURM_ARRAY_TASK_MAX'
+
+    # -------------------------------------------------------------------------
+    # parse()
+    #
+    # (index, count) of a shard specification - (0, 1) when sharding is off
+    # -------------------------------------------------------------------------
+    @classmethod
+    def parse(cls, spec, environ=None):
+        """
+        :param spec: 'i/N' (0 <= i < N), 'slurm', or None
+        :param environ: environment used for 'slurm' (default os.environ)
+        """
+        if spec is None or str(spec) in ('', 'None'):
+            return 0, 1
+
+        if str(spec).lower() == cls.SHARD_SLURM:
+            if environ is None:
+                environ = os.environ
+            if cls.SLURM_TASK_ID not in environ:
+                raise ValueError('--shard slurm requires a job array (' + cls.SLURM_TASK_ID + ' is not set)')
+            task_min = int(environ.get(cls.SLURM_TASK_MIN, 0))
+            if cls.SLURM_TASK_COUNT in environ:
+                count = int(environ[cls.SLURM_TASK_COUNT])
+            else:
+                count = int(environ[cls.SLURM_TASK_MAX]) - task_min + 1
+            index = int(environ[cls.SLURM_TASK_ID]) - task_min
+        else:
+            try:
+                index, count = [int(value) for value in str(spec).split('/')]
+            except ValueError:
+                raise ValueError('Invalid shard ' + str(spec) + " - expected 'i/N' or 'slurm'")
+
+        if not (count > 0 and 0 <= index < count):
+            raise ValueError('Invalid shard {}/{} - the index must be in [0, {})'.format(index, count, count))
+        return index, count
+
+    # -------------------------------------------------------------------------
+    # assign()
+    #
+    # Split items into count shards of balanced total weight
+    # -------------------------------------------------------------------------
+    @classmethod
+    def assign(cls, items, count, weights):
+        """
+        :param items: scene paths
+        :param count: number of shards
+        :param weights: weight (e.g., size or pixel count) of each item
+        :return: list of count lists of items, each sorted
+        """
+        shards = [[] for index in range(0, count)]
+        loads = [(0, index) for index in range(0, count)]
+        for weight, item in sorted(zip(weights, items), key=lambda pair: (-pair[0], str(pair[1]))):
+            load, index = heapq.heappop(loads)
+            shards[index].append(item)
+            heapq.heappush(loads, (load + weight, index))
+        return [sorted(shard, key=str) for shard in shards]
+
+    # -------------------------------------------------------------------------
+    # getShard()
+    #
+    # Items of shard index (all items when sharding is off)
+    # -------------------------------------------------------------------------
+    @classmethod
+    def getShard(cls, items, index, count, weights):
+        if count <= 1:
+            return list(items)
+        return cls.assign(items, count, weights)[index]
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import json
+import time
+import resource
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# -----------------------------------------------------------------------------
+# class StageProfiler
+#
+# This class measures workflow stages (wall and CPU time, peak traced memory,
+# resident memory, bytes read/written through system calls and pixel counts).
+# Every stage is appended as one JSON line to an event log shared by all
+# processes of a batch, and kept per scene so it can be added to the metrics CSV.
+# The traced peak is process-wide, so it is only reported (peak_mb) for stages
+# that ran alone, and only where tracemalloc.reset_peak() exists (Python 3.9+).
+# -----------------------------------------------------------------------------
+class StageProfiler(object):
+
+    MB = float(1 << 20)
+    PROC_IO = '/proc/self/io'
+
+    # Stages in progress in this process (prefetch threads overlap the computed scene)
+    _active = []
+    _active_lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    # __init__
+    # -------------------------------------------------------------------------
+    def __init__(self, event_fn=None):
+        self._event_fn = event_fn
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    # -------------------------------------------------------------------------
+    # stage()
+    #
+    # Context manager measuring the enclosed code as stage 'name' of a scene.  The
+    # yielded dict may be updated with stage-specific fields (e.g., 'pixels').
+    # -------------------------------------------------------------------------
+    @contextmanager
+    def stage(self, scene, name, stage_list=None):
+        event = {'scene': scene, 'stage': name, 'pid': os.getpid(), 'pixels': None}
+        io_start = self._getIo()
+        with self._active_lock:
+            for other in self._active:
+                other['overlap'] = True
+            event['overlap'] = len(self._active) > 0
+            self._active.append(event)
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        traced_start = tracemalloc.get_traced_memory()[0]
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield event
+        except BaseException as err:
+            event['error'] = str(err)
+            raise
+        finally:
+            event['wall'] = time.perf_counter() - wall_start
+            event['cpu'] = time.process_time() - cpu_start
+            with self._active_lock:
+                self._active.remove(event)
+                measured = hasattr(tracemalloc, 'reset_peak') and not event['overlap']
+                event['peak_mb'] = (tracemalloc.get_traced_memory()[1] - traced_start) / self.MB if measured else None
+            event['rss_mb'] = self._getRss() / self.MB
+            event['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+            io_end = self._getIo()
+            event['read_mb'] = None if io_start is None else (io_end[0] - io_start[0]) / self.MB
+            event['written_mb'] = None if io_start is None else (io_end[1] - io_start[1]) / self.MB
+            event['time'] = time.time()
+            if stage_list is not None:
+                stage_list.append(event)
+            self._writeEvent(event)
+
+    # -------------------------------------------------------------------------
+    # getColumns()
+    #
+    # Flatten the stages of a scene into {<stage>_<measure>: value} (repeated stages are summed)
+    # -------------------------------------------------------------------------
+    @classmethod
+    def getColumns(cls, stage_list):
+        columns = {}
+        for event in stage_list:
+            for measure in ('wall', 'cpu', 'peak_mb', 'read_mb', 'written_mb', 'pixels'):
+                key = '{}_{}'.format(event['stage'], measure)
+                value = event.get(measure)
+                if (measure == 'peak_mb') and (value is not None):
+                    columns[key] = max(columns.get(key) or 0.0, value)
+                elif value is not None:
+                    columns[key] = (columns.get(key) or 0) + value
+                else:
+                    columns.setdefault(key, None)
+        return columns
+
+    def _writeEvent(self, event):
+        if self._event_fn is None:
+            return
+        # One write per line in append mode, so concurrent workers do not interleave events
+        with open(self._event_fn, 'a') as eventFile:
+            eventFile.write(json.dumps(event) + '\n')
+
+    def _getIo(self):
+        # Bytes read and written through system calls (Linux only)
+        try:
+            with open(self.PROC_IO) as ioFile:
+                counters = dict(line.split(':', 1) for line in ioFile)
+            return int(counters['rchar']), int(counters['wchar'])
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _getRss(self):
+        try:
+            with open('/proc/self/statm') as statmFile:
+                return int(statmFile.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
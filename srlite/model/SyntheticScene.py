@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from rasterio.transform import from_origin
+
+# -----------------------------------------------------------------------------
+# class SyntheticScene
+#
+# This class writes a synthetic SR-Lite input triplet - a 2m WorldView-like TOA
+# stack, a 30m CCDC-like target stack and a 2m cloudmask - that share one
+# underlying surface reflectance field.  The TOA is a per-band linear distortion
+# of that field plus noise (so the regression has a known answer), surrounded by
+# an optional nodata collar; the target grid can be offset from the TOA grid.
+# Rasters are written in row strips so arbitrarily large scenes fit in memory.
+# -----------------------------------------------------------------------------
+class SyntheticScene(object):
+
+    TOA_BANDS = ['BAND-B', 'BAND-G', 'BAND-R', 'BAND-N', 'BAND-C', 'BAND-Y', 'BAND-RE', 'BAND-N2']
+    TARGET_BANDS = ['blue_ccdc', 'green_ccdc', 'red_ccdc', 'nir_ccdc',
+                    'coastal_ccdc', 'yellow_ccdc', 'rededge_ccdc', 'nir2_ccdc']
+    TOA_SUFFIX = '-toa.tif'
+    TARGET_SUFFIX = '-ccdc.tif'
+    CLOUDMASK_SUFFIX = '-toa.cloudmask.v1.2.tif'
+
+    TOA_RES = 2.0
+    TARGET_RES = 30.0
+    NODATA_VALUE = -9999
+    STRIP_ROWS = 1024
+    # Size (in TOA pixels) of the cells of the underlying reflectance field
+    FIELD_CELL = 48
+
+    # -------------------------------------------------------------------------
+    # __init__
+    # -------------------------------------------------------------------------
+    def __init__(self, width, height=None, bands=4, collar=0, offset=(0.0, 0.0), cloud_fraction=0.1,
+                 epsg=32606, origin=(500000.0, 6800000.0), seed=0):
+        """
+        :param width: TOA width in 2m pixels
+        :param height: TOA height in 2m pixels (default width)
+        :param bands: number of band pairs (at most len(TOA_BANDS))
+        :param collar: width in TOA pixels of the nodata collar around the TOA footprint
+        :param offset: (x, y) offset in meters of the target grid origin from the TOA origin
+        :param cloud_fraction: approximate fraction of TOA pixels flagged as cloud
+        :param epsg: CRS of all three rasters
+        :param origin: (x, y) upper left corner of the TOA
+        :param seed: random seed - the same parameters always produce the same scene
+        """
+        if not (0 < bands <= len(self.TOA_BANDS)):
+            raise ValueError('Number of bands must be between 1 and ' + str(len(self.TOA_BANDS)))
+        self.width = int(width)
+        self.height = int(height or width)
+        self.bands = int(bands)
+        self.collar = int(collar)
+        self.offset = (float(offset[0]), float(offset[1]))
+        self.cloud_fraction = float(cloud_fraction)
+        self.crs = 'EPSG:{}'.format(epsg)
+        self.origin = (float(origin[0]), float(origin[1]))
+        self.seed = int(seed)
+
+        # Per-band truth: sr = slope * toa + intercept
+        rng = np.random.default_rng(self.seed)
+        self.slopes = rng.uniform(0.8, 1.2, self.bands)
+        self.intercepts = rng.uniform(-200.0, 200.0, self.bands)
+
+        # Coarse reflectance field (one value per FIELD_CELL x FIELD_CELL TOA pixels, per band)
+        # and cloud field, padded so that an offset target grid is still covered
+        pad = int(np.ceil((max(abs(self.offset[0]), abs(self.offset[1])) + self.TARGET_RES) / self.TOA_RES)) + 1
+        self._pad = pad
+        rows = (self.height + 2 * pad) // self.FIELD_CELL + 2
+        cols = (self.width + 2 * pad) // self.FIELD_CELL + 2
+        self._field = rng.uniform(300.0, 4500.0, (self.bands, rows, cols))
+        self._clouds = rng.uniform(0.0, 1.0, (rows, cols)) < self.cloud_fraction
+
+    # -------------------------------------------------------------------------
+    # getBandPairs()
+    # -------------------------------------------------------------------------
+    def getBandPairs(self):
+        return str([[self.TARGET_BANDS[index], self.TOA_BANDS[index]] for index in range(0, self.bands)])
+
+    def getPrefix(self):
+        return 'SYN_{}x{}_{}b_s{}'.format(self.width, self.height, self.bands, self.seed)
+
+    # -------------------------------------------------------------------------
+    # write()
+    #
+    # Write the TOA, target and cloudmask rasters to out_dir and return their paths
+    # -------------------------------------------------------------------------
+    def write(self, out_dir, prefix=None):
+        os.makedirs(out_dir, exist_ok=True)
+        prefix = prefix or self.getPrefix()
+        toa_fn = os.path.join(out_dir, prefix + self.TOA_SUFFIX)
+        target_fn = os.path.join(out_dir, prefix + self.TARGET_SUFFIX)
+        cloudmask_fn = os.path.join(out_dir, prefix + self.CLOUDMASK_SUFFIX)
+
+        self._writeToa(toa_fn)
+        self._writeTarget(target_fn)
+        self._writeCloudmask(cloudmask_fn)
+        return toa_fn, target_fn, cloudmask_fn
+
+    def _getProfile(self, width, height, count, dtype, nodata, res, origin):
+        return {'driver': 'GTiff', 'width': width, 'height': height, 'count': count, 'dtype': dtype,
+                'nodata': nodata, 'crs': self.crs, 'transform': from_origin(origin[0], origin[1], res, res),
+                'tiled': True, 'blockxsize': 256, 'blockysize': 256, 'compress': 'lzw'}
+
+    def _sampleField(self, rows, cols, band=None):
+        # Nearest lookup of the coarse fields at TOA pixel coordinates (relative to the TOA origin)
+        r = ((rows + self._pad) // self.FIELD_CELL)[:, np.newaxis]
+        c = ((cols + self._pad) // self.FIELD_CELL)[np.newaxis, :]
+        if band is None:
+            return self._clouds[r, c]
+        return self._field[band][r, c]
+
+    def _getCollarMask(self, rows, cols):
+        inside_rows = (rows >= self.collar) & (rows < self.height - self.collar)
+        inside_cols = (cols >= self.collar) & (cols < self.width - self.collar)
+        return ~(inside_rows[:, np.newaxis] & inside_cols[np.newaxis, :])
+
+    def _getStrips(self):
+        # Full-width windows of STRIP_ROWS rows and the TOA row numbers they cover
+        for row in range(0, self.height, self.STRIP_ROWS):
+            window = Window(0, row, self.width, min(self.STRIP_ROWS, self.height - row))
+            yield window, np.arange(row, row + window.height)
+
+    def _writeToa(self, toa_fn):
+        rng = np.random.default_rng(self.seed + 1)
+        cols = np.arange(self.width)
+        profile = self._getProfile(self.width, self.height, self.bands, 'int16', self.NODATA_VALUE,
+                                   self.TOA_RES, self.origin)
+        with rasterio.open(toa_fn, 'w', **profile) as dst:
+            for band in range(0, self.bands):
+                dst.set_band_description(band + 1, self.TOA_BANDS[band])
+                for window, rows in self._getStrips():
+                    sr = self._sampleField(rows, cols, band)
+                    toa = (sr - self.intercepts[band]) / self.slopes[band] + rng.normal(0.0, 25.0, sr.shape)
+                    toa = np.clip(np.rint(toa), -1000, 10000).astype(np.int16)
+                    toa[self._getCollarMask(rows, cols)] = self.NODATA_VALUE
+                    dst.write(toa, band + 1, window=window)
+
+    def _writeTarget(self, target_fn):
+        # Target grid covers the TOA footprint (plus one pixel) from an offset origin
+        origin = (self.origin[0] + self.offset[0] - self.TARGET_RES, self.origin[1] + self.offset[1] + self.TARGET_RES)
+        width = int(np.ceil(self.width * self.TOA_RES / self.TARGET_RES)) + 3
+        height = int(np.ceil(self.height * self.TOA_RES / self.TARGET_RES)) + 3
+        # TOA pixel coordinates of the centers of the target pixels
+        cols = np.floor((origin[0] + (np.arange(width) + 0.5) * self.TARGET_RES - self.origin[0]) / self.TOA_RES)
+        rows = np.floor((self.origin[1] - (origin[1] - (np.arange(height) + 0.5) * self.TARGET_RES)) / self.TOA_RES)
+        rows = np.clip(rows.astype(int), -self._pad, self.height + self._pad - 1)
+        cols = np.clip(cols.astype(int), -self._pad, self.width + self._pad - 1)
+
+        profile = self._getProfile(width, height, self.bands, 'int16', self.NODATA_VALUE, self.TARGET_RES, origin)
+        with rasterio.open(target_fn, 'w', **profile) as dst:
+            for band in range(0, self.bands):
+                dst.set_band_description(band + 1, self.TARGET_BANDS[band])
+                dst.write(np.rint(self._sampleField(rows, cols, band)).astype(np.int16), band + 1)
+
+    def _writeCloudmask(self, cloudmask_fn):
+        cols = np.arange(self.width)
+        profile = self._getProfile(self.width, self.height, 1, 'uint8', 255, self.TOA_RES, self.origin)
+        with rasterio.open(cloudmask_fn, 'w', **profile) as dst:
+            for window, rows in self._getStrips():
+                # 1 = cloud, 0 = clear
+                clouds = self._sampleField(rows, cols).astype(np.uint8)
+                clouds[self._getCollarMask(rows, cols)] = 255
+                dst.write(clouds, 1, window=window)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from osgeo import gdal
+
+# -----------------------------------------------------------------------------
+# class WarpCache
+#
+# This class is a content-addressed, size-bounded on-disk cache of warped (30m)
+# datasets.  Entries are keyed on the identity of every input file (path, size,
+# mtime and optionally a content hash) plus the warp parameters, stored as tiled,
+# compressed GeoTIFFs, and evicted least-recently-used first.
+# -----------------------------------------------------------------------------
+class WarpCache(object):
+
+    CACHE_VERSION = 1
+    CACHE_SUBDIR = 'srlite-warp-cache'
+    CREATION_OPTIONS = ['TILED=YES', 'COMPRESS=LZW', 'BIGTIFF=IF_SAFER']
+    HASH_BLOCK_SIZE = 1 << 24
+
+    # -------------------------------------------------------------------------
+    # __init__
+    # -------------------------------------------------------------------------
+    def __init__(self, warp_dir, max_bytes, hash_contents=False):
+        self._cache_dir = os.path.join(warp_dir, self.CACHE_SUBDIR)
+        self._max_bytes = int(max_bytes)
+        self._hash_contents = hash_contents
+        os.makedirs(self._cache_dir, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # -------------------------------------------------------------------------
+    # getKey()
+    #
+    # Hash of input file identities and warp parameters
+    # -------------------------------------------------------------------------
+    def getKey(self, src_fn_list, target_fn, res, sampling_method, dst_ndv):
+        payload = {
+            'version': self.CACHE_VERSION,
+            'inputs': [self._getIdentity(fn) for fn in src_fn_list],
+            'target': self._getIdentity(target_fn),
+            'res': str(res),
+            'sampling': str(sampling_method),
+            'dst_ndv': repr(dst_ndv),
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _getIdentity(self, fn):
+        st = os.stat(fn)
+        identity = {'path': os.path.realpath(fn), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        if self._hash_contents:
+            digest = hashlib.sha1()
+            with open(fn, 'rb') as f:
+                for block in iter(lambda: f.read(self.HASH_BLOCK_SIZE), b''):
+                    digest.update(block)
+            identity['sha1'] = digest.hexdigest()
+        return identity
+
+    # -------------------------------------------------------------------------
+    # get()
+    #
+    # Return the list of opened cached datasets for key, or None on a miss
+    # -------------------------------------------------------------------------
+    def get(self, key):
+        entry_dir = os.path.join(self._cache_dir, key)
+        try:
+            with open(os.path.join(entry_dir, 'entry.json')) as f:
+                entry = json.load(f)
+            ds_list = [gdal.Open(os.path.join(entry_dir, fn), gdal.GA_ReadOnly) for fn in entry['files']]
+        except (OSError, ValueError, RuntimeError):
+            ds_list = None
+
+        if (ds_list is None) or (None in ds_list):
+            self.misses += 1
+            return None
+
+        # Mark as most recently used
+        os.utime(entry_dir, None)
+        self.hits += 1
+        return ds_list
+
+    # -------------------------------------------------------------------------
+    # put()
+    #
+    # Store warped datasets under key and return them reopened from the cache
+    # -------------------------------------------------------------------------
+    def put(self, key, ds_list):
+        entry_dir = os.path.join(self._cache_dir, key)
+        tmp_dir = tempfile.mkdtemp(prefix='.' + key[:16] + '-', dir=self._cache_dir)
+        try:
+            driver = gdal.GetDriverByName('GTiff')
+            files = []
+            for index, ds in enumerate(ds_list):
+                fn = 'warp-{}.tif'.format(index)
+                # The copy is closed (flushed) as soon as it is returned - it is not published if it failed
+                if driver.CreateCopy(os.path.join(tmp_dir, fn), ds, options=self.CREATION_OPTIONS) is None:
+                    raise RuntimeError('Could not write warp cache entry ' + os.path.join(tmp_dir, fn))
+                files.append(fn)
+            with open(os.path.join(tmp_dir, 'entry.json'), 'w') as f:
+                json.dump({'files': files}, f)
+
+            # Publish atomically - another process may have stored the same entry first
+            try:
+                os.rename(tmp_dir, entry_dir)
+            except OSError:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        self.evict(keep=key)
+        return [gdal.Open(os.path.join(entry_dir, fn), gdal.GA_ReadOnly) for fn in files]
+
+    # -------------------------------------------------------------------------
+    # evict()
+    #
+    # Remove least recently used entries until the cache fits within max_bytes
+    # -------------------------------------------------------------------------
+    def evict(self, keep=None):
+        entries = []
+        total_bytes = 0
+        for entry in os.scandir(self._cache_dir):
+            if not entry.is_dir() or entry.name.startswith('.'):
+                continue
+            size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+            entries.append((entry.stat().st_mtime, size, entry.path, entry.name))
+            total_bytes += size
+
+        for mtime, size, path, name in sorted(entries):
+            if total_bytes <= self._max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total_bytes -= size
+            self.evictions += 1
+        return total_bytes
+
+    # -------------------------------------------------------------------------
+    # getStats()
+    # -------------------------------------------------------------------------
+    def getStats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import json
+import time
+import socket
+import threading
+
+# -----------------------------------------------------------------------------
+# class WorkQueue
+#
+# This class is a scene queue on a shared filesystem, so any number of nodes
+# can join or leave a running batch.  Each scene is a small JSON file that
+# moves between state directories by atomic rename:
+#
+#   pending/ -> claimed/ -> done/ (or failed/)
+#
+# Pending files are named by size rank, so idle workers take the largest
+# remaining scene first.  Claim owners touch their claim files (heartbeat);
+# claims not touched within the timeout are returned to pending/ by any
+# worker.  A claim is only released by its owner, so the queue is drained
+# once no scene is pending or being computed; the worker that finds it
+# drained consolidates the results.  A scene whose claim went stale may be
+# computed twice; the last result wins, but a failure does not replace the
+# result of another owner.
+# -----------------------------------------------------------------------------
+class WorkQueue(object):
+
+    STATE_PENDING = 'pending'
+    STATE_CLAIMED = 'claimed'
+    STATE_DONE = 'done'
+    STATE_FAILED = 'failed'
+    STATES = (STATE_PENDING, STATE_CLAIMED, STATE_DONE, STATE_FAILED)
+
+    # Markers - mkdir is atomic, so the first node to create one owns the step
+    LOCK_POPULATE = '.populate'
+    LOCK_CONSOLIDATE = '.consolidate'
+    FN_READY = 'ready.json'
+
+    SUFFIX = '.json'
+    DEFAULT_TIMEOUT = 600
+
+    # -------------------------------------------------------------------------
+    # __init__
+    # -------------------------------------------------------------------------
+    def __init__(self, queue_dir, timeout=DEFAULT_TIMEOUT, owner=None):
+        """
+        :param queue_dir: shared queue directory (created if needed)
+        :param timeout: seconds without heartbeat after which a claim is stale
+        :param owner: claim owner (default host:pid)
+        """
+        self.queue_dir = str(queue_dir)
+        self.timeout = float(timeout)
+        self.owner = owner or '{}:{}'.format(socket.gethostname(), os.getpid())
+        self._claims = set()
+        self._lock = threading.Lock()
+        self._heartbeat = None
+        self._stop = threading.Event()
+        for state in self.STATES:
+            os.makedirs(self._getDir(state), exist_ok=True)
+
+    # -------------------------------------------------------------------------
+    # populate()
+    #
+    # Enqueue the scenes once per batch - later nodes wait for the first one
+    # -------------------------------------------------------------------------
+    def populate(self, items, weights):
+        """
+        :param items: TOA paths
+        :param weights: size of each item (larger scenes are claimed first)
+        :return: True if this node populated the queue
+        """
+        ready = os.path.join(self.queue_dir, self.FN_READY)
+        lock = os.path.join(self.queue_dir, self.LOCK_POPULATE)
+        while not os.path.exists(ready):
+            try:
+                os.mkdir(lock)
+            except FileExistsError:
+                # Another node is populating - take over if it died
+                if (time.time() - os.path.getmtime(lock) > self.timeout):
+                    os.rmdir(lock)
+                else:
+                    time.sleep(1)
+                continue
+
+            ranked = sorted(zip(weights, items), key=lambda pair: (-pair[0], str(pair[1])))
+            width = len(str(len(ranked)))
+            for rank, (weight, item) in enumerate(ranked):
+                name = str(rank).zfill(width) + '-' + os.path.basename(str(item)) + self.SUFFIX
+                if not self._exists(name):
+                    self._write(self._getPath(self.STATE_PENDING, name), {'toa': str(item), 'weight': weight})
+            self._write(ready, {'created': time.time(), 'owner': self.owner, 'count': len(ranked)})
+            return True
+        return False
+
+    def getCreated(self):
+        with open(os.path.join(self.queue_dir, self.FN_READY)) as readyFile:
+            return json.load(readyFile)['created']
+
+    # -------------------------------------------------------------------------
+    # claim()
+    #
+    # Claim the next pending scene - (name, record) or None if nothing is pending
+    # -------------------------------------------------------------------------
+    def claim(self):
+        for name in self._list(self.STATE_PENDING):
+            pending = self._getPath(self.STATE_PENDING, name)
+            claimed = self._getPath(self.STATE_CLAIMED, name)
+            try:
+                # Pending files keep the mtime of populate() - refresh it first, so the claim is never
+                # seen as stale by reclaimStale() (pending files are never reclaimed)
+                record = self._read(pending)
+                os.utime(pending)
+                os.rename(pending, claimed)
+            except FileNotFoundError:
+                # Claimed by another worker in the meantime
+                continue
+            with self._lock:
+                self._claims.add(name)
+            record = record or {}
+            record.update({'owner': self.owner, 'claimed': time.time()})
+            self._write(claimed, record)
+            return name, record
+        return None
+
+    # -------------------------------------------------------------------------
+    # complete()
+    #
+    # Record the summary of a claimed scene as done (or failed), and release
+    # the claim if this worker still owns it
+    # -------------------------------------------------------------------------
+    def complete(self, name, summary):
+        state = self.STATE_FAILED if summary.get('status') == 'failed' else self.STATE_DONE
+        with self._lock:
+            self._claims.discard(name)
+
+        done = self._read(self._getPath(self.STATE_DONE, name))
+        if (state == self.STATE_FAILED) and (done is not None) and (done['owner'] != self.owner):
+            # Another owner completed the scene since this claim went stale
+            return
+
+        claimed = self._getPath(self.STATE_CLAIMED, name)
+        record = self._read(claimed)
+        owned = (record is not None) and (record.get('owner') == self.owner)
+        record = dict(record or {'toa': summary.get('toa')})
+        record.update({'owner': self.owner, 'completed': time.time(), 'summary': summary})
+        self._write(self._getPath(state, name), record)
+
+        # A claim taken over by another owner is left for that owner to release
+        stale = [self._getPath(other, name) for other in (self.STATE_DONE, self.STATE_FAILED) if other != state]
+        if owned:
+            stale.append(claimed)
+        for path in stale:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    # -------------------------------------------------------------------------
+    # reclaimStale()
+    #
+    # Return claims without heartbeat for longer than the timeout to pending
+    # -------------------------------------------------------------------------
+    def reclaimStale(self):
+        reclaimed = []
+        now = time.time()
+        for name in self._list(self.STATE_CLAIMED):
+            claimed = self._getPath(self.STATE_CLAIMED, name)
+            try:
+                if (now - os.path.getmtime(claimed) <= self.timeout):
+                    continue
+                os.rename(claimed, self._getPath(self.STATE_PENDING, name))
+            except FileNotFoundError:
+                continue
+            reclaimed.append(name)
+        return reclaimed
+
+    def isDrained(self):
+        return (len(self._list(self.STATE_PENDING)) == 0) and (len(self._list(self.STATE_CLAIMED)) == 0)
+
+    def getCounts(self):
+        return {state: len(self._list(state)) for state in self.STATES}
+
+    # -------------------------------------------------------------------------
+    # consolidate()
+    #
+    # Summaries of all scenes, once per batch - None while scenes are pending
+    # or claimed (the owner of the last claim consolidates), or if another
+    # worker consolidates
+    # -------------------------------------------------------------------------
+    def consolidate(self):
+        if not self.isDrained():
+            return None
+        lock = os.path.join(self.queue_dir, self.LOCK_CONSOLIDATE)
+        try:
+            os.mkdir(lock)
+        except FileExistsError:
+            return None
+        if not self.isDrained():
+            # A scene was returned to the queue in the meantime
+            os.rmdir(lock)
+            return None
+
+        summaryList = []
+        for state in (self.STATE_DONE, self.STATE_FAILED):
+            for name in self._list(state):
+                record = self._read(self._getPath(state, name))
+                if (record is not None):
+                    summary = dict(record['summary'])
+                    summary['owner'] = record['owner']
+                    summaryList.append(summary)
+        return sorted(summaryList, key=lambda summary: str(summary['toa']))
+
+    # -------------------------------------------------------------------------
+    # start() / stop()
+    #
+    # Heartbeat thread touching the claims of this owner
+    # -------------------------------------------------------------------------
+    def start(self):
+        if (self._heartbeat is None):
+            self._stop.clear()
+            self._heartbeat = threading.Thread(target=self._beat, name='srlite-heartbeat', daemon=True)
+            self._heartbeat.start()
+        return self
+
+    def stop(self):
+        if (self._heartbeat is not None):
+            self._stop.set()
+            self._heartbeat.join()
+            self._heartbeat = None
+
+    def _beat(self):
+        while not self._stop.wait(self.timeout / 4):
+            with self._lock:
+                claims = list(self._claims)
+            for name in claims:
+                claimed = self._getPath(self.STATE_CLAIMED, name)
+                record = self._read(claimed)
+                if (record is None) or (record.get('owner') != self.owner):
+                    # Reclaimed by another worker - the result is still recorded on completion
+                    continue
+                try:
+                    os.utime(claimed)
+                except FileNotFoundError:
+                    pass
+
+    def _getDir(self, state):
+        return os.path.join(self.queue_dir, state)
+
+    def _getPath(self, state, name):
+        return os.path.join(self.queue_dir, state, name)
+
+    def _list(self, state):
+        with os.scandir(self._getDir(state)) as entries:
+            return sorted(entry.name for entry in entries if entry.name.endswith(self.SUFFIX))
+
+    def _exists(self, name):
+        return any(os.path.exists(self._getPath(state, name)) for state in self.STATES)
+
+    def _read(self, path):
+        try:
+            with open(path) as recordFile:
+                return json.load(recordFile)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, path, record):
+        # Write then rename, so readers never see a partial record
+        tmp = '{}.{}.tmp'.format(path, self.owner.replace(os.sep, '_'))
+        with open(tmp, 'w') as recordFile:
+            json.dump(record, recordFile)
+        os.replace(tmp, path)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# coding: utf-8
+import numpy as np
+from srlite.model.regression.linear.ClosedFormRegression import SufficientStatistics
+
+# -----------------------------------------------------------------------------
+# class RegressionMetrics
+#
+# This class computes the agreement metrics reported per band (r2, explained
+# variance, bias, MAE, MAPE, median AE, MSE) between observed and predicted
+# values.  The moment-based metrics come from SufficientStatistics, so they cost
+# nothing extra when a closed-form fit already produced them; the absolute-error
+# metrics share a single |y_true - y_pred| array whose exact median is found by
+# partitioning it in place.  Values match sklearn.metrics for 1-D inputs.
+# -----------------------------------------------------------------------------
+class RegressionMetrics(object):
+
+    EPSILON = np.finfo(np.float64).eps
+
+    # -------------------------------------------------------------------------
+    # fromArrays()
+    #
+    # Metrics of unmasked 1-D arrays of observed and predicted values
+    # -------------------------------------------------------------------------
+    @classmethod
+    def fromArrays(cls, y_true, y_pred, stats=None):
+        """
+        :param y_true: observed values, shape (n_samples,)
+        :param y_pred: predicted values, shape (n_samples,)
+        :param stats: optional SufficientStatistics of (y_pred, y_true), reused when available
+        :return: dict of metric name to value
+        """
+        y_true = np.ma.getdata(y_true).ravel()
+        y_pred = np.ma.getdata(y_pred).ravel()
+        if stats is None:
+            stats = SufficientStatistics.fromArrays(y_pred, y_true)
+        n = stats.n
+
+        ########################################
+        # Moment-based metrics - closed form from the sufficient statistics
+        ########################################
+        mean_true = stats.meanY()
+        mean_pred = stats.meanX()
+        ss_tot = stats.centeredYY()
+        # n * variance of the residuals y_true - y_pred
+        ss_res_centered = max(ss_tot + stats.centeredXX() - 2.0 * stats.centeredXY(), 0.0)
+        mbe = mean_true - mean_pred
+        ss_res = ss_res_centered + n * mbe * mbe
+
+        metrics = {}
+        metrics['r2_score'] = cls._ratioScore(ss_res, ss_tot)
+        metrics['explained_variance'] = cls._ratioScore(ss_res_centered, ss_tot)
+        metrics['mbe'] = mbe
+
+        ########################################
+        # Absolute-error metrics - one residual array, reused in place
+        ########################################
+        abs_error = np.subtract(y_true, y_pred, dtype=np.float64)
+        np.abs(abs_error, out=abs_error)
+        metrics['mae'] = abs_error.sum() / n
+        metrics['mape'] = (abs_error / np.maximum(np.abs(y_true), cls.EPSILON)).sum() / n
+        metrics['medae'] = np.median(abs_error, overwrite_input=True)
+        abs_error = None
+
+        metrics['mse'] = ss_res / n
+        metrics['rmse'] = metrics['mse'] ** 0.5
+        metrics['mean_ccdc_sr'] = mean_true
+        metrics['mean_evhr_srlite'] = mean_pred
+        metrics['mae_norm'] = metrics['mae'] / mean_true
+        metrics['rmse_norm'] = metrics['rmse'] / mean_true
+        return metrics
+
+    @classmethod
+    def _ratioScore(cls, numerator, denominator):
+        # 1 - numerator/denominator, finite for constant observations (as in sklearn)
+        if denominator == 0:
+            return 1.0 if numerator == 0 else 0.0
+        return 1.0 - numerator / denominator
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# coding: utf-8
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# class SufficientStatistics
+#
+# This class holds the sufficient statistics (n, Σx, Σy, Σxx, Σyy, Σxy) of paired
+# samples.  Sums are accumulated about a per-series shift (an estimate of the mean)
+# with NumPy's pairwise summation, which avoids the cancellation of the textbook
+# Σxx - n*mean² formulas on large reflectance values.  Per-pixel work arrays may
+# be float32 (half the memory); sums are always accumulated in float64.  All
+# fields may be arrays, one entry per series (e.g., per band).
+# -----------------------------------------------------------------------------
+class SufficientStatistics(object):
+
+    # Number of pixels sampled to estimate the shift of each series
+    SHIFT_SAMPLE_SIZE = 1024
+
+    # -------------------------------------------------------------------------
+    # __init__
+    # -------------------------------------------------------------------------
+    def __init__(self, n, sx, sy, sxx, syy, sxy, kx=0.0, ky=0.0):
+        self.n = n
+        self.sx = sx
+        self.sy = sy
+        self.sxx = sxx
+        self.syy = syy
+        self.sxy = sxy
+        self.kx = kx
+        self.ky = ky
+
+    # -------------------------------------------------------------------------
+    # fromArrays()
+    #
+    # Accumulate statistics of x and y along the last axis, skipping masked pixels
+    # -------------------------------------------------------------------------
+    @classmethod
+    def fromArrays(cls, x, y, mask=None, dtype=np.float64):
+        """
+        :param x: (pixels,) or (series, pixels) array or masked array of predictor values
+        :param y: array or masked array of response values, same shape as x
+        :param mask: optional boolean array, True where a pixel must be ignored
+        :param dtype: floating point type of the per-pixel work arrays
+        :return: SufficientStatistics with one entry per series
+        """
+        valid = ~(np.ma.getmaskarray(x) | np.ma.getmaskarray(y))
+        if mask is not None:
+            valid &= ~np.asarray(mask, dtype=bool)
+        x = np.ma.getdata(x)
+        y = np.ma.getdata(y)
+
+        kx = cls._shift(x, valid)
+        ky = cls._shift(y, valid)
+        n = np.count_nonzero(valid, axis=-1)
+
+        zero = np.zeros((), dtype=dtype)
+        dx = np.where(valid, x.astype(dtype, copy=False) - kx.astype(dtype)[..., np.newaxis], zero)
+        dy = np.where(valid, y.astype(dtype, copy=False) - ky.astype(dtype)[..., np.newaxis], zero)
+        sx = dx.sum(axis=-1, dtype=np.float64)
+        sy = dy.sum(axis=-1, dtype=np.float64)
+        sxy = (dx * dy).sum(axis=-1, dtype=np.float64)
+        dx *= dx
+        dy *= dy
+        # The shifts actually subtracted (rounded to dtype) keep the statistics exact
+        return cls(n, sx, sy, dx.sum(axis=-1, dtype=np.float64), dy.sum(axis=-1, dtype=np.float64), sxy,
+                   kx.astype(dtype).astype(np.float64), ky.astype(dtype).astype(np.float64))
+
+    @classmethod
+    def _shift(cls, values, valid):
+        # Mean of a strided subsample of the valid pixels - cheap, and close enough
+        # to the true mean that the shifted sums are nearly centered
+        step = max(1, values.shape[-1] // cls.SHIFT_SAMPLE_SIZE)
+        sample = np.ma.array(values[..., ::step], mask=~valid[..., ::step])
+        shift = np.ma.getdata(sample.mean(axis=-1, dtype=np.float64))
+        return np.where(np.ma.getmaskarray(sample).all(axis=-1), 0.0, shift)
+
+    # -------------------------------------------------------------------------
+    # __getitem__()
+    #
+    # Statistics of a single series (e.g., one band of a batched fit)
+    # -------------------------------------------------------------------------
+    def __getitem__(self, index):
+        return SufficientStatistics(*[np.asarray(value)[index] for value in
+                                      (self.n, self.sx, self.sy, self.sxx, self.syy, self.sxy,
+                                       self.kx, self.ky)])
+
+    def meanX(self):
+        return self.kx + self.sx / self.n
+
+    def meanY(self):
+        return self.ky + self.sy / self.n
+
+    def centeredXX(self):
+        return self.sxx - self.sx * self.sx / self.n
+
+    def centeredYY(self):
+        return self.syy - self.sy * self.sy / self.n
+
+    def centeredXY(self):
+        return self.sxy - self.sx * self.sy / self.n
+
+# -----------------------------------------------------------------------------
+# class ClosedFormRegression
+#
+# Ordinary least squares (OLS) and reduced major axis (RMA) regression of y on x,
+# solved in closed form from SufficientStatistics.  Exposes the subset of the
+# scikit-learn estimator interface used by RasterLib (fit, predict, coef_,
+# intercept_); the RMA solution matches pylr2.regress2(..., "reduced major axis").
+# -----------------------------------------------------------------------------
+class ClosedFormRegression(object):
+
+    METHOD_OLS = 'ols'
+    METHOD_RMA = 'rma'
+
+    # -------------------------------------------------------------------------
+    # __init__
+    # -------------------------------------------------------------------------
+    def __init__(self, method=METHOD_OLS, dtype=np.float64):
+        if method not in (self.METHOD_OLS, self.METHOD_RMA):
+            raise ValueError('Invalid closed-form regression method: ' + str(method))
+        self.method = method
+        self.dtype = np.dtype(dtype)
+
+    # -------------------------------------------------------------------------
+    # fit()
+    #
+    # Fit from (masked) arrays of samples
+    # -------------------------------------------------------------------------
+    def fit(self, X, y):
+        """
+        :param X: predictor values, shape (n_samples,) or (n_samples, 1)
+        :param y: response values, shape (n_samples,)
+        :return: self
+        """
+        X = np.ma.asarray(X)
+        if X.ndim == 2:
+            X = X[:, 0]
+        return self.fitStatistics(SufficientStatistics.fromArrays(X, np.ma.asarray(y).ravel(), dtype=self.dtype))
+
+    # -------------------------------------------------------------------------
+    # fitStatistics()
+    #
+    # Fit from precomputed statistics - no pass over the pixels
+    # -------------------------------------------------------------------------
+    def fitStatistics(self, stats):
+        cxx = stats.centeredXX()
+        cyy = stats.centeredYY()
+        cxy = stats.centeredXY()
+        mean_x = stats.meanX()
+        mean_y = stats.meanY()
+
+        if self.method == self.METHOD_OLS:
+            slope = cxy / cxx
+        else:
+            slope = np.sign(cxy) * np.sqrt(cyy / cxx)
+        intercept = mean_y - slope * mean_x
+
+        # Residual variance about the fitted line and the standard errors of its terms
+        s2 = (cyy - 2.0 * slope * cxy + slope * slope * cxx) / (stats.n - 2)
+
+        self.stats_ = stats
+        self.slope_ = slope
+        self.intercept_ = intercept
+        self.coef_ = np.atleast_1d(slope)
+        self.r_ = cxy / np.sqrt(cxx * cyy)
+        self.score_ = self.r_ * self.r_
+        self.std_slope_ = np.sqrt(s2 / cxx)
+        self.std_intercept_ = np.sqrt((cxx + stats.n * mean_x * mean_x) * s2 / (stats.n * cxx))
+        return self
+
+    # -------------------------------------------------------------------------
+    # predict()
+    # -------------------------------------------------------------------------
+    def predict(self, X):
+        """
+        :param X: predictor values, shape (n_samples, 1) or any array shape
+        :return: predictions of type dtype, shape (n_samples,) or the shape of X
+        """
+        X = np.ma.getdata(X)
+        if X.ndim == 2 and X.shape[1] == 1:
+            X = X[:, 0]
+        prediction = X.astype(self.dtype)
+        prediction *= self.dtype.type(self.slope_)
+        prediction += self.dtype.type(self.intercept_)
+        return prediction
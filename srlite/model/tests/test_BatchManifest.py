@@ -0,0 +1,63 @@
+import os
+from srlite.model.BatchManifest import BatchManifest
+
+def writeFile(path, content):
+    with open(path, 'w') as outFile:
+        outFile.write(content)
+    return str(path)
+
+def test_resume_redoes_incomplete_and_stale_scenes(tmp_path):
+    toa_a = writeFile(tmp_path / 'a-toa.tif', 'a')
+    toa_b = writeFile(tmp_path / 'b-toa.tif', 'b')
+    cog_a = writeFile(tmp_path / 'a-sr-02m.tif', 'cog')
+    manifest = BatchManifest(tmp_path / 'manifest', owner='node1-1')
+
+    manifest.start(toa_a, 'a', 'params', [toa_a])
+    manifest.record({'toa': toa_a, 'scene': 'a', 'status': 'completed'}, cog_a)
+    # Scene b was running when the batch stopped
+    manifest.start(toa_b, 'b', 'params', [toa_b])
+
+    assert manifest.getCounts() == {'completed': 1, 'running': 1}
+    assert manifest.getPending([toa_a, toa_b], 'params') == [toa_b]
+    # Other parameters, inputs or outputs make a completed scene stale
+    assert manifest.getPending([toa_a], 'other') == [toa_a]
+    writeFile(cog_a, 'rewritten cog')
+    assert manifest.getPending([toa_a], 'params') == [toa_a]
+
+def test_processes_write_their_own_files(tmp_path):
+    toa_a = writeFile(tmp_path / 'a-toa.tif', 'a')
+    cog_a = writeFile(tmp_path / 'a-sr-02m.tif', 'cog')
+    first = BatchManifest(tmp_path / 'manifest', owner='node1-1')
+    second = BatchManifest(tmp_path / 'manifest', owner='node2-1')
+
+    first.start(toa_a, 'a', 'params', [toa_a])
+    first.record({'toa': toa_a, 'scene': 'a', 'status': 'failed', 'error': 'boom'})
+    second.start(toa_a, 'a', 'params', [toa_a])
+    second.record({'toa': toa_a, 'scene': 'a', 'status': 'completed'}, cog_a)
+
+    assert sorted(os.listdir(tmp_path / 'manifest')) == ['node1-1.jsonl', 'node2-1.jsonl']
+    # Events of all files are folded in time order
+    assert first.get(toa_a)['state'] == BatchManifest.STATE_COMPLETED
+    assert first.getPending([toa_a], 'params') == []
+
+def test_skipped_scenes_keep_their_state(tmp_path):
+    toa_a = writeFile(tmp_path / 'a-toa.tif', 'a')
+    cog_a = writeFile(tmp_path / 'a-sr-02m.tif', 'cog')
+    manifest = BatchManifest(tmp_path / 'manifest')
+    manifest.start(toa_a, 'a', 'params', [toa_a])
+    manifest.record({'toa': toa_a, 'scene': 'a', 'status': 'completed'}, cog_a)
+    manifest.record({'toa': toa_a, 'scene': 'a', 'status': 'skipped'})
+    assert manifest.get(toa_a)['state'] == BatchManifest.STATE_COMPLETED
+
+    toa_b = writeFile(tmp_path / 'b-toa.tif', 'b')
+    manifest.record({'toa': toa_b, 'scene': 'b', 'status': 'skipped'})
+    assert manifest.get(toa_b)['state'] == BatchManifest.STATE_SKIPPED
+    assert manifest.getPending([toa_b], 'params') == [toa_b]
+
+def test_truncated_lines_are_ignored(tmp_path):
+    toa_a = writeFile(tmp_path / 'a-toa.tif', 'a')
+    manifest = BatchManifest(tmp_path / 'manifest', owner='node1-1')
+    manifest.start(toa_a, 'a', 'params', [toa_a])
+    with open(tmp_path / 'manifest' / 'node1-1.jsonl', 'a') as manifestFile:
+        manifestFile.write('{"toa": "')
+    assert manifest.getCounts() == {'running': 1}
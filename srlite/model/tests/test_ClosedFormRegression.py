@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from srlite.model.regression.linear.ClosedFormRegression import ClosedFormRegression, SufficientStatistics
+
+def getBandSamples(seed=0, size=50000, offset=0.0):
+    # Continuous TOA (x) and surface reflectance (y) samples of one band - offset shifts both to large
+    # magnitudes, where unshifted sums of squares lose precision
+    rng = np.random.default_rng(seed)
+    sr = offset + rng.uniform(300.0, 4500.0, size)
+    toa = (sr - rng.uniform(-200.0, 200.0)) / rng.uniform(0.8, 1.2) + rng.normal(0.0, 25.0, size)
+    return toa, sr + rng.normal(0.0, 25.0, size)
+
+@pytest.mark.parametrize('offset', [0.0, 1E4])
+def test_ols_matches_sklearn(offset):
+    linear_model = pytest.importorskip('sklearn.linear_model')
+    x, y = getBandSamples(offset=offset)
+    expected = linear_model.LinearRegression().fit(x.reshape(-1, 1), y)
+    model = ClosedFormRegression(ClosedFormRegression.METHOD_OLS).fit(x.reshape(-1, 1), y)
+    np.testing.assert_allclose(model.coef_, expected.coef_, rtol=1e-9)
+    np.testing.assert_allclose(model.intercept_, expected.intercept_, rtol=1e-9)
+    np.testing.assert_allclose(model.predict(x.reshape(-1, 1)), expected.predict(x.reshape(-1, 1)), rtol=1e-9)
+
+@pytest.mark.parametrize('offset', [0.0, 1E4])
+def test_rma_matches_pylr2(offset):
+    pylr2 = pytest.importorskip('pylr2')
+    x, y = getBandSamples(seed=3, offset=offset)
+    expected = pylr2.regress2(x, y, _method_type_2='reduced major axis')
+    model = ClosedFormRegression(ClosedFormRegression.METHOD_RMA).fit(x, y)
+    for name, value in (('slope', model.slope_), ('intercept', model.intercept_), ('r', model.r_),
+                        ('std_slope', model.std_slope_), ('std_intercept', model.std_intercept_)):
+        np.testing.assert_allclose(value, expected[name], rtol=1e-7, err_msg=name)
+
+def test_masked_samples_are_ignored():
+    x, y = getBandSamples(seed=1)
+    mask = np.zeros(x.shape, dtype=bool)
+    mask[::7] = True
+    masked = ClosedFormRegression().fit(np.ma.array(x, mask=mask), np.ma.array(y, mask=mask))
+    compressed = ClosedFormRegression().fit(x[~mask], y[~mask])
+    np.testing.assert_allclose(masked.coef_, compressed.coef_, rtol=1e-12)
+    np.testing.assert_allclose(masked.intercept_, compressed.intercept_, rtol=1e-12)
+
+def test_batched_statistics_match_single_bands():
+    samples = [getBandSamples(seed=band) for band in range(0, 3)]
+    stats = SufficientStatistics.fromArrays(np.stack([x for x, y in samples]), np.stack([y for x, y in samples]))
+    for band, (x, y) in enumerate(samples):
+        batched = ClosedFormRegression().fitStatistics(stats[band])
+        single = ClosedFormRegression().fit(x, y)
+        np.testing.assert_allclose(batched.coef_, single.coef_, rtol=1e-12)
+        np.testing.assert_allclose(batched.intercept_, single.intercept_, rtol=1e-12)
+
+@pytest.mark.parametrize('offset', [0.0, 1E4])
+def test_float32_work_arrays_stay_close(offset):
+    x, y = getBandSamples(seed=2, offset=offset)
+    model64 = ClosedFormRegression(dtype=np.float64).fit(x, y)
+    model32 = ClosedFormRegression(dtype=np.float32).fit(x, y)
+    np.testing.assert_allclose(model32.coef_, model64.coef_, rtol=1e-5)
+    assert model32.predict(x).dtype == np.float32
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from srlite.model.MaskEngine import MaskEngine
+
+# Odd widths and a few row counts - the pixel counts cover every packbits padding remainder (size % 8)
+SHAPES = [(rows, width) for width in (1, 7, 9, 301) for rows in (1, 2, 3, 4, 8)]
+
+def getLayers(shape, seed=0):
+    # Random cloud, quality and threshold layers of a scene, and a blue band with negative values
+    rng = np.random.default_rng(seed)
+    clouds = np.ma.array(np.zeros(shape), mask=rng.random(shape) < 0.2)
+    quality = rng.random(shape) < 0.05
+    blue = rng.uniform(-500.0, 4000.0, shape)
+    threshold = np.ma.masked_outside(blue, 0.0, 3000.0)
+    return clouds, quality, threshold, blue
+
+def getCommonMask(ma_list, positive=False):
+    # The masked-array union replaced by MaskEngine (masked_where(ma < 0) then common mask)
+    if positive:
+        ma_list = [np.ma.masked_where(ma < 0, ma) for ma in ma_list]
+    return np.logical_or.reduce([np.ma.getmaskarray(ma) for ma in ma_list])
+
+@pytest.mark.parametrize('shape', SHAPES)
+@pytest.mark.parametrize('seed', [0, 1])
+def test_scene_mask_matches_masked_array_union(shape, seed):
+    clouds, quality, threshold, blue = getLayers(shape, seed)
+    engine = MaskEngine(shape)
+    engine.add('cloudmask', clouds)
+    engine.add('qf', quality)
+    engine.add('threshold', threshold)
+    expected = getCommonMask([clouds, np.ma.array(np.zeros(shape), mask=quality), threshold])
+    np.testing.assert_array_equal(engine.getMask(), expected)
+    assert engine.getCount() == np.count_nonzero(expected)
+    assert engine.getCounts()['qf'] == np.count_nonzero(quality)
+
+@pytest.mark.parametrize('shape', SHAPES)
+def test_positive_layers(shape):
+    clouds, quality, threshold, blue = getLayers(shape, seed=2)
+    layer = np.ma.array(blue, mask=np.ma.getmaskarray(clouds))
+    engine = MaskEngine(shape)
+    engine.add('threshold', layer, positive=True)
+    np.testing.assert_array_equal(engine.getMask(), getCommonMask([layer], positive=True))
+
+@pytest.mark.parametrize('shape', SHAPES)
+def test_band_masks_are_ored_per_band(shape):
+    clouds, quality, threshold, blue = getLayers(shape, seed=3)
+    engine = MaskEngine(shape)
+    engine.add('cloudmask', clouds)
+    band_masks = np.stack([quality, blue < 1000.0, np.zeros(shape, dtype=bool)])
+    masks = engine.getMask(band_masks)
+    for band in range(0, band_masks.shape[0]):
+        np.testing.assert_array_equal(masks[band], band_masks[band] | np.ma.getmaskarray(clouds))
+
+    # Flat (bands, pixels) masks as used by the batched fit
+    flat = engine.getMask(band_masks.reshape(band_masks.shape[0], -1))
+    np.testing.assert_array_equal(flat, masks.reshape(flat.shape))
+
+def test_shapes_cover_padding_remainders():
+    assert sorted(set(rows * width % 8 for rows, width in SHAPES)) == list(range(0, 8))
+
+def test_full_and_empty_layers():
+    engine = MaskEngine((3, 7))
+    np.testing.assert_array_equal(engine.getMask(), np.zeros((3, 7), dtype=bool))
+    engine.add('all', np.ones((3, 7), dtype=bool))
+    assert engine.getCount() == 21
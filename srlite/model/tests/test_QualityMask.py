@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from srlite.model.QualityMask import QualityMask
+
+def getQfMask(qf_band, values=(0, 3, 4)):
+    # The np.select filtering replaced by QualityMask (on the float band read by iolib) - suppressed values
+    # become nodata, then masked
+    qf_band = qf_band.astype(np.float64)
+    ndv = -9999
+    qf = np.select([qf_band == value for value in values], [ndv] * len(values), qf_band)
+    return qf == ndv
+
+def test_values_match_select():
+    qf_band = np.random.default_rng(0).integers(0, 12, (64, 64)).astype(np.uint8)
+    np.testing.assert_array_equal(QualityMask.fromList('0,3,4').getMask(qf_band), getQfMask(qf_band))
+    np.testing.assert_array_equal(QualityMask.fromList('1, 7').getMask(qf_band), getQfMask(qf_band, (1, 7)))
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.int16, np.float32])
+def test_band_types(dtype):
+    qf_band = np.array([[0, 1, 3], [4, 5, 255]], dtype=dtype)
+    expected = np.array([[True, False, True], [True, False, False]])
+    np.testing.assert_array_equal(QualityMask.fromList('0,3,4').getMask(qf_band), expected)
+
+def test_bits():
+    # Landsat QA_PIXEL: bit 3 = cloud, bit 4 = cloud shadow
+    qa_band = np.random.default_rng(1).integers(0, 1 << 16, (32, 32)).astype(np.uint16)
+    quality_mask = QualityMask.fromList('b3,b4')
+    assert quality_mask.size == 1 << 16
+    np.testing.assert_array_equal(quality_mask.getMask(qa_band), (qa_band & ((1 << 3) | (1 << 4))) != 0)
+
+def test_values_and_bits():
+    qa_band = np.arange(0, 1 << 10, dtype=np.uint16)
+    expected = (qa_band == 1) | ((qa_band & (1 << 9)) != 0)
+    np.testing.assert_array_equal(QualityMask.fromList('1,b9').getMask(qa_band), expected)
+
+def test_values_outside_the_table_are_not_masked():
+    qf_band = np.array([-9999.0, np.nan, 3.5, 3.0, 70000.0])
+    np.testing.assert_array_equal(QualityMask.fromList('3').getMask(qf_band), [False, False, False, True, False])
+
+def test_invalid_lists():
+    with pytest.raises(ValueError):
+        QualityMask.fromList('-1')
+    with pytest.raises(ValueError):
+        QualityMask.fromList('b16')
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from srlite.model.regression.RegressionMetrics import RegressionMetrics
+
+metrics = pytest.importorskip('sklearn.metrics')
+
+def getPredictions(size=40000, seed=0):
+    # Continuous surface reflectance (observed) and a noisy, slightly biased prediction of it
+    rng = np.random.default_rng(seed)
+    y_true = rng.uniform(300.0, 4500.0, size)
+    return y_true, 0.97 * y_true + 40.0 + rng.normal(0.0, 60.0, size)
+
+def getExpected(y_true, y_pred):
+    return {'r2_score': metrics.r2_score(y_true, y_pred),
+            'explained_variance': metrics.explained_variance_score(y_true, y_pred),
+            'mae': metrics.mean_absolute_error(y_true, y_pred),
+            'mape': metrics.mean_absolute_percentage_error(y_true, y_pred),
+            'medae': metrics.median_absolute_error(y_true, y_pred),
+            'mse': metrics.mean_squared_error(y_true, y_pred),
+            'mbe': np.mean(y_true - y_pred)}
+
+def assertMetrics(result, expected):
+    for name, value in expected.items():
+        np.testing.assert_allclose(result[name], value, rtol=1e-9, err_msg=name)
+    np.testing.assert_allclose(result['rmse'], np.sqrt(expected['mse']), rtol=1e-9)
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_metrics_match_sklearn(seed):
+    y_true, y_pred = getPredictions(seed=seed)
+    assertMetrics(RegressionMetrics.fromArrays(y_true, y_pred), getExpected(y_true, y_pred))
+
+def test_even_length_median_of_unmasked_pixels():
+    y_true, y_pred = getPredictions(size=1001, seed=3)
+    # Unmasked pixels of a band, as passed by RasterLib (an even count: the median averages two values)
+    mask = np.zeros(y_true.shape, dtype=bool)
+    mask[::7] = True
+    y_true_ma, y_pred_ma = np.ma.array(y_true, mask=mask), np.ma.array(y_pred, mask=mask)
+    y_true_valid, y_pred_valid = y_true_ma.compressed(), y_pred_ma.compressed()
+    assert y_true_valid.size % 2 == 0
+
+    result = RegressionMetrics.fromArrays(y_true_valid, y_pred_valid)
+    assertMetrics(result, getExpected(y_true_valid, y_pred_valid))
+    # Differs from a nearest-rank median of the absolute errors
+    abs_error = np.sort(np.abs(y_true_valid - y_pred_valid))
+    assert result['medae'] != abs_error[abs_error.size // 2 - 1]
+    assert result['medae'] != abs_error[abs_error.size // 2]
+
+def test_constant_observations():
+    y_true = np.full(100, 1500.0)
+    for y_pred in (y_true.copy(), y_true + 10.0):
+        result = RegressionMetrics.fromArrays(y_true, y_pred)
+        assert result['r2_score'] == metrics.r2_score(y_true, y_pred)
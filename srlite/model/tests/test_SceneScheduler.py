@@ -0,0 +1,33 @@
+import pytest
+from srlite.model.SceneScheduler import SceneScheduler
+
+def test_estimate():
+    scheduler = SceneScheduler(band_pairs=4)
+    assert scheduler.estimate((8, 2000, 3000, 2, 2.0)) == pytest.approx(24.0)
+    # Only the bands of the band pairs are applied
+    assert scheduler.estimate((2, 2000, 3000)) == pytest.approx(12.0)
+
+def test_order_is_largest_first():
+    costs = {'/toa/a.tif': 5.0, '/toa/b.tif': 50.0, '/toa/c.tif': 20.0, '/toa/d.tif': 20.0}
+    items = sorted(costs)
+    assert SceneScheduler(4).order(items, costs) == ['/toa/b.tif', '/toa/c.tif', '/toa/d.tif', '/toa/a.tif']
+    # Independent of the input order
+    assert SceneScheduler(4).order(items[::-1], costs) == SceneScheduler(4).order(items, costs)
+
+def test_unknown_costs_go_last():
+    costs = {'/toa/b.tif': 1.0}
+    assert SceneScheduler(4).order(['/toa/c.tif', '/toa/a.tif', '/toa/b.tif'], costs) == \
+        ['/toa/b.tif', '/toa/a.tif', '/toa/c.tif']
+
+def test_calibrate():
+    predicted = [10.0, 20.0, 40.0, 80.0]
+    fit = SceneScheduler.calibrate(predicted, [1.5 * cost + 30.0 for cost in predicted])
+    assert fit['scenes'] == 4
+    assert fit['seconds_per_mpx'] == pytest.approx(1.5)
+    assert fit['overhead'] == pytest.approx(30.0)
+    assert fit['r2'] == pytest.approx(1.0)
+
+def test_calibrate_underdetermined():
+    assert SceneScheduler.calibrate([10.0], [40.0]) is None
+    assert SceneScheduler.calibrate([10.0, 10.0], [40.0, 45.0]) is None
+    assert SceneScheduler.calibrate([10.0, None], [40.0, 45.0]) is None
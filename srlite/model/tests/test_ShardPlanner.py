@@ -0,0 +1,54 @@
+import random
+import pytest
+from srlite.model.ShardPlanner import ShardPlanner
+
+def getScenes(count=37, seed=0):
+    rng = random.Random(seed)
+    items = ['/toa/WV02_{:04d}-toa.tif'.format(index) for index in range(0, count)]
+    return items, [rng.randint(1, 1000) for item in items]
+
+def test_assignment_is_deterministic():
+    items, weights = getScenes()
+    expected = ShardPlanner.assign(items, 4, weights)
+    # Every task of a job array lists the scenes independently - the input order must not matter
+    shuffled = list(zip(items, weights))
+    random.Random(1).shuffle(shuffled)
+    assert ShardPlanner.assign([item for item, weight in shuffled], 4, [weight for item, weight in shuffled]) \
+        == expected
+    assert ShardPlanner.assign(items, 4, weights) == expected
+
+def test_shards_partition_the_batch():
+    items, weights = getScenes()
+    shards = [ShardPlanner.getShard(items, index, 5, weights) for index in range(0, 5)]
+    assert sorted(item for shard in shards for item in shard) == sorted(items)
+    assert all(shard == sorted(shard) for shard in shards)
+
+def test_lpt_balance():
+    items, weights = getScenes(count=200, seed=2)
+    weight_of = dict(zip(items, weights))
+    loads = [sum(weight_of[item] for item in shard) for shard in ShardPlanner.assign(items, 8, weights)]
+    # LPT bound: no shard exceeds the mean load by more than the largest item
+    assert max(loads) - sum(loads) / len(loads) <= max(weights)
+
+def test_ties_are_broken_by_path():
+    items = ['/toa/c.tif', '/toa/a.tif', '/toa/b.tif', '/toa/d.tif']
+    assert ShardPlanner.assign(items, 2, [1, 1, 1, 1]) == [['/toa/a.tif', '/toa/c.tif'],
+                                                            ['/toa/b.tif', '/toa/d.tif']]
+
+def test_no_sharding():
+    items, weights = getScenes(count=5)
+    assert ShardPlanner.getShard(items, 0, 1, weights) == items
+
+@pytest.mark.parametrize('spec, environ, expected', [
+    (None, None, (0, 1)),
+    ('2/8', None, (2, 8)),
+    ('slurm', {'SLURM_ARRAY_TASK_ID': '3', 'SLURM_ARRAY_TASK_COUNT': '4'}, (3, 4)),
+    ('slurm', {'SLURM_ARRAY_TASK_ID': '5', 'SLURM_ARRAY_TASK_MIN': '1', 'SLURM_ARRAY_TASK_MAX': '8'}, (4, 8)),
+])
+def test_parse(spec, environ, expected):
+    assert ShardPlanner.parse(spec, environ) == expected
+
+@pytest.mark.parametrize('spec, environ', [('8/8', None), ('1-2', None), ('slurm', {})])
+def test_parse_invalid(spec, environ):
+    with pytest.raises(ValueError):
+        ShardPlanner.parse(spec, environ)
@@ -0,0 +1,104 @@
+import os
+import pytest
+from srlite.model.WorkQueue import WorkQueue
+
+@pytest.fixture
+def queues(tmp_path):
+    # Two nodes sharing a queue, populated with three scenes of different sizes
+    first = WorkQueue(tmp_path, timeout=60, owner='node1:1')
+    second = WorkQueue(tmp_path, timeout=60, owner='node2:1')
+    assert first.populate(['/toa/a.tif', '/toa/b.tif', '/toa/c.tif'], [10, 30, 20])
+    assert not second.populate(['/toa/a.tif', '/toa/b.tif', '/toa/c.tif'], [10, 30, 20])
+    return first, second
+
+def makeStale(queue, name):
+    os.utime(os.path.join(queue.queue_dir, WorkQueue.STATE_CLAIMED, name), (0, 0))
+
+def test_claims_largest_first(queues):
+    first, second = queues
+    assert [first.claim()[1]['toa'], second.claim()[1]['toa'], first.claim()[1]['toa']] == \
+        ['/toa/b.tif', '/toa/c.tif', '/toa/a.tif']
+    assert first.claim() is None
+    assert first.getCounts() == {'pending': 0, 'claimed': 3, 'done': 0, 'failed': 0}
+
+def test_complete_and_consolidate(queues):
+    first, second = queues
+    name, record = first.claim()
+    assert record['owner'] == 'node1:1'
+    first.complete(name, {'toa': record['toa'], 'status': 'completed'})
+    assert first.consolidate() is None
+
+    while True:
+        claim = second.claim()
+        if claim is None:
+            break
+        status = 'failed' if claim[1]['toa'] == '/toa/a.tif' else 'completed'
+        second.complete(claim[0], {'toa': claim[1]['toa'], 'status': status})
+    assert second.isDrained()
+    assert second.getCounts() == {'pending': 0, 'claimed': 0, 'done': 2, 'failed': 1}
+
+    summaryList = second.consolidate()
+    assert [(summary['toa'], summary['owner']) for summary in summaryList] == \
+        [('/toa/a.tif', 'node2:1'), ('/toa/b.tif', 'node1:1'), ('/toa/c.tif', 'node2:1')]
+    # Consolidated once per batch
+    assert first.consolidate() is None
+
+def test_stale_claims_are_reclaimed(queues):
+    first, second = queues
+    name, record = first.claim()
+    assert second.reclaimStale() == []
+    makeStale(first, name)
+    assert second.reclaimStale() == [name]
+    assert second.claim()[0] == name
+
+def test_complete_keeps_claims_of_other_owners(queues):
+    first, second = queues
+    name, record = first.claim()
+    makeStale(first, name)
+    second.reclaimStale()
+    second.claim()
+
+    # The first owner finishes late - its result is kept, but the claim now belongs to the second owner
+    first.complete(name, {'toa': record['toa'], 'status': 'completed'})
+    assert os.path.exists(os.path.join(first.queue_dir, WorkQueue.STATE_CLAIMED, name))
+    assert not first.isDrained()
+
+    second.complete(name, {'toa': record['toa'], 'status': 'completed'})
+    assert not os.path.exists(os.path.join(first.queue_dir, WorkQueue.STATE_CLAIMED, name))
+
+def test_failure_does_not_replace_result_of_other_owner(queues):
+    first, second = queues
+    name, record = first.claim()
+    makeStale(first, name)
+    second.reclaimStale()
+    second.claim()
+    second.complete(name, {'toa': record['toa'], 'status': 'completed'})
+
+    first.complete(name, {'toa': record['toa'], 'status': 'failed'})
+    counts = first.getCounts()
+    assert (counts['done'], counts['failed']) == (1, 0)
+
+def test_fresh_claims_are_not_reclaimed(queues, monkeypatch):
+    first, second = queues
+    pending = os.path.join(first.queue_dir, WorkQueue.STATE_PENDING)
+    for name in os.listdir(pending):
+        # Queue populated longer than the timeout ago
+        os.utime(os.path.join(pending, name), (0, 0))
+
+    rename = os.rename
+    reclaimed = []
+
+    def renameThenReclaim(src, dst):
+        # Another node looks for stale claims between the rename and the record rewrite
+        rename(src, dst)
+        reclaimed.extend(second.reclaimStale())
+
+    monkeypatch.setattr(os, 'rename', renameThenReclaim)
+    name, record = first.claim()
+    monkeypatch.setattr(os, 'rename', rename)
+
+    assert reclaimed == []
+    assert record['toa'] == '/toa/b.tif'
+    states = [state for state in WorkQueue.STATES if os.path.exists(os.path.join(first.queue_dir, state, name))]
+    assert states == [WorkQueue.STATE_CLAIMED]
+    assert first._read(os.path.join(first.queue_dir, WorkQueue.STATE_CLAIMED, name))['owner'] == 'node1:1'
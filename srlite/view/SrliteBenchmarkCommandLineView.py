@@ -0,0 +1,154 @@
+"""
+Purpose: Benchmark the SR-Lite workflow end to end on synthetic WorldView/CCDC scenes.  For every
+         combination of scene size and regressor a scene triplet is generated (once per size), the
+         workflow is run in a fresh process, and the wall time of each RasterLib stage, the peak RSS
+         and the throughput (TOA pixels per second) are saved as JSON.
+
+         Example:
+         python ./srlite/view/SrliteBenchmarkCommandLineView.py --sizes 2048,8192 --regressors ols,rma \
+             --work_dir /tmp/srlite-bench --output bench.json --srlite_args "--cloudmask --batchfit"
+"""
+# --------------------------------------------------------------------------------
+# Import System Libraries
+# --------------------------------------------------------------------------------
+import sys
+import os
+import time
+import json
+import shlex
+import shutil
+import resource
+import argparse
+import platform
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from unittest.mock import patch
+
+from srlite.model.Context import Context
+from srlite.model.RasterLib import RasterLib
+from srlite.model.SyntheticScene import SyntheticScene
+from srlite.view.SrliteWorkflowCommandLineView import processScene
+
+class StageTimer(object):
+    """
+    Proxy for RasterLib that accumulates the wall time of each method called by the workflow
+    """
+    def __init__(self, rasterLib):
+        self._rasterLib = rasterLib
+        self.stages = {}
+
+    def __getattr__(self, name):
+        attribute = getattr(self._rasterLib, name)
+        if not callable(attribute):
+            return attribute
+
+        def timed(*args, **kwargs):
+            stage_start_time = time.perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - stage_start_time
+        return timed
+
+def runCase(case):
+    """
+    Run the workflow on one generated scene - executed in a fresh process so peak RSS is per case
+    """
+    output_dir = os.path.join(case['work_dir'], 'output', '{}-{}'.format(case['prefix'], case['regressor']))
+    argv = ['SrliteWorkflowCommandLineView.py',
+            '-toa_dir', case['toa_fn'],
+            '-target_dir', case['target_fn'],
+            '-cloudmask_dir', case['cloudmask_fn'],
+            '-bandpairs', case['band_pairs'],
+            '-output_dir', output_dir,
+            '--regressor', case['regressor'],
+            '--clean'] + shlex.split(case['srlite_args'])
+
+    with patch('sys.argv', argv):
+        contextClazz = Context()
+    context = contextClazz.getDict()
+    rasterLib = StageTimer(RasterLib(int(context[Context.DEBUG_LEVEL]), contextClazz.getPlotLib()))
+    rasterLib.openCatalog(context)
+
+    summary = processScene(contextClazz, rasterLib, context, case['toa_fn'])
+    if not case['keep']:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    pixels = case['width'] * case['height'] * case['bands']
+    return {'size': case['width'], 'height': case['height'], 'bands': case['bands'],
+            'regressor': case['regressor'], 'repeat': case['repeat'], 'srlite_args': case['srlite_args'],
+            'status': summary['status'], 'error': summary['error'], 'elapsed': summary['elapsed'],
+            'stages': rasterLib.stages,
+            # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss /
+                           (1 << 20 if sys.platform == 'darwin' else 1 << 10),
+            'pixels_per_second': pixels / summary['elapsed'] if summary['elapsed'] > 0 else None}
+
+def getParser():
+    parser = argparse.ArgumentParser(description='Benchmark SR-Lite on synthetic scenes.')
+    parser.add_argument('--sizes', type=str, default='1024,4096',
+                        help='Comma-separated TOA sizes (2m pixels per side)')
+    parser.add_argument('--regressors', type=str, default='ols,rma',
+                        help='Comma-separated regressors (ols, rma, huber)')
+    parser.add_argument('--bands', type=int, default=4, help='Number of band pairs')
+    parser.add_argument('--collar', type=int, default=64, help='Width of the TOA nodata collar in pixels')
+    parser.add_argument('--offset', type=str, default='7,-11',
+                        help='x,y offset in meters of the target grid from the TOA grid')
+    parser.add_argument('--cloudfraction', type=float, default=0.1, dest='cloud_fraction',
+                        help='Approximate fraction of cloudy pixels')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of runs of each case')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the generated scenes')
+    parser.add_argument('--work_dir', type=str, default='./srlite-benchmark',
+                        help='Directory for generated scenes and outputs')
+    parser.add_argument('--output', type=str, default=None,
+                        help='JSON results file (default <work_dir>/benchmark.json)')
+    parser.add_argument('--srlite_args', type=str, default='--cloudmask',
+                        help='Additional SR-Lite workflow arguments applied to every case')
+    parser.add_argument('--keep', action='store_true', default=False,
+                        help='Keep generated SR-Lite outputs')
+    return parser
+
+def main():
+    args = getParser().parse_args()
+    os.makedirs(args.work_dir, exist_ok=True)
+    offset = [float(value) for value in args.offset.split(',')]
+    results = []
+    start_time = time.time()
+
+    for size in [int(value) for value in args.sizes.split(',')]:
+        # Generate (or reuse) the scene for this size
+        scene = SyntheticScene(size, bands=args.bands, collar=args.collar, offset=offset,
+                               cloud_fraction=args.cloud_fraction, seed=args.seed)
+        scene_dir = os.path.join(args.work_dir, 'scenes')
+        fn_list = [os.path.join(scene_dir, scene.getPrefix() + suffix) for suffix in
+                   (scene.TOA_SUFFIX, scene.TARGET_SUFFIX, scene.CLOUDMASK_SUFFIX)]
+        if not all(os.path.exists(fn) for fn in fn_list):
+            generate_start_time = time.time()
+            fn_list = scene.write(scene_dir)
+            print(f'Generated {scene.getPrefix()} in {time.time() - generate_start_time:.1f}s')
+
+        for regressor in args.regressors.split(','):
+            for repeat in range(0, args.repeat):
+                case = {'work_dir': args.work_dir, 'prefix': scene.getPrefix(),
+                        'toa_fn': fn_list[0], 'target_fn': fn_list[1], 'cloudmask_fn': fn_list[2],
+                        'band_pairs': scene.getBandPairs(), 'width': scene.width, 'height': scene.height,
+                        'bands': scene.bands, 'regressor': regressor, 'repeat': repeat,
+                        'srlite_args': args.srlite_args, 'keep': args.keep}
+                # A fresh (spawned) process per case isolates peak RSS and GDAL caches
+                with ProcessPoolExecutor(max_workers=1,
+                                         mp_context=multiprocessing.get_context('spawn')) as executor:
+                    result = executor.submit(runCase, case).result()
+                results.append(result)
+                print(f"{scene.getPrefix()} {regressor} #{repeat}: {result['status']} "
+                      f"{result['elapsed']:.2f}s {result['peak_rss_mb']:.0f}MB "
+                      f"{(result['pixels_per_second'] or 0) / 1e6:.1f} Mpix/s")
+
+    path = args.output or os.path.join(args.work_dir, 'benchmark.json')
+    with open(path, 'w') as resultsFile:
+        json.dump({'command': sys.argv, 'python': platform.python_version(), 'host': platform.node(),
+                   'cpus': os.cpu_count(), 'elapsed': time.time() - start_time, 'results': results},
+                  resultsFile, indent=2)
+    print(f'Benchmark results saved to {path}')
+
+if __name__ == "__main__":
+    main()
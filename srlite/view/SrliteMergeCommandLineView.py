@@ -0,0 +1,142 @@
+"""
+Purpose: Merge the outputs of a sharded SR-Lite batch (see --shard).  The run summaries of all shards
+         (<batch>_shard<i>of<N>_SRLite_summary.json) are combined into one batch summary, and the
+         per-scene metrics CSVs (<batch>_<scene>_<regressor>_SRLite_metrics.csv) into one batch CSV
+         with a scene column.  Missing or duplicated shards are reported.
+
+         Example:
+         python ./srlite/view/SrliteMergeCommandLineView.py -output_dir /path/to/output --batch Yukon_Delta
+"""
+# --------------------------------------------------------------------------------
+# Import System Libraries
+# --------------------------------------------------------------------------------
+import sys
+import os
+import re
+import json
+import glob
+import argparse
+import pandas as pd
+
+from srlite.model.Context import Context
+
+FN_METRICS_SUFFIX = '_SRLite_metrics.csv'
+
+def getShardSummaries(dir_list, batch):
+    """
+    Return the shard summary files of batch (all batches if batch is None) in the output directories
+    """
+    pattern = re.compile(r'^(?P<batch>.+)_shard(?P<index>\d+)of(?P<count>\d+)' + re.escape(Context.FN_SUMMARY_SUFFIX) + '$')
+    summaries = {}
+    for dir_name in dir_list:
+        for path in sorted(glob.glob(os.path.join(glob.escape(dir_name), '*' + Context.FN_SUMMARY_SUFFIX))):
+            match = pattern.match(os.path.basename(path))
+            if (match is None) or ((batch is not None) and (match.group('batch') != batch)):
+                continue
+            summaries.setdefault(match.group('batch'), []).append(path)
+    return summaries
+
+def mergeSummaries(batch, pathList):
+    """
+    Combine shard summaries - counts and warp cache statistics are summed, scenes concatenated and the
+    elapsed time is that of the slowest shard
+    """
+    counts = {}
+    warp_cache = {'hit': 0, 'miss': 0}
+    scenes, shards = [], {}
+    elapsed, workers, shard_count = 0.0, 0, 0
+    for path in pathList:
+        with open(path) as summaryFile:
+            summary = json.load(summaryFile)
+        index, count = summary.get('shard', [0, 1])
+        shards.setdefault(index, []).append(path)
+        shard_count = max(shard_count, count)
+        for status, value in summary['counts'].items():
+            counts[status] = counts.get(status, 0) + value
+        for status, value in summary.get('warp_cache', {}).items():
+            warp_cache[status] = warp_cache.get(status, 0) + value
+        scenes.extend(summary['scenes'])
+        elapsed = max(elapsed, summary['elapsed'])
+        workers = max(workers, summary.get('workers', 1))
+
+    missing = [index for index in range(0, shard_count) if index not in shards]
+    duplicates = {index: paths for index, paths in shards.items() if len(paths) > 1}
+    return {'batch': batch, 'elapsed': elapsed, 'workers': workers,
+            'shards': {'count': shard_count, 'merged': sorted(shards), 'missing': missing,
+                       'duplicates': duplicates},
+            'counts': counts, 'warp_cache': warp_cache,
+            'scenes': sorted(scenes, key=lambda summary: str(summary['scene']))}
+
+def mergeMetrics(dir_list, batch, sceneList, path):
+    """
+    Concatenate the metrics CSVs of the scenes in sceneList into path, with the scene (and regressor)
+    in a 'scene' column.  Returns the number of CSVs merged.
+    """
+    frames = []
+    prefix = batch + '_'
+    for dir_name in dir_list:
+        for csv_dir in (dir_name, os.path.join(dir_name, 'csv')):
+            for fn in sorted(glob.glob(os.path.join(glob.escape(csv_dir), prefix + '*' + FN_METRICS_SUFFIX))):
+                # <scene>_<regressor> - other batches may share the prefix of this one
+                name = os.path.basename(fn)[len(prefix):-len(FN_METRICS_SUFFIX)]
+                if not any(name.startswith(scene + '_') for scene in sceneList):
+                    continue
+                frame = pd.read_csv(fn, index_col=0)
+                frame.insert(0, 'scene', name)
+                frames.append(frame)
+
+    if (len(frames) > 0):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        pd.concat(frames).to_csv(path)
+    return len(frames)
+
+def getParser():
+    parser = argparse.ArgumentParser(description='Merge the summaries and metrics CSVs of a sharded SR-Lite batch.')
+    parser.add_argument('-output_dir', '--output_dir', type=str, nargs='+', required=True, dest='dir_out',
+                        help='Output directories of the shards (searched for summaries, and metrics CSVs '
+                             'in them and their csv subdirectory)')
+    parser.add_argument('--batch', type=str, default=None, dest='batch_name',
+                        help='Batch name to merge (default: every sharded batch found)')
+    parser.add_argument('--merge_dir', type=str, default=None,
+                        help='Directory of the merged summary and CSV (default: the first output directory)')
+    parser.add_argument('--partial', action='store_true', default=False,
+                        help='Exit successfully even if shards are missing')
+    return parser
+
+def main():
+    args = getParser().parse_args()
+    merge_dir = args.merge_dir or args.dir_out[0]
+    os.makedirs(merge_dir, exist_ok=True)
+
+    summaries = getShardSummaries(args.dir_out, args.batch_name)
+    if (len(summaries) == 0):
+        print(f'No shard summaries found in {args.dir_out}')
+        return 1
+
+    status = 0
+    for batch, pathList in sorted(summaries.items()):
+        merged = mergeSummaries(batch, pathList)
+        csv_path = os.path.join(merge_dir, batch + FN_METRICS_SUFFIX)
+        sceneList = set(str(summary['scene']) for summary in merged['scenes'])
+        merged['metrics_csv'] = csv_path if mergeMetrics(args.dir_out, batch, sceneList, csv_path) > 0 else None
+
+        path = os.path.join(merge_dir, batch + Context.FN_SUMMARY_SUFFIX)
+        with open(path, 'w') as summaryFile:
+            json.dump(merged, summaryFile, indent=2)
+
+        shards = merged['shards']
+        print(f"Batch {batch}: {len(shards['merged'])} of {shards['count']} shards, "
+              f"{len(merged['scenes'])} scenes {merged['counts']}")
+        if (len(shards['missing']) > 0):
+            print(f"   Missing shards: {shards['missing']}")
+            if not args.partial:
+                status = 1
+        for index, paths in shards['duplicates'].items():
+            print(f'   Shard {index} found more than once: {paths}')
+        print(f'Merged summary saved to {path}')
+        if (merged['metrics_csv'] is not None):
+            print(f"Merged metrics saved to {merged['metrics_csv']}")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -15,11 +15,432 @@ Original Author: Glenn Tamkin, CISTO, Code 602
 import sys
 import os
 import time  # tracking time
-import pathlib
-from pathlib import Path
+import json
+import ast
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from srlite.model.Context import Context
 from srlite.model.RasterLib import RasterLib
+from srlite.model.MemoryPlanner import MemoryPlanner
+from srlite.model.ShardPlanner import ShardPlanner
+from srlite.model.WorkQueue import WorkQueue
+from srlite.model.SceneScheduler import SceneScheduler
+
+# Per-process handles used by batch workers (see _initWorker)
+_workerContextClazz = None
+_workerRasterLib = None
+# Per-thread handles used by prefetch threads (see _prepareScenePrefetch)
+_prefetchLocal = threading.local()
+
+def processScene(contextClazz, rasterLib, context, toa_fn):
+    """
+    Run the SR-Lite workflow against a single TOA file and return a summary record.
+    Errors are captured in the record so that a failing scene does not stop the batch.
+    """
+    context, summary = prepareScene(contextClazz, rasterLib, context, toa_fn)
+    return computeScene(contextClazz, rasterLib, context, summary)
+
+def prepareScene(contextClazz, rasterLib, context, toa_fn):
+    """
+    Validate, open and warp a single TOA file (the I/O-bound part of the workflow).
+    Return the scene context and a summary record whose status is 'prepared' when the scene is
+    ready for computeScene().
+    """
+    scene_start_time = time.time()
+    summary = {'toa': str(toa_fn), 'scene': os.path.basename(str(toa_fn)),
+               'status': 'skipped', 'error': None, 'pid': os.getpid()}
+
+    # Each scene works on its own copy of the context
+    context = dict(context)
+    context[Context.FN_TOA] = toa_fn
+    try:
+        # Generate file names based on incoming EVHR file and declared suffixes - get snapshot
+        context = contextClazz.getFileNames(str(context[Context.FN_TOA]).rsplit("/", 1), context,
+                                            rasterLib.getCatalog())
+        summary['scene'] = context[Context.FN_PREFIX]
+
+         # Remove existing SR-Lite output if clean_flag is activated (resumed scenes are stale or incomplete)
+        rasterLib.removeFile(context[Context.FN_COG], str(eval(context[Context.CLEAN_FLAG])
+                                                          or eval(context[Context.RESUME_FLAG])))
+
+        # Proceed if SR-Lite output does not exist
+        if  not (os.path.exists(context[Context.FN_COG])):
+
+            manifest = rasterLib.getManifest()
+            if (manifest is not None):
+                fn_list = [context[Context.FN_TOA], context[Context.FN_TARGET]]
+                if (eval(context[Context.CLOUD_MASK_FLAG])):
+                    fn_list.append(context[Context.FN_CLOUDMASK])
+                manifest.start(toa_fn, context[Context.FN_PREFIX], context[Context.PARAMETER_HASH], fn_list)
+
+            # Capture input attributes - then align all artifacts to EVHR TOA projection
+            with rasterLib.profileStage(context, 'snapshot'):
+                rasterLib.getAttributeSnapshot(context)
+
+            # Define order indices for list processing
+            context[Context.LIST_INDEX_TARGET] = 0
+            context[Context.LIST_INDEX_TOA] = 1
+            context[Context.LIST_INDEX_CLOUDMASK] = -1  # increment if cloudmask requested
+
+            # Validate that input band name pairs exist in EVHR & CCDC files
+            context[Context.FN_LIST] = [str(context[Context.FN_TARGET]), str(context[Context.FN_TOA])]
+            with rasterLib.profileStage(context, 'bandindices'):
+                context[Context.LIST_BAND_PAIR_INDICES] = rasterLib.getBandIndices(context)
+
+            # Stream or use disk-backed storage if the scene does not fit in its share of --max-memory
+            plan = rasterLib.planMemory(context)
+            summary['memory_plan'] = None if plan is None else plan['mode']
+
+             #  Reproject TARGET (CCDC) to attributes of EVHR TOA Downscale  - use 'average' for resampling method
+            context[Context.FN_REPROJECTION_LIST] = [str(context[Context.FN_TARGET]), str(context[Context.FN_TOA])]
+            context[Context.TARGET_FN] = str(context[Context.FN_TOA])
+            context[Context.TARGET_SAMPLING_METHOD] = 'average'
+            with rasterLib.profileStage(context, 'reprojection') as stage:
+                context[Context.DS_WARP_LIST], context[Context.MA_WARP_LIST] = rasterLib.getReprojection(context)
+                stage['pixels'] = sum(ma.size for ma in context[Context.MA_WARP_LIST])
+
+            #  Downsample cloudmask to attributes of EVHR TOA Downscale  - cloud fraction per 30m cell
+            if (eval(context[Context.CLOUD_MASK_FLAG])):
+                with rasterLib.profileStage(context, 'reprojection_cloudmask') as stage:
+                    context[Context.DS_WARP_CLOUD_LIST], context[Context.MA_WARP_CLOUD_LIST] = \
+                        rasterLib.getCloudmaskReprojection(context)
+                    stage['pixels'] = sum(ma.size for ma in context[Context.MA_WARP_CLOUD_LIST])
+                context[Context.LIST_INDEX_CLOUDMASK] = 2
+
+            summary['status'] = 'prepared'
+
+    except BaseException as err:
+        _recordFailure(summary, err)
+        rasterLib.removeScratch(context)
+
+    summary['elapsed'] = time.time() - scene_start_time
+    return context, summary
+
+def computeScene(contextClazz, rasterLib, context, summary):
+    """
+    Fit, apply and write a scene returned by prepareScene() (the compute-bound part of the workflow)
+    """
+    if (summary['status'] != 'prepared'):
+        _recordScene(rasterLib, context, summary)
+        return summary
+
+    scene_start_time = time.time()
+    try:
+        # GDAL block cache of the memory plan (process-wide, hence set here rather than in prepareScene)
+        rasterLib.setCacheMax(context)
+
+        # Perform regression to capture coefficients from intersected pixels and apply to 2m EVHR
+        context[Context.PRED_LIST], sr_metrics_list= rasterLib.simulateSurfaceReflectance(context)
+
+        # Create COG image from stack of processed bands
+        context[Context.FN_SRC] = str(context[Context.FN_TOA])
+        context[Context.FN_DEST] = str(context[Context.FN_COG])
+        context[Context.FN_COG] = rasterLib.createImage(context)
+
+        # Generate CSV
+        with rasterLib.profileStage(context, 'csv') as stage:
+            rasterLib.generateCSV(context, sr_metrics_list)
+            stage['pixels'] = len(sr_metrics_list)
+
+        # Clean up
+        rasterLib.refresh(context)
+        summary['status'] = 'completed'
+        summary['warp_cache'] = context.get(Context.WARP_CACHE_STATUS)
+        summary['grid_plan'] = context.get(Context.GRID_PLAN_LIST)
+        cloud_fraction = context.get(Context.MA_CLOUD_FRACTION)
+        if (cloud_fraction is not None) and (cloud_fraction.count() > 0):
+            summary['cloud_fraction'] = float(cloud_fraction.mean())
+
+    except BaseException as err:
+        _recordFailure(summary, err)
+    finally:
+        # Already removed by refresh() on success
+        rasterLib.removeScratch(context)
+
+    # Time spent on the scene (prepare + compute), excluding time waiting in the prefetch queue
+    summary['elapsed'] += time.time() - scene_start_time
+    _recordScene(rasterLib, context, summary)
+    return summary
+
+def _recordScene(rasterLib, context, summary):
+    manifest = rasterLib.getManifest()
+    if (manifest is not None):
+        try:
+            manifest.record(summary, context.get(Context.FN_COG))
+        except BaseException as err:
+            print('Manifest not updated - Error details: ', err)
+
+def _recordFailure(summary, err):
+    if isinstance(err, FileNotFoundError):
+        print('File Not Found - Error details: ', err)
+    else:
+        print('Run abended - Error details: ', err)
+    summary['status'] = 'failed'
+    summary['error'] = str(err)
+
+def _initWorker(context_dict):
+    """
+    Pool initializer - build the per-process context and raster library once per worker
+    """
+    global _workerContextClazz, _workerRasterLib
+    _workerContextClazz = Context(context_dict)
+    _workerRasterLib = RasterLib(int(context_dict[Context.DEBUG_LEVEL]), _workerContextClazz.getPlotLib())
+    _workerRasterLib.openCatalog(context_dict, readonly=True)
+    _workerRasterLib.openManifest(context_dict)
+
+def _processSceneWorker(toa_fn):
+    return processScene(_workerContextClazz, _workerRasterLib, _workerContextClazz.getDict(), toa_fn)
+
+def _prepareScenePrefetch(context_dict, toa_fn):
+    """
+    Prefetch task - each prefetch thread builds its own context and raster library (catalog connections
+    and GDAL handles are not shared between threads)
+    """
+    if (getattr(_prefetchLocal, 'rasterLib', None) is None):
+        _prefetchLocal.contextClazz = Context(context_dict)
+        _prefetchLocal.rasterLib = RasterLib(int(context_dict[Context.DEBUG_LEVEL]),
+                                             _prefetchLocal.contextClazz.getPlotLib())
+        _prefetchLocal.rasterLib.openCatalog(context_dict, readonly=True)
+        _prefetchLocal.rasterLib.openManifest(context_dict)
+    return prepareScene(_prefetchLocal.contextClazz, _prefetchLocal.rasterLib, context_dict, toa_fn)
+
+def runPipeline(contextClazz, rasterLib, context, toaList, depth):
+    """
+    Process scenes in order while up to 'depth' following scenes are validated, opened and warped by
+    background threads - the prefetch depth bounds the number of prepared scenes held in memory, and
+    --max-memory is shared by the depth + 1 resident scenes (see RasterLib.planMemory)
+    """
+    print(f'Processing {len(toaList)} scenes with a prefetch depth of {depth}')
+    summaryList = []
+    with ThreadPoolExecutor(max_workers=depth, thread_name_prefix='srlite-prefetch') as executor:
+        pending = deque(executor.submit(_prepareScenePrefetch, dict(context), str(toa_fn))
+                        for toa_fn in toaList[:depth])
+        next_index = len(pending)
+        while pending:
+            sceneContext, summary = pending.popleft().result()
+            if (next_index < len(toaList)):
+                pending.append(executor.submit(_prepareScenePrefetch, dict(context), str(toaList[next_index])))
+                next_index += 1
+            summaryList.append(computeScene(contextClazz, rasterLib, sceneContext, summary))
+            sceneContext = None
+    return summaryList
+
+def getWorkers(contextClazz, rasterLib, context, toaList):
+    """
+    Number of worker processes - reduced when the largest scene could not otherwise fit in --max-memory
+    """
+    workers = int(context[Context.WORKERS])
+    if (float(context[Context.MAX_MEMORY]) <= 0) or (workers < 2) or (len(toaList) < 2):
+        return workers
+
+    largest = max(toaList, key=lambda fn: os.path.getsize(fn))
+    try:
+        sceneContext = contextClazz.getFileNames(str(largest).rsplit("/", 1), dict(context), rasterLib.getCatalog())
+    except FileNotFoundError:
+        return workers
+    planner = MemoryPlanner(float(context[Context.MAX_MEMORY]) * (1 << 30), workers)
+    budgetWorkers = planner.getWorkers(rasterLib.getMemoryEstimate(sceneContext, planner))
+    if (budgetWorkers < workers):
+        print(f'Reducing workers from {workers} to {budgetWorkers} to fit {context[Context.MAX_MEMORY]} GB')
+        # Per-scene budgets are shares of --max-memory across the effective workers
+        context[Context.WORKERS] = budgetWorkers
+    return budgetWorkers
+
+def runBatch(contextClazz, rasterLib, context, toaList):
+    """
+    Process every scene in toaList, either in this process or in a pool of worker processes.
+    Workers are recycled after MAX_TASKS_PER_WORKER scenes to bound GDAL/NumPy memory growth.
+    """
+    workers = getWorkers(contextClazz, rasterLib, context, toaList)
+    if (workers > 1 and len(toaList) > 1):
+        print(f'Processing {len(toaList)} scenes with {workers} worker processes')
+        with multiprocessing.Pool(processes=min(workers, len(toaList)),
+                                  initializer=_initWorker,
+                                  initargs=(dict(context),),
+                                  maxtasksperchild=int(context[Context.MAX_TASKS_PER_WORKER])) as pool:
+            summaryList = list(pool.imap_unordered(_processSceneWorker, [str(fn) for fn in toaList]))
+    elif (int(context[Context.PREFETCH]) > 0 and len(toaList) > 1):
+        summaryList = runPipeline(contextClazz, rasterLib, context, toaList, int(context[Context.PREFETCH]))
+    else:
+        summaryList = [processScene(contextClazz, rasterLib, context, toa_fn) for toa_fn in toaList]
+    return summaryList
+
+def runQueue(contextClazz, rasterLib, context, toaList):
+    """
+    Claim scenes from the shared queue (--queue_dir) until it is drained, in this process or in a pool
+    of worker processes.  Idle workers return stale claims of dead nodes to the queue.
+    Return the summaries of this node and, for the node that drains the queue, of the whole batch.
+    """
+    queue = WorkQueue(context[Context.QUEUE_DIR], float(context[Context.QUEUE_TIMEOUT]))
+    if queue.populate(toaList, getSceneWeights(toaList, rasterLib.getCatalog())):
+        print(f'Queued {len(toaList)} scenes in {queue.queue_dir}')
+    workers = getWorkers(contextClazz, rasterLib, context, toaList)
+    print(f'Processing scenes from {queue.queue_dir} with {workers} worker(s) as {queue.owner}: {queue.getCounts()}')
+
+    pool = None
+    if (workers > 1):
+        pool = multiprocessing.Pool(processes=workers, initializer=_initWorker, initargs=(dict(context),),
+                                    maxtasksperchild=int(context[Context.MAX_TASKS_PER_WORKER]))
+    summaryList = []
+    running = {}
+    queue.start()
+    try:
+        while True:
+            # Keep every worker busy with the largest pending scene
+            while (len(running) < workers):
+                claim = queue.claim()
+                if (claim is None):
+                    break
+                name, record = claim
+                if (pool is None):
+                    running[name] = (record['toa'], processScene(contextClazz, rasterLib, context, record['toa']))
+                else:
+                    running[name] = (record['toa'], pool.apply_async(_processSceneWorker, (record['toa'],)))
+
+            for name in [name for name, (toa_fn, result) in running.items() if (pool is None) or result.ready()]:
+                toa_fn, summary = running.pop(name)
+                if (pool is not None):
+                    try:
+                        summary = summary.get()
+                    except BaseException as err:
+                        # The worker process died - the scene is recorded as failed
+                        summary = {'toa': toa_fn, 'scene': os.path.basename(toa_fn), 'error': None,
+                                   'pid': None, 'elapsed': 0.0}
+                        _recordFailure(summary, err)
+                queue.complete(name, summary)
+                summaryList.append(summary)
+
+            if (len(running) == 0):
+                if queue.isDrained():
+                    break
+                # Nothing to claim - wait for the other nodes, taking over their scenes if they die
+                reclaimed = queue.reclaimStale()
+                if (len(reclaimed) > 0):
+                    print(f'Reclaimed stale scenes: {reclaimed}')
+                else:
+                    time.sleep(min(10.0, queue.timeout / 4))
+            elif (pool is not None):
+                time.sleep(1)
+    finally:
+        queue.stop()
+        if (pool is not None):
+            pool.close()
+            pool.join()
+
+    return summaryList, queue.consolidate(), queue
+
+def getSchedule(contextClazz, rasterLib, context, toaList):
+    """
+    Order toaList largest estimated cost first (--schedule cost).
+    Return the ordered list and the predicted cost of each scene.
+    """
+    scheduler = SceneScheduler(len(list(ast.literal_eval(context[Context.LIST_BAND_PAIRS]))))
+    costs = {}
+    for toa_fn in toaList:
+        try:
+            costs[str(toa_fn)] = scheduler.estimate(rasterLib.getRasterShape(toa_fn))
+        except BaseException:
+            # Missing or unreadable inputs - the scene fails fast wherever it is scheduled
+            continue
+
+    scheduleList = scheduler.order(toaList, costs)
+    print(f'Scheduled {len(scheduleList)} scenes largest first: {sum(costs.values()):.0f} Mpx predicted')
+    return scheduleList, costs
+
+def getScheduleReport(summaryList, costs):
+    """
+    Add the predicted cost to each scene summary and fit the elapsed time of completed scenes to it
+    """
+    for summary in summaryList:
+        summary['predicted_cost'] = costs.get(str(summary['toa']))
+    completed = [summary for summary in summaryList
+                 if (summary['status'] == 'completed') and (summary['predicted_cost'] is not None)]
+    fit = SceneScheduler.calibrate([summary['predicted_cost'] for summary in completed],
+                                   [summary['elapsed'] for summary in completed])
+    if (fit is not None):
+        print(f"Cost model: {fit['seconds_per_mpx']:.4f} s/Mpx + {fit['overhead']:.1f} s "
+              f"(r2 = {fit['r2']:.3f}, {fit['scenes']} scenes)")
+    return {'policy': Context.SCHEDULE_COST, 'unit': 'Mpx', 'fit': fit}
+
+def getToaList(context, catalog=None):
+    """
+    Return the sorted TOA files of the input TOA directory (or the single TOA file).  Directories are
+    streamed with os.scandir; when a writable catalog is in use all input directories are (incrementally)
+    indexed.
+    """
+    if not os.path.isdir(context[Context.DIR_TOA]):
+        return [context[Context.DIR_TOA]]
+
+    if (catalog is not None) and not catalog.readonly:
+        for dir_key, suffix_key in ((Context.DIR_TOA, Context.FN_TOA_SUFFIX),
+                                    (Context.DIR_TARGET, Context.FN_TARGET_SUFFIX),
+                                    (Context.DIR_CLOUDMASK, Context.FN_CLOUDMASK_SUFFIX)):
+            if os.path.isdir(context[dir_key]):
+                count, updated = catalog.scan(context[dir_key], context[suffix_key])
+                print(f'Catalog: {count} files in {context[dir_key]} ({updated} updated)')
+        return catalog.listFiles(context[Context.DIR_TOA], context[Context.FN_TOA_SUFFIX])
+
+    with os.scandir(context[Context.DIR_TOA]) as entries:
+        return sorted(entry.path for entry in entries
+                      if not entry.name.startswith('.') and entry.name.endswith(context[Context.FN_TOA_SUFFIX])
+                      and entry.is_file())
+
+def getSceneWeights(toaList, catalog=None):
+    """
+    Relative cost of each TOA file - pixel count from the catalog, or file size
+    """
+    weights = []
+    for toa_fn in toaList:
+        entry = None if catalog is None else catalog.get(toa_fn)
+        if (entry is not None):
+            weights.append(entry['width'] * entry['height'] * entry['count'])
+        else:
+            weights.append(os.path.getsize(toa_fn))
+    return weights
+
+def getShardList(context, toaList, catalog=None):
+    """
+    Return the TOA files of this task's shard (--shard), balanced across shards by scene weight
+    """
+    index, count = int(context[Context.SHARD_INDEX]), int(context[Context.SHARD_COUNT])
+    if (count <= 1):
+        return toaList
+
+    shardList = ShardPlanner.getShard(toaList, index, count, getSceneWeights(toaList, catalog))
+    print(f'Shard {index} of {count}: {len(shardList)} of {len(toaList)} scenes')
+    return shardList
+
+def writeBatchSummary(context, summaryList, elapsed, schedule=None):
+    """
+    Report per-status counts and save the batch summary as JSON in the output directory
+    """
+    counts = {}
+    warp_cache = {'hit': 0, 'miss': 0}
+    for summary in summaryList:
+        counts[summary['status']] = counts.get(summary['status'], 0) + 1
+        for status in (summary.get('warp_cache') or []):
+            warp_cache[status] += 1
+
+    batch = Context.getBatchName(context)
+    path = os.path.join(context[Context.DIR_OUTPUT], batch + Context.FN_SUMMARY_SUFFIX)
+    with open(path + '.part', 'w') as summaryFile:
+        json.dump({'batch': batch, 'elapsed': elapsed, 'workers': int(context[Context.WORKERS]),
+                   'shard': [int(context[Context.SHARD_INDEX]), int(context[Context.SHARD_COUNT])],
+                   'counts': counts, 'warp_cache': warp_cache, 'schedule': schedule,
+                   'scenes': summaryList}, summaryFile, indent=2)
+    os.replace(path + '.part', path)
+
+    print(f'\nBatch summary: {counts}')
+    if (eval(context[Context.WARP_CACHE_FLAG])):
+        print(f"Warp cache: {warp_cache['hit']} hits, {warp_cache['miss']} misses")
+    for summary in summaryList:
+        if (summary['status'] == 'failed'):
+            print(f"   Failed: {summary['scene']} - {summary['error']}")
+    print(f'Batch summary saved to {path}')
+    return path
 
 def main():
 
@@ -36,68 +457,33 @@ def main():
     # Get handles to plot and raster classes
     plotLib = contextClazz.getPlotLib()
     rasterLib = RasterLib(int(context[Context.DEBUG_LEVEL]), plotLib)
+    rasterLib.openCatalog(context)
+    rasterLib.openManifest(context)
 
     # Retrieve TOA files in sorted order from the input TOA directory and loop through them
-    toa_filter = '*' + context[Context.FN_TOA_SUFFIX]
-    toaList=[context[Context.DIR_TOA]]
-    if os.path.isdir(Path(context[Context.DIR_TOA])):
-        toaList = sorted(Path(context[Context.DIR_TOA]).glob(toa_filter))
-
-    for context[Context.FN_TOA] in toaList:
-        try:
-            # Generate file names based on incoming EVHR file and declared suffixes - get snapshot
-            context = contextClazz.getFileNames(str(context[Context.FN_TOA]).rsplit("/", 1), context)
-
-             # Remove existing SR-Lite output if clean_flag is activated
-            rasterLib.removeFile(context[Context.FN_COG], context[Context.CLEAN_FLAG])
-
-            # Proceed if SR-Lite output does not exist
-            if  not (os.path.exists(context[Context.FN_COG])):
-
-                # Capture input attributes - then align all artifacts to EVHR TOA projection
-                rasterLib.getAttributeSnapshot(context)
-
-                # Define order indices for list processing
-                context[Context.LIST_INDEX_TARGET] = 0
-                context[Context.LIST_INDEX_TOA] = 1
-                context[Context.LIST_INDEX_CLOUDMASK] = -1  # increment if cloudmask requested
-
-                # Validate that input band name pairs exist in EVHR & CCDC files
-                context[Context.FN_LIST] = [str(context[Context.FN_TARGET]), str(context[Context.FN_TOA])]
-                context[Context.LIST_BAND_PAIR_INDICES] = rasterLib.getBandIndices(context)
-
-                 #  Reproject TARGET (CCDC) to attributes of EVHR TOA Downscale  - use 'average' for resampling method
-                context[Context.FN_REPROJECTION_LIST] = [str(context[Context.FN_TARGET]), str(context[Context.FN_TOA])]
-                context[Context.TARGET_FN] = str(context[Context.FN_TOA])
-                context[Context.TARGET_SAMPLING_METHOD] = 'average'
-                context[Context.DS_WARP_LIST], context[Context.MA_WARP_LIST] = rasterLib.getReprojection(context)
-
-                #  Reproject cloudmask to attributes of EVHR TOA Downscale  - use 'mode' for resampling method
-                if (eval(context[Context.CLOUD_MASK_FLAG])):
-                    context[Context.FN_REPROJECTION_LIST] = [str(context[Context.FN_CLOUDMASK])]
-                    context[Context.TARGET_FN] = str(context[Context.FN_TOA])
-                    context[Context.TARGET_SAMPLING_METHOD] = 'mode'
-                    context[Context.DS_WARP_CLOUD_LIST], context[Context.MA_WARP_CLOUD_LIST] = rasterLib.getReprojection(context)
-                    context[Context.LIST_INDEX_CLOUDMASK] = 2
-
-                # Perform regression to capture coefficients from intersected pixels and apply to 2m EVHR
-                context[Context.PRED_LIST], sr_metrics_list= rasterLib.simulateSurfaceReflectance(context)
-
-                # Create COG image from stack of processed bands
-                context[Context.FN_SRC] = str(context[Context.FN_TOA])
-                context[Context.FN_DEST] = str(context[Context.FN_COG])
-                context[Context.FN_COG] = rasterLib.createImage(context)
-
-                # Generate CSV
-                rasterLib.generateCSV(context, sr_metrics_list)
-
-                # Clean up
-                rasterLib.refresh(context)
-
-        except FileNotFoundError as exc:
-            print('File Not Found - Error details: ', exc)
-        except BaseException as err:
-            print('Run abended - Error details: ', err)
+    toaList = getToaList(context, rasterLib.getCatalog())
+    toaList = getShardList(context, toaList, rasterLib.getCatalog())
+    if (eval(context[Context.RESUME_FLAG])):
+        pendingList = rasterLib.getManifest().getPending(toaList, context[Context.PARAMETER_HASH])
+        print(f'Resuming: {len(pendingList)} of {len(toaList)} scenes failed, incomplete or stale '
+              f'{rasterLib.getManifest().getCounts()}')
+        toaList = pendingList
+
+    if (context[Context.QUEUE_DIR] != 'None'):
+        summaryList, batchList, queue = runQueue(contextClazz, rasterLib, context, toaList)
+        if (batchList is None):
+            print(f'{len(summaryList)} scenes processed by this node - the batch summary is written '
+                  f'by the node that drains {queue.queue_dir}')
+        else:
+            writeBatchSummary(context, batchList, time.time() - queue.getCreated())
+    else:
+        schedule = None
+        if (context[Context.SCHEDULE] == Context.SCHEDULE_COST):
+            toaList, costs = getSchedule(contextClazz, rasterLib, context, toaList)
+        summaryList = runBatch(contextClazz, rasterLib, context, toaList)
+        if (context[Context.SCHEDULE] == Context.SCHEDULE_COST):
+            schedule = getScheduleReport(summaryList, costs)
+        writeBatchSummary(context, summaryList, time.time() - start_time, schedule)
 
     print("\nTotal Elapsed Time for " + str(context[Context.DIR_OUTPUT])  + ': ',
            (time.time() - start_time) / 60.0)  # time in min